@@ -24,6 +24,16 @@ login_manager.login_view = 'login'
 
 logger.debug("LoginManager initialized")
 
+def start_ga_tasks(accounts):
+    # Pre-fetch the standard report data of every account off-peak (only
+    # with GA_WARMUP_ENABLED) and register `flask ga-backfill` and `flask ga-export`
+    from app import ga_backfill, ga_export, ga_warmup
+    if ga_warmup.WARMUP_ENABLED:
+        ga_warmup.start_warmup_scheduler(accounts)
+    app.cli.add_command(ga_backfill.backfill_command)
+    app.cli.add_command(ga_export.export_command)
+    logger.debug("GA tasks set up")
+
 try:
     from app.models import User, users
 
@@ -40,6 +50,8 @@ try:
     # Import routes
     from app import routes
     logger.debug("Routes imported")
+
+    start_ga_tasks(routes.accounts)
 except Exception as e:
     logger.error(f"Error during app initialization: {str(e)}", exc_info=True)
 
@@ -0,0 +1,311 @@
+from google.analytics.data_v1beta.types import (BatchRunReportsResponse, CheckCompatibilityResponse, Metadata,
+                                                RunReportResponse)
+from google.api_core import exceptions as api_exceptions
+from app.ga_cache import CACHE_PATH
+from collections import deque
+import asyncio
+import base64
+import fcntl
+import gzip
+import hashlib
+import httpx
+import json
+import os
+import re
+import threading
+import time
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# record: every GA call and OpenAI HTTP request is written to the cassette
+# with its response and duration. replay: they are answered from the cassette
+# instead, waiting the recorded durations times CASSETTE_TIME_SCALE (0 answers
+# at once). Answers the report cache or daily store give locally are not
+# recorded, so record with them in the state they will be replayed in
+CASSETTE_MODE = os.environ.get('CASSETTE_MODE', 'off').lower()
+if CASSETTE_MODE not in ('off', 'record', 'replay'):
+    logger.warning(f"Unknown CASSETTE_MODE {CASSETTE_MODE}, cassettes are off")
+    CASSETTE_MODE = 'off'
+# Gzipped JSON lines, one gzip member per call so worker processes can append
+CASSETTE_PATH = os.environ.get('CASSETTE_PATH') or os.path.join(os.path.dirname(CACHE_PATH), 'cassettes',
+                                                                 'cassette.jsonl.gz')
+TIME_SCALE = float(os.environ.get('CASSETTE_TIME_SCALE', 1))
+
+GA_RESPONSE_TYPES = {'run_report': RunReportResponse, 'batch_run_reports': BatchRunReportsResponse,
+                     'get_metadata': Metadata, 'check_compatibility': CheckCompatibilityResponse}
+# OpenAI object ids differ between runs of the same workload
+OPENAI_ID = re.compile(r'\b(?:thread|msg|run|step)_[A-Za-z0-9]+')
+OPENAI_HEADERS = ('content-type', 'openai-poll-after-ms', 'retry-after-ms', 'retry-after')
+# Headers the OpenAI SDK sleeps on
+OPENAI_DELAY_HEADERS = ('openai-poll-after-ms', 'retry-after-ms', 'retry-after')
+
+class CassetteMiss(LookupError):
+    # Replay was asked for a call the cassette has no recording of
+    pass
+
+def digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def ga_key(method, request):
+    # Same key for the same request, whatever the quota flag
+    message = type(request).pb(request)
+    copy = type(message)()
+    copy.CopyFrom(message)
+    for report_request in [copy, *getattr(copy, 'requests', [])]:
+        if 'return_property_quota' in report_request.DESCRIPTOR.fields_by_name:
+            report_request.ClearField('return_property_quota')
+    return hashlib.sha256(method.encode('utf-8') + b'|' + copy.SerializeToString(deterministic=True)).hexdigest()
+
+def openai_request_text(request):
+    return f"{request.method} {request.url.raw_path.decode('ascii')}\n{request.content.decode('utf-8', 'replace')}"
+
+def openai_loose_key(text):
+    return digest(OPENAI_ID.sub('*', text))
+
+class Cassette:
+    def __init__(self, path=CASSETTE_PATH, mode=CASSETTE_MODE):
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        # (kind, key): recorded entries in order
+        self._entries = {}
+        # Replayed OpenAI id: the recorded id it stands for
+        self._aliases = {}
+        self._reports = []
+        if mode == 'replay':
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+    def _load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as cassette_file:
+            for line in cassette_file:
+                entry = json.loads(line)
+                if entry["kind"] == 'report':
+                    self._reports.append(entry)
+                    continue
+                self._entries.setdefault((entry["kind"], entry["key"]), deque()).append(entry)
+                if entry["kind"] == 'openai':
+                    self._entries.setdefault(('openai-loose', entry["loose"]), deque()).append(entry)
+        logger.info(f"Loaded cassette {self.path}: {sum(map(len, self._entries.values()))} calls, "
+                    f"{len(self._reports)} reports")
+
+    def _write(self, entry):
+        data = gzip.compress((json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8'))
+        with self._lock, open(self.path, 'ab') as cassette_file:
+            fcntl.flock(cassette_file, fcntl.LOCK_EX)
+            cassette_file.write(data)
+
+    def _take(self, kind, key):
+        # Entries are served in recorded order (a retried call replays its
+        # failures first); the last one keeps being served, e.g. for extra polls
+        queue = self._entries.get((kind, key))
+        while queue and len(queue) > 1 and queue[0].get('used'):
+            queue.popleft()
+        if not queue:
+            return None
+        entry = queue.popleft() if len(queue) > 1 else queue[0]
+        entry['used'] = True
+        return entry
+
+    def reports(self):
+        return list(self._reports)
+
+    def record_report(self, report, property_id, start_date, end_date):
+        self._write({"kind": "report", "report": report, "property_id": str(property_id),
+                     "start_date": start_date.strftime('%Y-%m-%d'), "end_date": end_date.strftime('%Y-%m-%d'),
+                     "at": time.time()})
+
+    def record_ga(self, method, request, started, response=None, error=None):
+        entry = {"kind": "ga", "key": ga_key(method, request), "method": method,
+                 "seconds": round(time.perf_counter() - started, 4)}
+        if error is not None:
+            entry["error"] = {"type": type(error).__name__, "message": getattr(error, 'message', None) or str(error)}
+        else:
+            entry["response"] = base64.b64encode(type(response).serialize(response)).decode('ascii')
+        self._write(entry)
+
+    def find_ga(self, method, request):
+        key = ga_key(method, request)
+        with self._lock:
+            entry = self._take('ga', key)
+        if entry is None:
+            raise CassetteMiss(f"No recorded {method} response for request {key[:12]}")
+        return entry
+
+    def ga_result(self, method, entry):
+        if "error" in entry:
+            error_class = getattr(api_exceptions, entry["error"]["type"], api_exceptions.GoogleAPICallError)
+            raise error_class(entry["error"]["message"])
+        return GA_RESPONSE_TYPES[method].deserialize(base64.b64decode(entry["response"]))
+
+    def record_openai(self, request, response, seconds):
+        text = openai_request_text(request)
+        self._write({"kind": "openai", "key": digest(text), "loose": openai_loose_key(text),
+                     "ids": OPENAI_ID.findall(text), "status": response.status_code,
+                     "headers": {name: response.headers[name] for name in OPENAI_HEADERS if name in response.headers},
+                     "body": response.text, "seconds": round(seconds, 4)})
+
+    def find_openai(self, request):
+        with self._lock:
+            text = OPENAI_ID.sub(lambda match: self._aliases.get(match.group(0), match.group(0)),
+                                 openai_request_text(request))
+            entry = self._take('openai', digest(text))
+            if entry is None:
+                # Replayed objects can come back in a different order than
+                # recorded (e.g. which thread a report got); match without ids
+                # and keep using the recorded ids from here on
+                entry = self._take('openai-loose', openai_loose_key(text))
+                if entry is None:
+                    raise CassetteMiss(f"No recorded response for {text.splitlines()[0]}")
+                for replayed, recorded in zip(OPENAI_ID.findall(text), entry["ids"]):
+                    if replayed != recorded:
+                        self._aliases[replayed] = recorded
+        return entry
+
+class RecordingGAClient:
+    # Passes calls through to a real GA client (sync or async) and records them
+    def __init__(self, client, cassette):
+        self._client = client
+        self._cassette = cassette
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+        if name not in GA_RESPONSE_TYPES:
+            return method
+        cassette = self._cassette
+        if asyncio.iscoroutinefunction(method):
+            async def record_async(request, **kwargs):
+                started = time.perf_counter()
+                try:
+                    response = await method(request, **kwargs)
+                except Exception as e:
+                    cassette.record_ga(name, request, started, error=e)
+                    raise
+                cassette.record_ga(name, request, started, response=response)
+                return response
+            return record_async
+
+        def record(request, **kwargs):
+            started = time.perf_counter()
+            try:
+                response = method(request, **kwargs)
+            except Exception as e:
+                cassette.record_ga(name, request, started, error=e)
+                raise
+            cassette.record_ga(name, request, started, response=response)
+            return response
+        return record
+
+class ReplayGAClient:
+    # Answers GA calls from the cassette; also its own transport for ClientPool.close
+    def __init__(self, cassette):
+        self._cassette = cassette
+        self.transport = self
+
+    def __getattr__(self, name):
+        if name not in GA_RESPONSE_TYPES:
+            raise AttributeError(name)
+
+        def replay(request, **kwargs):
+            entry = self._cassette.find_ga(name, request)
+            time.sleep(entry["seconds"] * TIME_SCALE)
+            return self._cassette.ga_result(name, entry)
+        return replay
+
+    def close(self):
+        pass
+
+class AsyncReplayGAClient(ReplayGAClient):
+    def __getattr__(self, name):
+        if name not in GA_RESPONSE_TYPES:
+            raise AttributeError(name)
+
+        async def replay(request, **kwargs):
+            entry = self._cassette.find_ga(name, request)
+            await asyncio.sleep(entry["seconds"] * TIME_SCALE)
+            return self._cassette.ga_result(name, entry)
+        return replay
+
+    async def close(self):
+        pass
+
+class RecordingTransport(httpx.BaseTransport):
+    def __init__(self, cassette, transport=None):
+        self._cassette = cassette
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request):
+        started = time.perf_counter()
+        response = self._transport.handle_request(request)
+        # Streamed responses are recorded whole
+        response.read()
+        self._cassette.record_openai(request, response, time.perf_counter() - started)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+class ReplayTransport(httpx.BaseTransport):
+    def __init__(self, cassette):
+        self._cassette = cassette
+
+    def handle_request(self, request):
+        entry = self._cassette.find_openai(request)
+        time.sleep(entry["seconds"] * TIME_SCALE)
+        headers = dict(entry["headers"])
+        for name in OPENAI_DELAY_HEADERS:
+            # The SDK's own polling and retry waits scale with the replay
+            try:
+                delay = float(headers[name]) * TIME_SCALE
+            except (KeyError, ValueError):
+                continue
+            if name.startswith('retry-after'):
+                # The SDK ignores a retry-after of 0 and backs off on its own instead
+                delay = max(delay, 1 if name.endswith('-ms') else 0.001)
+            headers[name] = str(int(delay)) if name.endswith('-ms') else str(delay)
+        return httpx.Response(entry["status"], headers=headers, content=entry["body"].encode('utf-8'),
+                              request=request)
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+def get_cassette():
+    global _cassette
+    if CASSETTE_MODE == 'off':
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette()
+            logger.info(f"Cassette {CASSETTE_MODE} mode with {_cassette.path}")
+        return _cassette
+
+def wrap_ga_client(client):
+    # The client itself unless recording
+    cassette = get_cassette()
+    if cassette is None or cassette.mode != 'record':
+        return client
+    return RecordingGAClient(client, cassette)
+
+def replay_ga_client(asynchronous=False):
+    cassette = get_cassette()
+    return AsyncReplayGAClient(cassette) if asynchronous else ReplayGAClient(cassette)
+
+def openai_client_options():
+    # Extra OpenAI() arguments for the cassette mode
+    from openai import DefaultHttpxClient
+    cassette = get_cassette()
+    if cassette is None:
+        return {}
+    if cassette.mode == 'record':
+        return {"http_client": DefaultHttpxClient(transport=RecordingTransport(cassette))}
+    return {"http_client": DefaultHttpxClient(transport=ReplayTransport(cassette)),
+            "api_key": os.environ.get('OPENAI_API_KEY') or 'replay'}
+
+def record_report(report, property_id, start_date, end_date):
+    cassette = get_cassette()
+    if cassette is not None and cassette.mode == 'record':
+        cassette.record_report(report, property_id, start_date, end_date)
@@ -1,199 +1,393 @@
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
+from google.analytics.data_v1beta.types import BatchRunReportsRequest, DateRange, OrderBy
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from app.ga_cache import get_report_cache
+from app.ga_client import TRANSPORT, get_client_pool, run_coroutine
+from app.ga_errors import GAReportError, wrap_error
+from app.ga_metadata import validate_reports
+from app.ga_retry import run_ga_call, run_ga_call_async
+from app.ga_result import ReportResult
+from app.ga_planner import PLANNER_ENABLED, get_plan, get_planned_request, other_row
+from app.report_specs import TOP_N, get_report_specs, parse_metric_value, raw_response
+import asyncio
+import os
+import weakref
+import logging
 
-def fetch_data(property_id, start_date, end_date):
-    client = BetaAnalyticsDataClient()
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# GA4 accepts at most 5 RunReportRequests per BatchRunReportsRequest
+MAX_BATCH_SIZE = 5
+# and at most 4 DateRanges per RunReportRequest
+MAX_DATE_RANGES = 4
+# Rows per page when streaming a full report (GA allows up to 250000)
+EXPORT_PAGE_SIZE = int(os.environ.get('GA_EXPORT_PAGE_SIZE', 10000))
+# GA RPCs in flight per event loop on the async path
+MAX_ASYNC_CONCURRENCY = int(os.environ.get('GA_ASYNC_MAX_CONCURRENCY', 64))
+# Serve reports from the day-granular GA store instead of per-range requests
+USE_DAILY_STORE = os.environ.get('GA_USE_DAILY_STORE', 'false').lower() in ('1', 'true', 'yes')
+
+_async_semaphores = weakref.WeakKeyDictionary()
+
+def get_fetcher():
+    # fetch_periods or its drop-in backed by the daily store (which imports this module)
+    if not USE_DAILY_STORE:
+        return fetch_periods
+    from app.ga_store import fetch_periods_from_store
+    return fetch_periods_from_store
+
+def fetch_data(property_id, start_date, end_date, batched=True, report_names=None):
+    return fetch_periods(property_id, [("current", start_date, end_date)], batched=batched,
+                         report_names=report_names)["current"]
+
+def fetch_periods(property_id, periods, batched=True, report_names=None):
+    # periods is a list of (name, start_date, end_date); all periods of a report
+    # are requested together as named DateRanges and split back out per period.
+    # report_names restricts the fetch to some of the registered report specs
+    if TRANSPORT == 'grpc_asyncio':
+        return run_coroutine(fetch_periods_async(property_id, periods, batched, report_names))
     # Convert datetime objects to string in YYYY-MM-DD format
-    start_date_str = start_date.strftime('%Y-%m-%d')
-    end_date_str = end_date.strftime('%Y-%m-%d')
-    
-    reports = {
-        "overall": run_report_overall,
-        "browser": run_report_browser,
-        "city": run_report_city,
-        "page_url": run_report_upage_url,
-        "user_source": run_report_user_source,
-        "events": run_report_ereignisse,
-        "conversion_origin": run_report_conversion_herkunft,
-        "devices": run_report_geräte
-    }
-    
-    data = {}
-    with ThreadPoolExecutor(max_workers=len(reports)) as executor:
-        future_to_report = {executor.submit(report_func, client, property_id, start_date_str, end_date_str): report_name 
-                            for report_name, report_func in reports.items()}
-        for future in as_completed(future_to_report):
-            report_name = future_to_report[future]
-            try:
-                data[report_name] = future.result()
-            except Exception as e:
-                raise Exception(f"Error in {report_name} report: {str(e)}")
-    
-    return {
-        "Zeitraum": {"Anfang": start_date_str, "Ende": end_date_str},
-        "Kennzahlen": data.get("overall", {}),
-        "Zielgruppe": {"Browser": data.get("browser", {}), "Geräte": data.get("devices", {})},
-        "Besucher Quellen": data.get("user_source", {}),
-        "Top Städte": data.get("city", {}),
-        "Conversions und Ereignisse": data.get("events", {}),
-        "Herkunft der Conversions ": data.get("conversion_origin", {}),
-        "Top Seiten": data.get("page_url", {})
-    }
-
-def run_report_overall(client, property_id, start_date, end_date):
-    try:
-        request = RunReportRequest(
-            property=f"properties/{property_id}",
-            metrics=[
-                Metric(name="newUsers"),
-                Metric(name="totalUsers"),
-                Metric(name="sessions"),
-                Metric(name="screenPageViews"),
-                Metric(name="engagementRate"),
-                Metric(name="screenPageViewsPerUser"),
-                Metric(name="userEngagementDuration")
-            ],
-            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        )
-        response = client.run_report(request)
-        return format_response(response)
-    except Exception as e:
-        raise Exception(f"Error in run_report_overall: {str(e)}")
+    period_dates = {name: (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+                    for name, start_date, end_date in periods}
+    date_ranges = [DateRange(start_date=start_date_str, end_date=end_date_str, name=name)
+                   for name, (start_date_str, end_date_str) in period_dates.items()]
 
-def run_report_browser(client, property_id, start_date, end_date):
-    try:
-        request = RunReportRequest(
-            property=f"properties/{property_id}",
-            dimensions=[Dimension(name="browser")],
-            metrics=[
-                Metric(name="newUsers"),
-                Metric(name="totalUsers"),
-                Metric(name="conversions"),
-                Metric(name="engagementRate"),
-                Metric(name="userEngagementDuration")
-            ],
-            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        )
-        response = client.run_report(request)
-        return format_response(response)
-    except Exception as e:
-        raise Exception(f"Error in run_report_browser: {str(e)}")
+    data = {name: {} for name in period_dates}
+    with get_client_pool().client() as client:
+        planned = validate_plan(client, property_id, report_names)
+        for i in range(0, len(date_ranges), MAX_DATE_RANGES):
+            chunk = date_ranges[i:i + MAX_DATE_RANGES]
+            for report_name, report_data in run_reports(client, property_id, chunk, report_names, batched,
+                                                        planned).items():
+                for name, period_data in report_data.items():
+                    data[name][report_name] = period_data
 
-def run_report_city(client, property_id, start_date, end_date):
-    try:
-        request = RunReportRequest(
-            property=f"properties/{property_id}",
-            dimensions=[Dimension(name="city")],
-            metrics=[
-                Metric(name="newUsers"),
-                Metric(name="totalUsers"),
-                Metric(name="sessions"),
-                Metric(name="engagementRate"),
-                Metric(name="userEngagementDuration"),
-                Metric(name="eventCountPerUser")
-            ],
-            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        )
-        response = client.run_report(request)
-        return format_response(response)
-    except Exception as e:
-        raise Exception(f"Error in run_report_city: {str(e)}")
+    return {name: build_sections(start_date_str, end_date_str, data[name])
+            for name, (start_date_str, end_date_str) in period_dates.items()}
 
-def run_report_upage_url(client, property_id, start_date, end_date):
-    try:
-        if not isinstance(property_id, str):
-            property_id = str(property_id)
-        
-        request = RunReportRequest(
-            property=f"properties/{property_id}",
-            dimensions=[Dimension(name="fullPageUrl")],
-            metrics=[
-                Metric(name="newUsers"),
-                Metric(name="totalUsers"),
-                Metric(name="screenPageViews"),
-                Metric(name="userEngagementDuration")
-            ],
-            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        )
-        response = client.run_report(request)
-        return format_response(response)
-    except Exception as e:
-        raise Exception(f"Error in run_report_upage_url: {str(e)}, Types: property_id: {type(property_id)}, start_date: {type(start_date)}, end_date: {type(end_date)}")
+def stream_report(property_id, report_name, start_date, end_date, page_size=EXPORT_PAGE_SIZE, columnar=False):
+    # Yields every row of a report, not just the top rows, one page at a time
+    # in format_response's shape (or as a ReportResult with columnar=True), so
+    # memory stays bounded by the page size. The spec's row limit and totals
+    # are dropped
+    spec = get_report_specs()[report_name]
+    validate_report_specs(property_id, [report_name])
+    request = spec.build_request(property_id, [DateRange(start_date=start_date.strftime('%Y-%m-%d'),
+                                                         end_date=end_date.strftime('%Y-%m-%d'))])
+    del request.metric_aggregations[:]
+    request.limit = page_size
+    # Pages are read by offset, which is only stable under a total order: rows
+    # tying on the spec's metric are ordered by their dimensions
+    request.order_bys.extend(OrderBy(dimension=OrderBy.DimensionOrderBy(dimension_name=name))
+                             for name in spec.dimensions)
 
+    while True:
+        try:
+            with get_client_pool().client() as client:
+                response = run_ga_call(client.run_report, request, f"{report_name} export")
+        except Exception as e:
+            raise wrap_error(e, f"{report_name} export at offset {request.offset}", report_name)
+        page = ReportResult.from_response(response) if columnar else format_response(response, limit=None)
+        page_rows = len(response.rows)
+        row_count = response.row_count
+        # Don't keep the proto rows alive while the caller works on the page
+        del response
+        if page_rows:
+            yield page
+        request.offset += page_rows
+        if not page_rows or request.offset >= row_count:
+            break
 
-def run_report_user_source(client, property_id, start_date, end_date):
+async def fetch_periods_async(property_id, periods, batched=False, report_names=None):
+    # Same result as fetch_periods, but every planned request (or batch) of
+    # every DateRange chunk runs as one task on the event loop
+    client = get_client_pool().async_client()
+    period_dates = {name: (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+                    for name, start_date, end_date in periods}
+    date_ranges = [DateRange(start_date=start_date_str, end_date=end_date_str, name=name)
+                   for name, (start_date_str, end_date_str) in period_dates.items()]
+
+    chunks = [date_ranges[i:i + MAX_DATE_RANGES] for i in range(0, len(date_ranges), MAX_DATE_RANGES)]
+    # Metadata lookups are cached and use the sync client
+    planned = await asyncio.to_thread(validate_report_plan, property_id, report_names)
+    data = await run_reports_async(client, property_id, chunks, report_names, batched, planned)
+
+    by_period = {name: {} for name in period_dates}
+    for report_name, report_data in data.items():
+        for name, period_data in report_data.items():
+            by_period[name][report_name] = period_data
+    return {name: build_sections(start_date_str, end_date_str, by_period[name])
+            for name, (start_date_str, end_date_str) in period_dates.items()}
+
+async def run_reports_async(client, property_id, chunks, report_names=None, batched=False, planned=PLANNER_ENABLED):
+    plan = get_plan(report_names, planned)
+    requests = {}
+    for i, chunk in enumerate(chunks):
+        for plan_name, request in build_planned_requests(plan, property_id, chunk).items():
+            requests[(plan_name, i)] = request
+
+    # Only the cache misses go to GA. The cache's SQLite calls run in a worker
+    # thread, as they can wait on other workers' writes
+    cache = get_report_cache()
+    if cache is None:
+        results = await fetch_requests_async(client, property_id, requests, batched)
+    else:
+        results, missing = await asyncio.to_thread(cache.split_all, requests)
+        if missing:
+            async with cache.guard_async(missing.values()):
+                # Another caller may have filled the cache while we were waiting
+                results, missing = await asyncio.to_thread(cache.split_all, requests)
+                if missing:
+                    fetched = await fetch_requests_async(client, property_id, missing, batched)
+                    await asyncio.to_thread(cache.store_many, missing, fetched)
+                    for key in missing:
+                        results[key].update(fetched[key])
+
+    date_ranges = [date_range for chunk in chunks for date_range in chunk]
+    data, incomplete = collect_reports(results.values(), planned_report_names(plan),
+                                       [date_range.name for date_range in date_ranges])
+    if incomplete and (planned or len(date_ranges) > 1):
+        # Reports the planned requests could not answer are fetched on their
+        # own, one period per request so no other period's rows crowd them out
+        refetches = [run_reports_async(client, property_id, [[date_range]], sorted(incomplete[date_range.name]),
+                                       batched, planned=False)
+                     for date_range in date_ranges if date_range.name in incomplete]
+        for fetched in await asyncio.gather(*refetches):
+            merge_reports(data, fetched)
+    return data
+
+async def fetch_requests_async(client, property_id, requests, batched):
+    # {(plan name, chunk): {period_name: {report_name: data}}} for the requests
+    if batched:
+        keys = list(requests)
+        groups = [keys[i:i + MAX_BATCH_SIZE] for i in range(0, len(keys), MAX_BATCH_SIZE)]
+        coroutines = [run_batch_async(client, property_id, [requests[key] for key in group],
+                                      "+".join(plan_name for plan_name, _ in group))
+                      for group in groups]
+    else:
+        groups = [[key] for key in requests]
+        coroutines = [run_report_async(client, plan_name, request) for (plan_name, _), request in requests.items()]
+
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
     try:
-        request = RunReportRequest(
-            property=f"properties/{property_id}",
-            dimensions=[Dimension(name="firstUserSource"), Dimension(name="firstUserMedium")],
-            metrics=[
-                Metric(name="totalUsers"),
-                Metric(name="newUsers"),
-                Metric(name="sessions"),
-                Metric(name="userEngagementDuration"),
-                Metric(name="engagementRate"),
-                Metric(name="conversions")
-            ],
-            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        )
-        response = client.run_report(request)
-        return format_response(response)
-    except Exception as e:
-        raise Exception(f"Error in run_report_user_source: {str(e)}")
+        responses = await asyncio.gather(*tasks)
+    except BaseException:
+        # Don't leave sibling RPCs running when one fails or the caller is cancelled
+        for task in tasks:
+            task.cancel()
+        raise
+
+    results = {}
+    for group, group_responses in zip(groups, responses):
+        for key, response in zip(group, group_responses):
+            results[key] = split_response(key[0], requests[key], response)
+    return results
+
+def get_async_semaphore():
+    # One semaphore per event loop caps the GA RPCs in flight from this worker
+    loop = asyncio.get_running_loop()
+    semaphore = _async_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _async_semaphores[loop] = asyncio.Semaphore(MAX_ASYNC_CONCURRENCY)
+    return semaphore
+
+async def run_report_async(client, plan_name, request):
+    async with get_async_semaphore():
+        try:
+            return [await run_ga_call_async(client.run_report, request, plan_name)]
+        except Exception as e:
+            raise wrap_error(e, f"{plan_name} report", plan_name)
+
+async def run_batch_async(client, property_id, requests, key):
+    async with get_async_semaphore():
+        try:
+            request = BatchRunReportsRequest(
+                property=f"properties/{property_id}",
+                requests=requests,
+            )
+            response = await run_ga_call_async(client.batch_run_reports, request, key)
+            return list(response.reports)
+        except Exception as e:
+            raise wrap_error(e, "run_batch_async")
+
+def build_sections(start_date_str, end_date_str, data):
+    # Nest every report under its spec's section path, in registry order
+    sections = {"Zeitraum": {"Anfang": start_date_str, "Ende": end_date_str}}
+    for spec in get_report_specs().values():
+        parent = sections
+        for key in spec.section[:-1]:
+            parent = parent.setdefault(key, {})
+        parent[spec.section[-1]] = data.get(spec.name, {})
+    return sections
+
+def selected_specs(report_names=None):
+    specs = get_report_specs()
+    return [specs[report_name] for report_name in (report_names or specs)]
 
-def run_report_ereignisse(client, property_id, start_date, end_date):
+def validate_report_specs(property_id, report_names=None):
+    with get_client_pool().client() as client:
+        validate_reports(client, property_id, selected_specs(report_names))
+
+def validate_plan(client, property_id, report_names=None):
+    # Validates the specs, then the planned requests that merge or roll them
+    # up: GA can reject fields together that each spec uses fine on its own
+    # (custom dimensions differ per property). Returns whether the plan can
+    # be used; if not, the property's reports are fetched one request per spec
+    validate_reports(client, property_id, selected_specs(report_names))
+    if not PLANNER_ENABLED:
+        return False
+    plan = get_plan(report_names)
     try:
-        request = RunReportRequest(
-            property=f"properties/{property_id}",
-            dimensions=[Dimension(name="eventName")],
-            metrics=[
-                Metric(name="conversions")
-            ],
-            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        )
-        response = client.run_report(request)
-        return format_response(response)
-    except Exception as e:
-        raise Exception(f"Error in run_report_ereignisse: {str(e)}")
+        validate_reports(client, property_id, [planned_request.host for planned_request in plan
+                                                if len(planned_report_names([planned_request])) > 1])
+    except GAReportError as e:
+        logger.warning(f"GA query plan rejected for property {property_id}, fetching reports unplanned: {str(e)}")
+        return False
+    return True
+
+def validate_report_plan(property_id, report_names=None):
+    with get_client_pool().client() as client:
+        return validate_plan(client, property_id, report_names)
+
+def build_requests(property_id, date_ranges, report_names=None):
+    # One request per report spec, without planning
+    specs = get_report_specs()
+    return {report_name: specs[report_name].build_request(property_id, date_ranges)
+            for report_name in (report_names or specs)}
+
+def report_limit(report_name):
+    # Rows kept per period; specs without a limit keep everything GA returns
+    spec = get_report_specs().get(report_name)
+    return spec.limit if spec is not None else TOP_N
+
+def build_planned_requests(plan, property_id, date_ranges):
+    return {planned_request.name: planned_request.build_request(property_id, date_ranges)
+            for planned_request in plan}
 
-def run_report_conversion_herkunft(client, property_id, start_date, end_date):
+def split_response(plan_name, request, response):
+    # {period_name: {report_name: data}} for one planned request
+    period_names = [date_range.name for date_range in request.date_ranges]
     try:
-        request = RunReportRequest(
-            property=f"properties/{property_id}",
-            dimensions=[Dimension(name="eventName"), Dimension(name="city")],
-            metrics=[
-                Metric(name="conversions")
-            ],
-            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        )
-        response = client.run_report(request)
-        return format_response(response)
+        return get_planned_request(plan_name).split(response, period_names)
     except Exception as e:
-        raise Exception(f"Error in run_report_conversion_herkunft: {str(e)}")
+        raise wrap_error(e, f"split_response for {plan_name}", plan_name)
+
+def collect_reports(results, report_names, period_names):
+    # Flattens per-request results into {report_name: {period_name: data}} and
+    # returns {period_name: report names} that could not be derived from their
+    # host request (truncated rollups, periods crowded out by another period's
+    # rows, or cache entries written under a different plan)
+    data = {}
+    for result in results:
+        for period_name, reports in result.items():
+            for report_name, report_data in reports.items():
+                if report_data is not None:
+                    data.setdefault(report_name, {})[period_name] = report_data
+    incomplete = {}
+    for report_name in report_names:
+        for period_name in period_names:
+            if period_name not in data.get(report_name, {}):
+                incomplete.setdefault(period_name, set()).add(report_name)
+    return data, incomplete
+
+def merge_reports(data, fetched):
+    for report_name, report_data in fetched.items():
+        data.setdefault(report_name, {}).update(report_data)
+
+def planned_report_names(plan):
+    return [spec.name for planned_request in plan
+            for spec in planned_request.members + planned_request.rollups + planned_request.totals]
+
+def run_reports(client, property_id, date_ranges, report_names=None, batched=True, planned=PLANNER_ENABLED):
+    plan = get_plan(report_names, planned)
+    requests = build_planned_requests(plan, property_id, date_ranges)
+    if batched:
+        results = run_reports_batched(client, property_id, requests)
+    else:
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(requests) or 1) as executor:
+            future_to_report = {executor.submit(run_request_cached, client, plan_name, request): plan_name
+                                for plan_name, request in requests.items()}
+            for future in as_completed(future_to_report):
+                plan_name = future_to_report[future]
+                try:
+                    results[plan_name] = future.result()
+                except Exception as e:
+                    raise wrap_error(e, f"{plan_name} report", plan_name)
+
+    data, incomplete = collect_reports(results.values(), planned_report_names(plan),
+                                       [date_range.name for date_range in date_ranges])
+    if incomplete and (planned or len(date_ranges) > 1):
+        # Reports the planned requests could not answer are fetched on their
+        # own, one period per request so no other period's rows crowd them out
+        for date_range in date_ranges:
+            if date_range.name in incomplete:
+                merge_reports(data, run_reports(client, property_id, [date_range],
+                                                sorted(incomplete[date_range.name]), batched, planned=False))
+    return data
 
-def run_report_geräte(client, property_id, start_date, end_date):
+def run_reports_batched(client, property_id, requests):
+    cache = get_report_cache()
+    if cache is None:
+        return run_batches(client, property_id, requests)
+    return cache.fetch_many(requests, lambda missing: run_batches(client, property_id, missing))
+
+def run_batches(client, property_id, requests):
+    # Pack the requests into as few BatchRunReports calls as possible and
+    # map the responses back to their plan names (responses keep request order)
+    plan_names = list(requests)
+    batches = [plan_names[i:i + MAX_BATCH_SIZE] for i in range(0, len(plan_names), MAX_BATCH_SIZE)]
+
+    data = {}
+    with ThreadPoolExecutor(max_workers=len(batches) or 1) as executor:
+        future_to_batch = {executor.submit(run_batch, client, property_id, [requests[name] for name in batch],
+                                           "+".join(batch)): batch
+                           for batch in batches}
+        for future in as_completed(future_to_batch):
+            batch = future_to_batch[future]
+            try:
+                responses = future.result()
+            except Exception as e:
+                raise wrap_error(e, f"batch {', '.join(batch)}")
+            for plan_name, response in zip(batch, responses):
+                data[plan_name] = split_response(plan_name, requests[plan_name], response)
+    return data
+
+def run_batch(client, property_id, requests, key):
     try:
-        request = RunReportRequest(
+        request = BatchRunReportsRequest(
             property=f"properties/{property_id}",
-            dimensions=[Dimension(name="deviceCategory")],
-            metrics=[
-                Metric(name="totalUsers")
-            ],
-            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
+            requests=requests,
         )
-        response = client.run_report(request)
-        return format_response(response)
+        response = run_ga_call(client.batch_run_reports, request, key)
+        return list(response.reports)
     except Exception as e:
-        raise Exception(f"Error in run_report_geräte: {str(e)}")
+        raise wrap_error(e, "run_batch")
+
+def run_request(client, plan_name, request):
+    response = run_ga_call(client.run_report, request, plan_name)
+    return split_response(plan_name, request, response)
+
+def run_request_cached(client, plan_name, request):
+    cache = get_report_cache()
+    if cache is None:
+        return run_request(client, plan_name, request)
+    return cache.fetch(request, lambda missing_request: run_request(client, plan_name, missing_request))
 
-def format_response(response):
+def format_response(response, limit=TOP_N):
+    # response may be a proto-plus RunReportResponse, its raw protobuf or serialized bytes
     try:
-        return {
-            "metricHeaders": [header.name for header in response.metric_headers],
-            "rows": [{"dimensionValues": [str(value.value) for value in row.dimension_values], 
-                      "metricValues": [str(value.value) for value in row.metric_values]} 
-                     for row in response.rows[:10]]  # Limit to top 10 rows
-        }
+        response = raw_response(response)
+        metric_headers = [header.name for header in response.metric_headers]
+        rows = [{"dimensionValues": [value.value for value in row.dimension_values],
+                 "metricValues": [value.value for value in row.metric_values]}
+                for row in response.rows[:limit]]  # Limit to top 10 rows by default
+        if response.totals and response.row_count > len(rows):
+            total_values = [parse_metric_value(value.value) for value in response.totals[0].metric_values]
+            shown_values = [sum(parse_metric_value(row["metricValues"][i]) for row in rows)
+                            for i in range(len(metric_headers))]
+            rows.append(other_row(metric_headers, len(response.dimension_headers), total_values, shown_values))
+        return {"metricHeaders": metric_headers, "rows": rows}
     except Exception as e:
-        raise Exception(f"Error in format_response: {str(e)}")
\ No newline at end of file
+        raise wrap_error(e, "format_response")
@@ -0,0 +1,106 @@
+from app.data_fetcher import build_requests
+from app.ga_client import get_client_pool
+from app.ga_store import answers_from_store, contiguous_runs, get_daily_store
+from app.routes import accounts
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+from flask.cli import with_appcontext
+import calendar
+import click
+import os
+import time
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+MAX_BACKFILL_MONTHS = 24
+# Days per GA request; smaller chunks mean finer checkpoints and more parallelism
+CHUNK_DAYS = int(os.environ.get('GA_BACKFILL_CHUNK_DAYS', 31))
+# Chunks fetched at once; the quota limiter still paces each property
+BACKFILL_WORKERS = int(os.environ.get('GA_BACKFILL_WORKERS', 4))
+
+def backfill_range(months, today=None):
+    # Up to yesterday, going back the given number of months from it (the
+    # same day of the month, clamped to the month's length, plus one day)
+    end_day = (today or date.today()) - timedelta(days=1)
+    months = min(months, MAX_BACKFILL_MONTHS)
+    if not months:
+        return end_day, end_day
+    year, month = divmod(end_day.year * 12 + end_day.month - 1 - months, 12)
+    month += 1
+    start_day = date(year, month, min(end_day.day, calendar.monthrange(year, month)[1])) + timedelta(days=1)
+    return start_day, end_day
+
+def plan_chunks(store, property_id, start_day, end_day, report_names=None):
+    # (report name, daily request, spec key, first day, last day) for every
+    # missing stretch of days; days already in the store are the checkpoint,
+    # so an interrupted backfill resumes where it stopped
+    chunks = []
+    for report_name, request in build_requests(property_id, [], report_names).items():
+        if not answers_from_store(request):
+            # Reports the store can't answer are always fetched directly
+            continue
+        daily_request = store.daily_request(request)
+        spec = store.spec_key(daily_request)
+        for run_start, run_end in contiguous_runs(store.missing_days(spec, start_day, end_day)):
+            chunk_start = run_start
+            while chunk_start <= run_end:
+                chunk_end = min(run_end, chunk_start + timedelta(days=CHUNK_DAYS - 1))
+                chunks.append((report_name, daily_request, spec, chunk_start, chunk_end))
+                chunk_start = chunk_end + timedelta(days=1)
+    return chunks
+
+def run_backfill(property_ids, months=MAX_BACKFILL_MONTHS, report_names=None, workers=BACKFILL_WORKERS,
+                 progress=None):
+    # Fills the daily store for the given properties; returns (chunks done, chunks failed)
+    store = get_daily_store()
+    start_day, end_day = backfill_range(months)
+    chunks = [(property_id, *chunk) for property_id in property_ids
+              for chunk in plan_chunks(store, str(property_id), start_day, end_day, report_names)]
+    logger.info(f"Backfilling {len(chunks)} chunks from {start_day} to {end_day} for {len(property_ids)} properties")
+    if not chunks:
+        return 0, 0
+
+    done = failed = 0
+    started = time.time()
+    with get_client_pool().client() as client:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            future_to_chunk = {executor.submit(store.fetch_days, client, daily_request, spec, chunk_start, chunk_end):
+                               (property_id, report_name, chunk_start, chunk_end)
+                               for property_id, report_name, daily_request, spec, chunk_start, chunk_end in chunks}
+            for future in as_completed(future_to_chunk):
+                property_id, report_name, chunk_start, chunk_end = future_to_chunk[future]
+                try:
+                    future.result()
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Error backfilling {report_name} for {property_id} "
+                                 f"{chunk_start} to {chunk_end}: {str(e)}")
+                if progress:
+                    progress(done, failed, len(chunks), time.time() - started)
+        finally:
+            # On Ctrl-C, drop the queued chunks; finished ones are already stored
+            executor.shutdown(wait=True, cancel_futures=True)
+    return done, failed
+
+@click.command('ga-backfill', help='Fill the daily GA store with up to 24 months of history. '
+                                     'Resumable: days already stored are skipped.')
+@click.option('--property', 'property_ids', multiple=True, help='GA property id; all accounts when omitted')
+@click.option('--months', default=MAX_BACKFILL_MONTHS, show_default=True, type=click.IntRange(0, MAX_BACKFILL_MONTHS))
+@click.option('--report', 'report_names', multiple=True, help='Report spec name; all reports when omitted')
+@click.option('--workers', default=BACKFILL_WORKERS, show_default=True, type=click.IntRange(1))
+@with_appcontext
+def backfill_command(property_ids, months, report_names, workers):
+    property_ids = list(property_ids) or [str(property_id) for property_id in accounts.values()]
+
+    def progress(done, failed, total, elapsed):
+        click.echo(f"\r{done + failed}/{total} chunks ({failed} failed) in {elapsed:.0f}s", nl=False)
+
+    done, failed = run_backfill(property_ids, months, list(report_names) or None, workers, progress)
+    click.echo()
+    click.echo(f"Backfill finished: {done} chunks stored, {failed} failed"
+               + ("; run again to retry the failed chunks" if failed else ""))
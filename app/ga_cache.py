@@ -0,0 +1,250 @@
+from google.analytics.data_v1beta.types import RunReportRequest
+from app.ga_singleflight import MAX_POLL_INTERVAL_SECONDS, POLL_INTERVAL_SECONDS, get_shared_flights
+from datetime import date, datetime, timedelta
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.environ.get('GA_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CACHE_PATH = os.environ.get('GA_CACHE_PATH') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'ga_cache.sqlite3')
+# GA4 keeps processing a day's data for up to ~72 hours; older days are final
+FINAL_AFTER_DAYS = int(os.environ.get('GA_CACHE_FINAL_AFTER_DAYS', 3))
+# Ranges touching the last FINAL_AFTER_DAYS days are only kept briefly
+RECENT_TTL_SECONDS = int(os.environ.get('GA_CACHE_RECENT_TTL', 900))
+# Bumped whenever the shape of the cached data changes
+CACHE_VERSION = 2
+
+class ReportCache:
+    # Caches formatted report data per (property, report spec, date range), so
+    # a request for [current, last_year] can reuse last year's final data even
+    # while the current period keeps expiring
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        # range key: [lock, number of callers holding or waiting for it]
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS ga_report_cache (
+                    key TEXT PRIMARY KEY,
+                    property TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL
+                )""")
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def spec_key(request):
+        # Everything that shapes the result except the date ranges
+        spec = RunReportRequest(request)
+        del spec.date_ranges[:]
+        spec.return_property_quota = False
+        # The row limit scales with the number of DateRanges (ReportSpec.build_request);
+        # the formatted top rows of each period do not depend on it
+        spec.limit = 0
+        return RunReportRequest.to_json(spec, sort_keys=True, indent=None)
+
+    @staticmethod
+    def range_key(spec_key, date_range):
+        raw = f"{CACHE_VERSION}|{spec_key}|{date_range.start_date}|{date_range.end_date}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def expires_at(date_range, now=None):
+        now = now or time.time()
+        try:
+            end_date = datetime.strptime(date_range.end_date, '%Y-%m-%d').date()
+        except ValueError:
+            # Relative dates like "today" or "7daysAgo" are never final
+            return now + RECENT_TTL_SECONDS
+        if end_date < date.today() - timedelta(days=FINAL_AFTER_DAYS):
+            return None
+        return now + RECENT_TTL_SECONDS
+
+    def split(self, request):
+        # Returns the cached data per period name and a copy of the request
+        # reduced to the date ranges that still have to be fetched (or None)
+        spec_key = self.spec_key(request)
+        keys = [self.range_key(spec_key, date_range) for date_range in request.date_ranges]
+        rows = self._connect().execute(
+            f"SELECT key, data FROM ga_report_cache WHERE key IN ({','.join('?' * len(keys))}) "
+            "AND (expires_at IS NULL OR expires_at > ?)", [*keys, time.time()]).fetchall()
+        found = dict(rows)
+
+        hits = {}
+        missing = []
+        for key, date_range in zip(keys, request.date_ranges):
+            if key in found:
+                hits[date_range.name] = json.loads(found[key])
+            else:
+                missing.append(date_range)
+        if not missing:
+            return hits, None
+        missing_request = RunReportRequest(request)
+        del missing_request.date_ranges[:]
+        missing_request.date_ranges.extend(missing)
+        return hits, missing_request
+
+    def store(self, request, data):
+        # data maps each DateRange name of the request to its formatted result
+        spec_key = self.spec_key(request)
+        now = time.time()
+        rows = [(self.range_key(spec_key, date_range), request.property, date_range.start_date,
+                 date_range.end_date, json.dumps(data[date_range.name]), now, self.expires_at(date_range, now))
+                for date_range in request.date_ranges if date_range.name in data]
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO ga_report_cache "
+                "(key, property, start_date, end_date, data, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows)
+
+    def store_many(self, requests, fetched):
+        # requests and fetched are keyed alike, as in fetch_many
+        for key, request in requests.items():
+            self.store(request, fetched[key])
+
+    def keep_until(self, property_name, date_ranges, until):
+        # Extends the not-yet-final entries of these (start, end) ranges to the
+        # given timestamp, e.g. the next warm-up run
+        with self._connect() as connection:
+            connection.executemany(
+                "UPDATE ga_report_cache SET expires_at = ? WHERE property = ? AND start_date = ? AND end_date = ? "
+                "AND expires_at IS NOT NULL AND expires_at < ?",
+                [(until, property_name, start_date, end_date, until) for start_date, end_date in date_ranges])
+
+    def _claim_locks(self, requests):
+        keys = sorted({self.range_key(self.spec_key(request), date_range)
+                       for request in requests for date_range in request.date_ranges})
+        with self._locks_lock:
+            locks = []
+            for key in keys:
+                entry = self._locks.setdefault(key, [threading.Lock(), 0])
+                entry[1] += 1
+                locks.append(entry[0])
+        return keys, locks
+
+    def _drop_locks(self, keys, held):
+        for lock in reversed(held):
+            lock.release()
+        # Locks nobody holds or waits for are dropped, so they don't pile up per range
+        with self._locks_lock:
+            for key in keys:
+                entry = self._locks[key]
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    @contextmanager
+    def guard(self, requests):
+        # Serializes concurrent fetches of the same report spec and date range
+        # so a cold entry is filled by one caller while the others wait and re-check
+        # (across worker processes too with GA_SINGLEFLIGHT_SHARED)
+        keys, locks = self._claim_locks(requests)
+        held = []
+        try:
+            for lock in locks:
+                lock.acquire()
+                held.append(lock)
+            shared_flights = get_shared_flights()
+            if shared_flights is None:
+                yield
+            else:
+                with shared_flights.hold(keys):
+                    yield
+        finally:
+            self._drop_locks(keys, held)
+
+    @asynccontextmanager
+    async def guard_async(self, requests):
+        # guard for the event loop: the locks are polled rather than waited on
+        # in a thread, so waiters don't starve the executor the leader's fetch needs
+        keys, locks = self._claim_locks(requests)
+        held = []
+        try:
+            for lock in locks:
+                interval = POLL_INTERVAL_SECONDS
+                while not lock.acquire(blocking=False):
+                    await asyncio.sleep(interval)
+                    interval = min(interval * 2, MAX_POLL_INTERVAL_SECONDS)
+                held.append(lock)
+            shared_flights = get_shared_flights()
+            if shared_flights is None:
+                yield
+            else:
+                async with shared_flights.hold_async(keys):
+                    yield
+        finally:
+            self._drop_locks(keys, held)
+
+    def fetch(self, request, fetch_func):
+        # fetch_func(request) must return {period_name: data} for the request's ranges
+        data = self.fetch_many({None: request}, lambda requests: {None: fetch_func(requests[None])})
+        return data[None]
+
+    def fetch_many(self, requests, fetch_func):
+        # requests maps report names to RunReportRequests; fetch_func receives
+        # the reduced requests that missed the cache and must return
+        # {report_name: {period_name: data}} for them
+        data, missing = self.split_all(requests)
+        if not missing:
+            return data
+        with self.guard(missing.values()):
+            # Another caller may have filled the cache while we were waiting
+            data, missing = self.split_all(requests)
+            if missing:
+                fetched = fetch_func(missing)
+                self.store_many(missing, fetched)
+                for report_name in missing:
+                    data[report_name].update(fetched[report_name])
+        return data
+
+    def split_all(self, requests):
+        data = {}
+        missing = {}
+        for report_name, request in requests.items():
+            data[report_name], missing_request = self.split(request)
+            if missing_request is not None:
+                missing[report_name] = missing_request
+        return data, missing
+
+    def purge_expired(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM ga_report_cache WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                               (time.time(),))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_report_cache():
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ReportCache()
+            logger.debug(f"GA report cache opened at {_cache.path}")
+        return _cache
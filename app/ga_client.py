@@ -0,0 +1,269 @@
+from google.analytics.data_v1beta import BetaAnalyticsDataAsyncClient, BetaAnalyticsDataClient
+from google.analytics.data_v1beta.services.beta_analytics_data.transports import (
+    BetaAnalyticsDataGrpcAsyncIOTransport, BetaAnalyticsDataGrpcTransport, BetaAnalyticsDataRestTransport)
+from google.auth.credentials import AnonymousCredentials
+from app.cassette import CASSETTE_MODE, replay_ga_client, wrap_ga_client
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+import google.auth
+import grpc
+import asyncio
+import atexit
+import os
+import threading
+import weakref
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+GA_SCOPES = ["https://www.googleapis.com/auth/analytics.readonly"]
+
+# Upper bound of gRPC channels per pool and the number of concurrent leases a
+# channel takes before the pool opens another one
+MAX_CHANNELS = int(os.environ.get('GA_MAX_CHANNELS', 4))
+MAX_LEASES_PER_CHANNEL = int(os.environ.get('GA_MAX_LEASES_PER_CHANNEL', 16))
+
+# grpc, grpc_asyncio (fetch_periods runs on one asyncio channel driven by a
+# background event loop) or rest (JSON over HTTP/1.1)
+TRANSPORTS = ('grpc', 'grpc_asyncio', 'rest')
+TRANSPORT = os.environ.get('GA_TRANSPORT', 'grpc').lower()
+if TRANSPORT not in TRANSPORTS:
+    logger.warning(f"Unknown GA_TRANSPORT {TRANSPORT}, using grpc")
+    TRANSPORT = 'grpc'
+# host[:port]; an http:// endpoint is used without TLS or credentials, for a
+# local stand-in server
+API_ENDPOINT = os.environ.get('GA_API_ENDPOINT', 'analyticsdata.googleapis.com')
+INSECURE = API_ENDPOINT.startswith('http://')
+API_HOST = API_ENDPOINT.split('://', 1)[-1]
+
+# gRPC channel tuning. Keepalive pings stop proxies from silently dropping
+# idle channels (0 turns them off)
+KEEPALIVE_MS = int(os.environ.get('GA_GRPC_KEEPALIVE_MS', 0))
+KEEPALIVE_TIMEOUT_MS = int(os.environ.get('GA_GRPC_KEEPALIVE_TIMEOUT_MS', 20000))
+# Largest message either way in MB, -1 for no limit like the client library's default
+MAX_MESSAGE_MB = int(os.environ.get('GA_GRPC_MAX_MESSAGE_MB', -1))
+COMPRESSIONS = {'none': grpc.Compression.NoCompression, 'gzip': grpc.Compression.Gzip,
+                'deflate': grpc.Compression.Deflate}
+COMPRESSION = COMPRESSIONS.get(os.environ.get('GA_GRPC_COMPRESSION', 'none').lower(), grpc.Compression.NoCompression)
+# RPCs in flight on one channel (HTTP connections per client for rest); more
+# wait for a free stream. 0 leaves it to the server's HTTP/2 limit
+MAX_STREAMS_PER_CHANNEL = int(os.environ.get('GA_MAX_STREAMS_PER_CHANNEL', 0))
+
+def channel_options():
+    options = [("grpc.max_send_message_length", MAX_MESSAGE_MB * 1024 * 1024 if MAX_MESSAGE_MB > 0 else -1),
+               ("grpc.max_receive_message_length", MAX_MESSAGE_MB * 1024 * 1024 if MAX_MESSAGE_MB > 0 else -1),
+               # A local subchannel pool keeps gRPC from folding our channels
+               # back into one shared connection
+               ("grpc.use_local_subchannel_pool", 1)]
+    if KEEPALIVE_MS > 0:
+        options += [("grpc.keepalive_time_ms", KEEPALIVE_MS),
+                    ("grpc.keepalive_timeout_ms", KEEPALIVE_TIMEOUT_MS),
+                    ("grpc.keepalive_permit_without_calls", 0),
+                    ("grpc.http2.max_pings_without_data", 0)]
+    return options
+
+class StreamLimit(grpc.UnaryUnaryClientInterceptor):
+    # Caps the RPCs in flight on a sync channel. The client library makes
+    # blocking calls, which have finished when continuation returns
+    def __init__(self, limit):
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        with self._semaphore:
+            return continuation(client_call_details, request)
+
+class AsyncStreamLimit(grpc.aio.UnaryUnaryClientInterceptor):
+    # Same for an asyncio channel, which lives on a single event loop
+    def __init__(self, limit):
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        async with self._semaphore:
+            call = await continuation(client_call_details, request)
+            await call
+            return call
+
+class ClientPool:
+    def __init__(self, credentials_file=None, max_channels=MAX_CHANNELS, max_leases_per_channel=MAX_LEASES_PER_CHANNEL):
+        self.credentials_file = credentials_file
+        self.max_channels = max_channels
+        self.max_leases_per_channel = max_leases_per_channel
+        self._lock = threading.Lock()
+        self._credentials = None
+        self._clients = []
+        self._leases = []
+        # Async clients are bound to the event loop that created them
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._pid = os.getpid()
+
+    def _load_credentials(self):
+        if self.credentials_file:
+            credentials, _ = google.auth.load_credentials_from_file(self.credentials_file, scopes=GA_SCOPES)
+        else:
+            credentials, _ = google.auth.default(scopes=GA_SCOPES)
+        return credentials
+
+    def _create_channel(self, host, **kwargs):
+        # Our options replace the library's message size defaults
+        kwargs.pop('options', None)
+        if INSECURE:
+            channel = grpc.insecure_channel(host, options=channel_options(), compression=COMPRESSION)
+        else:
+            channel = BetaAnalyticsDataGrpcTransport.create_channel(host, options=channel_options(),
+                                                                    compression=COMPRESSION, **kwargs)
+        if MAX_STREAMS_PER_CHANNEL > 0:
+            channel = grpc.intercept_channel(channel, StreamLimit(MAX_STREAMS_PER_CHANNEL))
+        return channel
+
+    def _create_async_channel(self, host, **kwargs):
+        kwargs.pop('options', None)
+        interceptors = [AsyncStreamLimit(MAX_STREAMS_PER_CHANNEL)] if MAX_STREAMS_PER_CHANNEL > 0 else None
+        if INSECURE:
+            return grpc.aio.insecure_channel(host, options=channel_options(), compression=COMPRESSION,
+                                             interceptors=interceptors)
+        return BetaAnalyticsDataGrpcAsyncIOTransport.create_channel(host, options=channel_options(),
+                                                                    compression=COMPRESSION,
+                                                                    interceptors=interceptors, **kwargs)
+
+    def _get_credentials(self):
+        if self._credentials is None:
+            self._credentials = AnonymousCredentials() if INSECURE else self._load_credentials()
+        return self._credentials
+
+    def _create_client(self):
+        if CASSETTE_MODE == 'replay':
+            return replay_ga_client()
+        if TRANSPORT == 'rest':
+            transport = BetaAnalyticsDataRestTransport(host=API_HOST, credentials=self._get_credentials(),
+                                                       url_scheme='http' if INSECURE else 'https')
+            if MAX_STREAMS_PER_CHANNEL > 0:
+                # Blocks instead of opening throwaway connections past the limit
+                adapter = HTTPAdapter(pool_maxsize=MAX_STREAMS_PER_CHANNEL, pool_block=True)
+                transport._session.mount('http://' if INSECURE else 'https://', adapter)
+        else:
+            # The sync client has no asyncio transport; grpc_asyncio only
+            # changes how fetch_periods runs
+            transport = BetaAnalyticsDataGrpcTransport(host=API_HOST, credentials=self._get_credentials(),
+                                                       channel=self._create_channel)
+        logger.debug(f"Opened GA {TRANSPORT} channel {len(self._clients) + 1} "
+                     f"for credentials {self.credentials_file or 'default'}")
+        return wrap_ga_client(BetaAnalyticsDataClient(transport=transport))
+
+    def _create_async_client(self):
+        if CASSETTE_MODE == 'replay':
+            return replay_ga_client(asynchronous=True)
+        # Always gRPC: the library's async client only supports grpc_asyncio
+        transport = BetaAnalyticsDataGrpcAsyncIOTransport(host=API_HOST, credentials=self._get_credentials(),
+                                                          channel=self._create_async_channel)
+        return wrap_ga_client(BetaAnalyticsDataAsyncClient(transport=transport))
+
+    def _reset_after_fork(self):
+        # gRPC channels must not be reused across fork(); start over in the child
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._clients = []
+            self._leases = []
+            self._async_clients = weakref.WeakKeyDictionary()
+
+    def acquire(self):
+        with self._lock:
+            self._reset_after_fork()
+            index = min(range(len(self._clients)), key=self._leases.__getitem__, default=None)
+            if index is None or (self._leases[index] >= self.max_leases_per_channel
+                                 and len(self._clients) < self.max_channels):
+                self._clients.append(self._create_client())
+                self._leases.append(0)
+                index = len(self._clients) - 1
+            self._leases[index] += 1
+            return index, self._clients[index]
+
+    def release(self, index):
+        with self._lock:
+            if index < len(self._leases):
+                self._leases[index] -= 1
+
+    @contextmanager
+    def client(self):
+        index, client = self.acquire()
+        try:
+            yield client
+        finally:
+            self.release(index)
+
+    def async_client(self):
+        # Must be called from a coroutine; returns the client of the running loop
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._reset_after_fork()
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = self._create_async_client()
+                logger.debug(f"Opened async GA channel for credentials {self.credentials_file or 'default'}")
+            return client
+
+    async def close_async(self):
+        with self._lock:
+            client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.transport.close()
+
+    def close(self):
+        with self._lock:
+            for client in self._clients:
+                try:
+                    client.transport.close()
+                except Exception as e:
+                    logger.warning(f"Error closing GA channel: {str(e)}")
+            self._clients = []
+            self._leases = []
+
+# One pool per credentials file for the lifetime of the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_client_pool(credentials_file=None):
+    credentials_file = credentials_file or os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+    if credentials_file:
+        credentials_file = os.path.abspath(credentials_file)
+    with _pools_lock:
+        pool = _pools.get(credentials_file)
+        if pool is None:
+            pool = _pools[credentials_file] = ClientPool(credentials_file)
+        return pool
+
+class LoopThread(threading.Thread):
+    # Event loop of the grpc_asyncio transport. Request threads hand it their
+    # coroutines, so one asyncio channel serves the whole worker process
+    def __init__(self):
+        super().__init__(name='ga-asyncio', daemon=True)
+        self.loop = asyncio.new_event_loop()
+        self.pid = os.getpid()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+def run_coroutine(coroutine):
+    # Runs the coroutine on the shared loop and waits for its result
+    global _loop_thread
+    with _loop_lock:
+        # Threads don't survive fork(); the child starts its own loop
+        if _loop_thread is None or _loop_thread.pid != os.getpid():
+            _loop_thread = LoopThread()
+            _loop_thread.start()
+        loop = _loop_thread.loop
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+def shutdown_client_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+    logger.debug("GA client pools shut down")
+
+atexit.register(shutdown_client_pools)
@@ -0,0 +1,38 @@
+from google.api_core.exceptions import GatewayTimeout, ServiceUnavailable, TooManyRequests
+
+class GAError(Exception):
+    # Base class of everything the GA fetch path raises; report_name is the
+    # report (or planned request) that failed, when known
+    def __init__(self, message, report_name=None):
+        super().__init__(message)
+        self.report_name = report_name
+
+class GAReportError(GAError):
+    # GA rejected the request or its response could not be read; retrying won't help
+    pass
+
+class GATransientError(GAError):
+    # UNAVAILABLE or DEADLINE_EXCEEDED that outlasted all retries
+    pass
+
+class GAQuotaError(GAError):
+    # The property's quota stayed exhausted for longer than we are willing to wait
+    pass
+
+# google.api_core exceptions that are worth another attempt. The REST transport
+# raises the HTTP parents of gRPC's DeadlineExceeded and ResourceExhausted
+RETRYABLE_ERRORS = (ServiceUnavailable, GatewayTimeout)
+QUOTA_ERRORS = TooManyRequests
+
+def wrap_error(e, context, report_name=None):
+    # Keeps the "Error in ...: ..." messages while preserving the error type
+    if isinstance(e, GAError):
+        error_class = type(e)
+        report_name = report_name or e.report_name
+    elif isinstance(e, RETRYABLE_ERRORS):
+        error_class = GATransientError
+    elif isinstance(e, QUOTA_ERRORS):
+        error_class = GAQuotaError
+    else:
+        error_class = GAReportError
+    return error_class(f"Error in {context}: {str(e)}", report_name=report_name)
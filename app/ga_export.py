@@ -0,0 +1,40 @@
+from app.data_fetcher import EXPORT_PAGE_SIZE, stream_report
+from app.ga_result import plain_value
+from app.report_specs import get_report_specs
+from flask.cli import with_appcontext
+import click
+import csv
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+def write_csv(spec, pages, output):
+    # A header row, then every row of the ReportResult pages; returns the row count
+    writer = csv.writer(output)
+    writer.writerow(list(spec.dimensions) + list(spec.metrics))
+    rows = 0
+    for page in pages:
+        for i in range(len(page)):
+            dimension_values, metric_values = page.row(i)
+            writer.writerow(dimension_values + [plain_value(value) for value in metric_values])
+        rows += len(page)
+    return rows
+
+@click.command('ga-export', help='Write every row of one report, not just the top rows, as CSV. '
+                                 'Rows are fetched page by page, so memory stays bounded.')
+@click.option('--property', 'property_id', required=True, help='GA property id')
+@click.option('--report', 'report_name', required=True, help='Report spec name')
+@click.option('--start', 'start_date', required=True, type=click.DateTime(['%Y-%m-%d']))
+@click.option('--end', 'end_date', required=True, type=click.DateTime(['%Y-%m-%d']))
+@click.option('--page-size', default=EXPORT_PAGE_SIZE, show_default=True, type=click.IntRange(1, 250000))
+@click.option('--output', default='-', type=click.File('w', encoding='utf-8'), help='CSV file; stdout when omitted')
+@with_appcontext
+def export_command(property_id, report_name, start_date, end_date, page_size, output):
+    spec = get_report_specs().get(report_name)
+    if spec is None:
+        raise click.BadParameter(f"unknown report {report_name}", param_hint='--report')
+    pages = stream_report(property_id, report_name, start_date, end_date, page_size, columnar=True)
+    rows = write_csv(spec, pages, output)
+    logger.info(f"Exported {rows} rows of {report_name} for {property_id}")
@@ -0,0 +1,79 @@
+from array import array
+from bisect import bisect_right
+from datetime import date
+import json
+
+class RangeIndex:
+    # Cumulative sums of the additive metrics of one stored report spec, one
+    # typed array per dimension combination and metric covering only the days
+    # from the combination's first to its last day with data, so the total of
+    # a date range is cumulative[end + 1] - cumulative[start] per combination
+    # (a range query still visits every combination that starts before its end)
+    def __init__(self, first_day, last_day, metric_count):
+        self.first_day = first_day
+        self.last_day = last_day
+        self.metric_count = metric_count
+        # dimension tuple: (first position, last position, [cumulative array per metric])
+        self.columns = {}
+        # Keys ordered by first position, for range_totals
+        self._keys = []
+        self._firsts = []
+        # Number of stored values, for the store's memory cap
+        self.size = 0
+
+    @classmethod
+    def build(cls, rows, first_day, last_day, metric_count):
+        # rows: (iso day, dimensions JSON, metrics JSON) as stored by DailyStore
+        index = cls(first_day, last_day, metric_count)
+        is_float = [False] * metric_count
+        daily = {}
+        for day, dimensions, metrics in rows:
+            position = (date.fromisoformat(day) - first_day).days
+            values = json.loads(metrics)
+            days = daily.setdefault(dimensions, {})
+            previous = days.get(position)
+            days[position] = values if previous is None else [a + b for a, b in zip(previous, values)]
+            for i, value in enumerate(values):
+                if isinstance(value, float):
+                    is_float[i] = True
+
+        typecodes = ['d' if column_is_float else 'q' for column_is_float in is_float]
+        for dimensions, days in daily.items():
+            first, last = min(days), max(days)
+            span = last - first + 1
+            cumulative_columns = []
+            for i, typecode in enumerate(typecodes):
+                cumulative = array(typecode, [0]) * (span + 1)
+                running = 0
+                for position in range(first, last + 1):
+                    values = days.get(position)
+                    if values is not None:
+                        running += values[i]
+                    cumulative[position - first + 1] = running
+                cumulative_columns.append(cumulative)
+            index.columns[tuple(json.loads(dimensions))] = (first, last, cumulative_columns)
+            index.size += (span + 1) * metric_count
+        index._keys = sorted(index.columns, key=lambda key: index.columns[key][0])
+        index._firsts = [index.columns[key][0] for key in index._keys]
+        return index
+
+    def _positions(self, start_day, end_day):
+        return (start_day - self.first_day).days, (end_day - self.first_day).days
+
+    @staticmethod
+    def _sum(entry, start, end):
+        first, last, columns = entry
+        low, high = max(start, first) - first, min(end, last) - first + 1
+        if low >= high:
+            return None
+        return [cumulative[high] - cumulative[low] for cumulative in columns]
+
+    def range_totals(self, start_day, end_day):
+        # {dimension tuple: [metric totals]} for every combination with data in the range
+        start, end = self._positions(start_day, end_day)
+        totals = {}
+        for key in self._keys[:bisect_right(self._firsts, end)]:
+            values = self._sum(self.columns[key], start, end)
+            if values is not None and any(values):
+                totals[key] = values
+        return totals
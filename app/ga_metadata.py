@@ -0,0 +1,170 @@
+from google.analytics.data_v1beta.types import (CheckCompatibilityRequest, Compatibility, Dimension, FilterExpression,
+                                                GetMetadataRequest, Metric, MetricType)
+from app.ga_cache import CACHE_PATH
+from app.ga_errors import GAReportError, wrap_error
+from app.report_specs import parse_metric_value
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+VALIDATION_ENABLED = os.environ.get('GA_VALIDATE_SPECS', 'true').lower() in ('1', 'true', 'yes')
+METADATA_PATH = os.environ.get('GA_METADATA_PATH') or os.path.join(os.path.dirname(CACHE_PATH), 'ga_metadata.sqlite3')
+# Custom dimensions and metrics change rarely; a day keeps new ones from
+# being rejected for long
+METADATA_TTL_SECONDS = int(os.environ.get('GA_METADATA_TTL', 86400))
+
+class MetadataCache:
+    # GA4 getMetadata and checkCompatibility results per property, kept in
+    # SQLite (shared by worker processes) and in memory, so report specs are
+    # validated locally before any RunReport is sent
+    def __init__(self, path=METADATA_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._memory = {}
+        self._memory_lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS ga_metadata (
+                    key TEXT PRIMARY KEY,
+                    property TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )""")
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _cached(self, key, property_name, fetch_func):
+        now = time.time()
+        with self._memory_lock:
+            entry = self._memory.get(key)
+        if entry is not None and entry[0] > now - METADATA_TTL_SECONDS:
+            return entry[1]
+        row = self._connect().execute("SELECT data, fetched_at FROM ga_metadata WHERE key = ? AND fetched_at > ?",
+                                      (key, now - METADATA_TTL_SECONDS)).fetchone()
+        if row is not None:
+            data, fetched_at = json.loads(row[0]), row[1]
+        else:
+            data, fetched_at = fetch_func(), now
+            with self._connect() as connection:
+                connection.execute("INSERT OR REPLACE INTO ga_metadata (key, property, data, fetched_at) "
+                                   "VALUES (?, ?, ?, ?)", (key, property_name, json.dumps(data), fetched_at))
+        with self._memory_lock:
+            self._memory[key] = (fetched_at, data)
+        return data
+
+    def metadata(self, client, property_id):
+        # {"dimensions": [api names], "metrics": {api name: MetricType name}}
+        property_name = f"properties/{property_id}"
+
+        def fetch():
+            try:
+                metadata = client.get_metadata(GetMetadataRequest(name=f"{property_name}/metadata"))
+            except Exception as e:
+                raise wrap_error(e, f"get_metadata for {property_name}")
+            return {"dimensions": [dimension.api_name for dimension in metadata.dimensions],
+                    "metrics": {metric.api_name: MetricType(metric.type_).name for metric in metadata.metrics}}
+        return self._cached(f"metadata|{property_name}", property_name, fetch)
+
+    def compatibility(self, client, property_id, spec):
+        # {"dimensions": {name: Compatibility name}, "metrics": {...}} for one spec's fields
+        property_name = f"properties/{property_id}"
+        signature = json.dumps([spec.dimensions, spec.metrics, spec.dimension_filter])
+        key = "compatibility|" + hashlib.sha256(f"{property_name}|{signature}".encode('utf-8')).hexdigest()
+
+        def fetch():
+            request = CheckCompatibilityRequest(
+                property=property_name,
+                dimensions=[Dimension(name=name) for name in spec.dimensions],
+                metrics=[Metric(name=name) for name in spec.metrics],
+            )
+            if spec.dimension_filter:
+                request.dimension_filter = FilterExpression.from_json(spec.dimension_filter)
+            try:
+                response = client.check_compatibility(request)
+            except Exception as e:
+                raise wrap_error(e, f"check_compatibility for {spec.name}", spec.name)
+            return {"dimensions": {item.dimension_metadata.api_name: Compatibility(item.compatibility).name
+                                   for item in response.dimension_compatibilities},
+                    "metrics": {item.metric_metadata.api_name: Compatibility(item.compatibility).name
+                                for item in response.metric_compatibilities}}
+        return self._cached(key, property_name, fetch)
+
+    def problems(self, client, property_id, spec):
+        # Human-readable reasons the spec would be rejected, empty if it is fine
+        metadata = self.metadata(client, property_id)
+        unknown = [f"unknown dimension {name}" for name in spec.dimensions if name not in metadata["dimensions"]]
+        unknown += [f"unknown metric {name}" for name in spec.metrics if name not in metadata["metrics"]]
+        if unknown:
+            return unknown
+        compatibility = self.compatibility(client, property_id, spec)
+        return [f"{name} is incompatible"
+                for fields in (compatibility["dimensions"], compatibility["metrics"])
+                for name, value in fields.items() if value == Compatibility.INCOMPATIBLE.name]
+
+    def validate(self, client, property_id, specs):
+        # Raises GAReportError naming every invalid spec. If the metadata
+        # itself can't be fetched the specs are let through and GA decides
+        try:
+            self.metadata(client, property_id)
+        except Exception as e:
+            logger.warning(f"Skipping validation of report specs for {property_id}: {str(e)}")
+            return
+        errors = []
+        for spec in specs:
+            try:
+                problems = self.problems(client, property_id, spec)
+            except Exception as e:
+                logger.warning(f"Skipping validation of {spec.name} for {property_id}: {str(e)}")
+                continue
+            if problems:
+                errors.append(f"{spec.name}: {', '.join(problems)}")
+        if errors:
+            raise GAReportError(f"Error in report specs for property {property_id}: {'; '.join(errors)}",
+                                report_name=errors[0].split(':')[0])
+
+    def metric_parsers(self, client, property_id, metric_names):
+        # int for TYPE_INTEGER metrics, float for the other known types and
+        # the int-or-float guess for anything the metadata doesn't list
+        try:
+            metric_types = self.metadata(client, property_id)["metrics"]
+        except Exception as e:
+            logger.warning(f"No GA metadata for {property_id}: {str(e)}")
+            metric_types = {}
+        parsers = []
+        for name in metric_names:
+            metric_type = metric_types.get(name)
+            if metric_type is None or metric_type == MetricType.METRIC_TYPE_UNSPECIFIED.name:
+                parsers.append(parse_metric_value)
+            else:
+                parsers.append(int if metric_type == MetricType.TYPE_INTEGER.name else float)
+        return parsers
+
+_metadata_cache = None
+_metadata_lock = threading.Lock()
+
+def get_metadata_cache():
+    global _metadata_cache
+    with _metadata_lock:
+        if _metadata_cache is None:
+            _metadata_cache = MetadataCache()
+        return _metadata_cache
+
+def validate_reports(client, property_id, specs):
+    if VALIDATION_ENABLED:
+        get_metadata_cache().validate(client, str(property_id), specs)
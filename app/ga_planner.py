@@ -0,0 +1,215 @@
+from app.report_specs import ADDITIVE_METRICS, OTHER_LABEL, ReportSpec, format_metric_value, get_report_specs, parse_metric_value, raw_response
+from dataclasses import dataclass, field, replace
+import os
+import threading
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+PLANNER_ENABLED = os.environ.get('GA_QUERY_PLANNER', 'true').lower() in ('1', 'true', 'yes')
+# GA4 limits per RunReportRequest
+MAX_METRICS = 10
+# Rows fetched for a host whose rows are rolled up into a coarser report; if
+# GA has more rows than this, the coarser report is fetched on its own
+ROLLUP_ROW_LIMIT = int(os.environ.get('GA_PLANNER_ROLLUP_ROWS', 10000))
+
+@dataclass
+class PlannedRequest:
+    # One GA request and the reports derived from it:
+    #   members  - specs whose rows are read straight from the request
+    #   rollups  - specs whose dimensions are a subset, aggregated locally
+    #   totals   - dimensionless specs answered by the TOTAL aggregation
+    host: ReportSpec
+    members: list = field(default_factory=list)
+    rollups: list = field(default_factory=list)
+    totals: list = field(default_factory=list)
+
+    @property
+    def name(self):
+        return self.host.name
+
+    def build_request(self, property_id, date_ranges):
+        return self.host.build_request(property_id, date_ranges)
+
+    def split(self, response, period_names):
+        # {period_name: {report_name: data}}; a rollup whose host rows were
+        # truncated by the row limit comes back as None. GA applies the row
+        # limit across all DateRanges, so in a truncated response a quiet
+        # period can be crowded out by a busy one: a period with fewer rows
+        # than a member's limit is left out (and not cached), to be fetched
+        # on its own
+        response = raw_response(response)
+        periods = rows_by_period(response, period_names)
+        # row_count covers all periods; more rows than returned may exist for any of them
+        truncated = len(response.rows) < response.row_count
+        metric_names = [header.name for header in response.metric_headers]
+        dimension_count = len(self.host.dimensions)
+
+        data = {}
+        for period_name, (rows, total) in periods.items():
+            if truncated and any(spec.limit and len(rows) < spec.limit for spec in self.members):
+                continue
+            reports = data[period_name] = {}
+            for spec in self.members:
+                reports[spec.name] = select_rows(spec, rows, total, metric_names, dimension_count, truncated)
+            for spec in self.rollups:
+                reports[spec.name] = rollup_rows(spec, self.host, rows, metric_names) if not truncated else None
+            for spec in self.totals:
+                reports[spec.name] = select_totals(spec, total, metric_names)
+        return data
+
+def rows_by_period(response, period_names):
+    # {period_name: ([(dimension values, metric values)], total metric values or None)}
+    periods = {name: ([], None) for name in period_names}
+    dimension_names = [header.name for header in response.dimension_headers]
+    date_range_index = dimension_names.index("dateRange") if len(period_names) > 1 else None
+    for row in response.rows:
+        dimension_values = [value.value for value in row.dimension_values]
+        period_name = dimension_values.pop(date_range_index) if date_range_index is not None else period_names[0]
+        periods[period_name][0].append((dimension_values, [value.value for value in row.metric_values]))
+    for total_row in response.totals:
+        period_name = (total_row.dimension_values[date_range_index].value
+                       if date_range_index is not None else period_names[0])
+        if period_name in periods:
+            periods[period_name] = (periods[period_name][0], [value.value for value in total_row.metric_values])
+    return periods
+
+def other_row(metric_names, dimension_count, total_values, shown_values):
+    # Everything outside the shown rows; only additive metrics can be derived
+    return {"dimensionValues": [OTHER_LABEL] * dimension_count,
+            "metricValues": [format_metric_value(total - shown) if name in ADDITIVE_METRICS else ""
+                             for name, total, shown in zip(metric_names, total_values, shown_values)]}
+
+def select_rows(spec, rows, total, metric_names, dimension_count, truncated=False):
+    indexes = [metric_names.index(name) for name in spec.metrics]
+    shown = rows[:spec.limit] if spec.limit else rows
+    result_rows = [{"dimensionValues": dimension_values, "metricValues": [metric_values[i] for i in indexes]}
+                   for dimension_values, metric_values in shown]
+    if spec.other_bucket and total is not None and (len(rows) > len(shown) or truncated):
+        shown_values = [sum(parse_metric_value(metric_values[i]) for _, metric_values in shown) for i in indexes]
+        total_values = [parse_metric_value(total[i]) for i in indexes]
+        result_rows.append(other_row(spec.metrics, dimension_count, total_values, shown_values))
+    return {"metricHeaders": list(spec.metrics), "rows": result_rows}
+
+def rollup_rows(spec, host, rows, metric_names):
+    dimension_indexes = [host.dimensions.index(name) for name in spec.dimensions]
+    metric_indexes = [metric_names.index(name) for name in spec.metrics]
+    sums = {}
+    for dimension_values, metric_values in rows:
+        key = tuple(dimension_values[i] for i in dimension_indexes)
+        values = [parse_metric_value(metric_values[i]) for i in metric_indexes]
+        if key in sums:
+            sums[key] = [a + b for a, b in zip(sums[key], values)]
+        else:
+            sums[key] = values
+
+    sort_index = spec.metrics.index(spec.order_by) if spec.order_by else 0
+    ordered = sorted(sums.items(), key=lambda item: item[1][sort_index], reverse=True)
+    shown, rest = (ordered[:spec.limit], ordered[spec.limit:]) if spec.limit else (ordered, [])
+    result_rows = [{"dimensionValues": list(key), "metricValues": [format_metric_value(value) for value in values]}
+                   for key, values in shown]
+    if spec.other_bucket and rest:
+        rest_values = [sum(column) for column in zip(*(values for _, values in rest))]
+        result_rows.append(other_row(spec.metrics, len(spec.dimensions), rest_values, [0] * len(spec.metrics)))
+    return {"metricHeaders": list(spec.metrics), "rows": result_rows}
+
+def select_totals(spec, total, metric_names):
+    if total is None:
+        return {"metricHeaders": list(spec.metrics), "rows": []}
+    return {"metricHeaders": list(spec.metrics),
+            "rows": [{"dimensionValues": [], "metricValues": [total[metric_names.index(name)] for name in spec.metrics]}]}
+
+def merged_metrics(*metric_lists):
+    metrics = []
+    for metric_list in metric_lists:
+        for name in metric_list:
+            if name not in metrics:
+                metrics.append(name)
+    return tuple(metrics)
+
+def plan_reports(specs):
+    # Reduces the specs to as few GA requests as possible:
+    # 1. specs with the same dimensions, filter, ordering and limit share a
+    #    request with the union of their metrics
+    # 2. additive-only specs whose dimensions are a subset of another
+    #    request's are aggregated locally from that request's rows
+    # 3. dimensionless, unfiltered specs are read from the TOTAL aggregation
+    #    of an unfiltered request
+    plan = []
+    for spec in specs:
+        for planned in plan:
+            host = planned.host
+            if (host.dimensions, host.dimension_filter, host.order_by, host.limit) == \
+                    (spec.dimensions, spec.dimension_filter, spec.order_by, spec.limit) and \
+                    len(merged_metrics(host.metrics, spec.metrics)) <= MAX_METRICS:
+                planned.host = replace(host, metrics=merged_metrics(host.metrics, spec.metrics),
+                                       other_bucket=host.other_bucket or spec.other_bucket)
+                planned.members.append(spec)
+                break
+        else:
+            plan.append(PlannedRequest(host=replace(spec, section=()), members=[spec]))
+
+    for planned in list(plan):
+        if len(planned.members) != 1 or not planned.host.dimensions:
+            continue
+        spec = planned.members[0]
+        if not set(spec.metrics) <= ADDITIVE_METRICS:
+            continue
+        for host_plan in plan:
+            host = host_plan.host
+            if host_plan is not planned and set(spec.dimensions) < set(host.dimensions) and \
+                    host.dimension_filter == spec.dimension_filter and not host_plan.rollups and \
+                    len(merged_metrics(host.metrics, spec.metrics)) <= MAX_METRICS:
+                host_plan.host = replace(host, metrics=merged_metrics(host.metrics, spec.metrics), limit=ROLLUP_ROW_LIMIT)
+                host_plan.rollups.append(spec)
+                plan.remove(planned)
+                break
+
+    for planned in list(plan):
+        if len(planned.members) != 1 or planned.host.dimensions or planned.host.dimension_filter:
+            continue
+        spec = planned.members[0]
+        for host_plan in plan:
+            host = host_plan.host
+            if host_plan is not planned and host.dimensions and not host.dimension_filter and \
+                    len(merged_metrics(host.metrics, spec.metrics)) <= MAX_METRICS:
+                # other_bucket makes the host request the TOTAL aggregation
+                host_plan.host = replace(host, metrics=merged_metrics(host.metrics, spec.metrics), other_bucket=True)
+                host_plan.totals.append(spec)
+                plan.remove(planned)
+                break
+
+    for planned in plan:
+        reports = planned.members + planned.rollups + planned.totals
+        if len(reports) > 1:
+            planned.host = replace(planned.host, name="+".join(spec.name for spec in reports))
+    return plan
+
+_plans = {}
+_planned_requests = {}
+_lock = threading.Lock()
+
+def get_plan(report_names=None, planned=PLANNER_ENABLED):
+    # Plans are cached per set of report names; planned=False gives one
+    # request per spec
+    specs = get_report_specs()
+    key = (tuple(report_names or specs), planned)
+    with _lock:
+        plan = _plans.get(key)
+        if plan is None:
+            selected = [specs[name] for name in key[0]]
+            if planned:
+                plan = plan_reports(selected)
+            else:
+                plan = [PlannedRequest(host=replace(spec, section=()), members=[spec]) for spec in selected]
+            _plans[key] = plan
+            for planned_request in plan:
+                _planned_requests[planned_request.name] = planned_request
+            logger.debug(f"GA query plan for {len(selected)} reports: {[p.name for p in plan]}")
+        return plan
+
+def get_planned_request(name):
+    with _lock:
+        return _planned_requests[name]
@@ -0,0 +1,296 @@
+from google.analytics.data_v1beta.types import BatchRunReportsRequest, BatchRunReportsResponse
+from app.ga_cache import CACHE_PATH
+from app.ga_errors import QUOTA_ERRORS, GAQuotaError
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+QUOTA_ENABLED = os.environ.get('GA_QUOTA_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+QUOTA_PATH = os.environ.get('GA_QUOTA_PATH') or os.path.join(os.path.dirname(CACHE_PATH), 'ga_quota.sqlite3')
+# Concurrent requests per property across all worker processes; GA4 standard
+# properties allow 10, the limit starts lower and grows while requests succeed
+INITIAL_CONCURRENCY = float(os.environ.get('GA_QUOTA_INITIAL_CONCURRENCY', 4))
+MAX_CONCURRENCY = float(os.environ.get('GA_QUOTA_MAX_CONCURRENCY', 10))
+# Tokens left in the hourly or daily quota below which new requests wait for the reset
+RESERVE_TOKENS = int(os.environ.get('GA_QUOTA_RESERVE_TOKENS', 100))
+# Longest a request queues for a slot before giving up
+MAX_WAIT_SECONDS = float(os.environ.get('GA_QUOTA_MAX_WAIT', 3600))
+MAX_EXHAUSTED_RETRIES = 5
+# Leases of crashed workers stop counting against the limit after this long
+LEASE_TIMEOUT_SECONDS = 300
+POLL_INTERVAL_SECONDS = 0.05
+MAX_POLL_INTERVAL_SECONDS = 1.0
+# GA4 daily quotas reset at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+def next_hour(now):
+    return (now // 3600 + 1) * 3600
+
+def next_quota_day(now):
+    local = datetime.fromtimestamp(now, QUOTA_TIMEZONE)
+    midnight = (local + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.timestamp()
+
+def response_quotas(response):
+    # PropertyQuota messages of a RunReportResponse or every report of a batch
+    reports = response.reports if isinstance(response, BatchRunReportsResponse) else [response]
+    return [report.property_quota for report in reports if "property_quota" in report]
+
+class QuotaLimiter:
+    # AIMD concurrency limit per GA property, shared by all worker processes
+    # through SQLite: every success raises the limit by 1/limit, every
+    # RESOURCE_EXHAUSTED halves it. Requests queue for a free slot, and while
+    # the property's hourly or daily tokens are nearly used up they queue
+    # until the quota resets instead of failing
+    def __init__(self, path=QUOTA_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = self._connect()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS ga_quota_state (
+                property TEXT PRIMARY KEY,
+                concurrency REAL NOT NULL,
+                max_concurrency REAL NOT NULL,
+                paused_until REAL NOT NULL DEFAULT 0,
+                tokens_per_hour INTEGER,
+                tokens_per_day INTEGER,
+                updated_at REAL NOT NULL
+            )""")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS ga_quota_leases (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                property TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                acquired_at REAL NOT NULL
+            )""")
+        connection.execute("CREATE INDEX IF NOT EXISTS ga_quota_leases_property ON ga_quota_leases (property)")
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit mode; the read-modify-write sections use BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self, func):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(connection)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+    @staticmethod
+    def _state(connection, property_name, now):
+        row = connection.execute(
+            "SELECT concurrency, max_concurrency, paused_until FROM ga_quota_state WHERE property = ?",
+            (property_name,)).fetchone()
+        if row is None:
+            row = (INITIAL_CONCURRENCY, MAX_CONCURRENCY, 0)
+            connection.execute(
+                "INSERT INTO ga_quota_state (property, concurrency, max_concurrency, updated_at) VALUES (?, ?, ?, ?)",
+                (property_name, row[0], row[1], now))
+        return row
+
+    def try_acquire(self, property_name):
+        # Returns (lease id, 0) when a slot is free, else (None, seconds to wait)
+        def acquire(connection):
+            now = time.time()
+            concurrency, _, paused_until = self._state(connection, property_name, now)
+            if paused_until > now:
+                return None, paused_until - now
+            connection.execute("DELETE FROM ga_quota_leases WHERE property = ? AND acquired_at < ?",
+                               (property_name, now - LEASE_TIMEOUT_SECONDS))
+            in_flight = connection.execute("SELECT COUNT(*) FROM ga_quota_leases WHERE property = ?",
+                                           (property_name,)).fetchone()[0]
+            if in_flight >= max(1, int(concurrency)):
+                return None, 0
+            cursor = connection.execute("INSERT INTO ga_quota_leases (property, pid, acquired_at) VALUES (?, ?, ?)",
+                                        (property_name, os.getpid(), now))
+            return cursor.lastrowid, 0
+        return self._transaction(acquire)
+
+    def acquire(self, property_name):
+        deadline = time.time() + MAX_WAIT_SECONDS
+        interval = POLL_INTERVAL_SECONDS
+        while True:
+            lease_id, wait = self.try_acquire(property_name)
+            if lease_id is not None:
+                return lease_id
+            interval = self._wait_interval(property_name, deadline, wait, interval)
+            time.sleep(interval)
+
+    async def acquire_async(self, property_name):
+        # The SQLite transactions run in a worker thread; BEGIN IMMEDIATE can
+        # wait on other workers and must not block the event loop meanwhile
+        deadline = time.time() + MAX_WAIT_SECONDS
+        interval = POLL_INTERVAL_SECONDS
+        while True:
+            trying = asyncio.ensure_future(asyncio.to_thread(self.try_acquire, property_name))
+            try:
+                lease_id, wait = await asyncio.shield(trying)
+            except asyncio.CancelledError:
+                # A slot taken after the caller stopped waiting is handed back
+                trying.add_done_callback(lambda task: self._release_taken(task, property_name))
+                raise
+            if lease_id is not None:
+                return lease_id
+            interval = self._wait_interval(property_name, deadline, wait, interval)
+            await asyncio.sleep(interval)
+
+    def _release_taken(self, task, property_name):
+        if not task.cancelled() and task.exception() is None and task.result()[0] is not None:
+            self.release(task.result()[0], property_name)
+
+    @staticmethod
+    def _wait_interval(property_name, deadline, wait, interval):
+        now = time.time()
+        if now + wait > deadline:
+            raise GAQuotaError(f"GA quota for {property_name} did not free up within {MAX_WAIT_SECONDS:.0f}s")
+        if wait:
+            logger.debug(f"GA quota for {property_name} paused for {wait:.0f}s")
+            return min(wait, deadline - now)
+        return min(interval * 2, MAX_POLL_INTERVAL_SECONDS)
+
+    def release(self, lease_id, property_name, response=None):
+        # Frees the slot; a response counts as a success and updates the quota
+        quotas = response_quotas(response) if response is not None else []
+
+        def release(connection):
+            now = time.time()
+            connection.execute("DELETE FROM ga_quota_leases WHERE id = ?", (lease_id,))
+            if response is None:
+                return
+            concurrency, max_concurrency, paused_until = self._state(connection, property_name, now)
+            tokens_per_hour = tokens_per_day = None
+            for quota in quotas:
+                if "concurrent_requests" in quota:
+                    status = quota.concurrent_requests
+                    max_concurrency = min(MAX_CONCURRENCY, status.consumed + status.remaining) or max_concurrency
+                if "tokens_per_hour" in quota:
+                    remaining = quota.tokens_per_hour.remaining
+                    tokens_per_hour = remaining if tokens_per_hour is None else min(tokens_per_hour, remaining)
+                if "tokens_per_day" in quota:
+                    remaining = quota.tokens_per_day.remaining
+                    tokens_per_day = remaining if tokens_per_day is None else min(tokens_per_day, remaining)
+            if tokens_per_day is not None and tokens_per_day < RESERVE_TOKENS:
+                paused_until = max(paused_until, next_quota_day(now))
+            elif tokens_per_hour is not None and tokens_per_hour < RESERVE_TOKENS:
+                paused_until = max(paused_until, next_hour(now))
+            concurrency = min(max_concurrency, concurrency + 1 / concurrency)
+            connection.execute(
+                "UPDATE ga_quota_state SET concurrency = ?, max_concurrency = ?, paused_until = ?, "
+                "tokens_per_hour = COALESCE(?, tokens_per_hour), tokens_per_day = COALESCE(?, tokens_per_day), "
+                "updated_at = ? WHERE property = ?",
+                (concurrency, max_concurrency, paused_until, tokens_per_hour, tokens_per_day, now, property_name))
+        self._transaction(release)
+
+    def exhausted(self, property_name, attempt):
+        # RESOURCE_EXHAUSTED: halve the limit and hold new requests back, until
+        # the next hour if the hourly tokens were the last thing seen running low
+        def exhausted(connection):
+            now = time.time()
+            concurrency, _, paused_until = self._state(connection, property_name, now)
+            tokens_per_hour = connection.execute("SELECT tokens_per_hour FROM ga_quota_state WHERE property = ?",
+                                                 (property_name,)).fetchone()[0]
+            if tokens_per_hour is not None and tokens_per_hour < RESERVE_TOKENS:
+                resume_at = next_hour(now)
+            else:
+                resume_at = now + 2 ** attempt
+            concurrency = max(1.0, concurrency / 2)
+            connection.execute("UPDATE ga_quota_state SET concurrency = ?, paused_until = ?, updated_at = ? "
+                               "WHERE property = ?", (concurrency, max(paused_until, resume_at), now, property_name))
+            return concurrency
+        concurrency = self._transaction(exhausted)
+        logger.warning(f"GA quota exhausted for {property_name}, concurrency now {concurrency:.1f}")
+
+    def call(self, method, request):
+        # method is a client's run_report or batch_run_reports
+        for attempt in range(MAX_EXHAUSTED_RETRIES + 1):
+            lease_id = self.acquire(request.property)
+            response = None
+            try:
+                response = method(request)
+                return response
+            except QUOTA_ERRORS:
+                if attempt == MAX_EXHAUSTED_RETRIES:
+                    raise
+                self.exhausted(request.property, attempt)
+            finally:
+                self.release(lease_id, request.property, response)
+
+    async def call_async(self, method, request):
+        for attempt in range(MAX_EXHAUSTED_RETRIES + 1):
+            lease_id = await self.acquire_async(request.property)
+            response = None
+            try:
+                response = await method(request)
+                return response
+            except QUOTA_ERRORS:
+                if attempt == MAX_EXHAUSTED_RETRIES:
+                    raise
+                await asyncio.to_thread(self.exhausted, request.property, attempt)
+            finally:
+                await asyncio.to_thread(self.release, lease_id, request.property, response)
+
+    def status(self):
+        now = time.time()
+        connection = self._connect()
+        in_flight = dict(connection.execute(
+            "SELECT property, COUNT(*) FROM ga_quota_leases WHERE acquired_at >= ? GROUP BY property",
+            (now - LEASE_TIMEOUT_SECONDS,)).fetchall())
+        return {property_name: {"concurrency": concurrency, "in_flight": in_flight.get(property_name, 0),
+                                "paused_for": max(0, paused_until - now), "tokens_per_hour": tokens_per_hour,
+                                "tokens_per_day": tokens_per_day}
+                for property_name, concurrency, paused_until, tokens_per_hour, tokens_per_day in connection.execute(
+                    "SELECT property, concurrency, paused_until, tokens_per_hour, tokens_per_day FROM ga_quota_state")}
+
+def request_quota(request):
+    # Ask GA to report the property's remaining quota with the response
+    if isinstance(request, BatchRunReportsRequest):
+        for report_request in request.requests:
+            report_request.return_property_quota = True
+    else:
+        request.return_property_quota = True
+
+def run_with_quota(method, request):
+    limiter = get_quota_limiter()
+    if limiter is None:
+        return method(request)
+    request_quota(request)
+    return limiter.call(method, request)
+
+async def run_with_quota_async(method, request):
+    limiter = get_quota_limiter()
+    if limiter is None:
+        return await method(request)
+    request_quota(request)
+    return await limiter.call_async(method, request)
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_quota_limiter():
+    global _limiter
+    if not QUOTA_ENABLED:
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = QuotaLimiter()
+        return _limiter
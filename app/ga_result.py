@@ -0,0 +1,94 @@
+from google.analytics.data_v1beta.types import MetricType
+from app.ga_planner import other_row
+from app.report_specs import raw_response
+from array import array
+
+# Metric types GA returns as whole numbers; everything else (FLOAT, SECONDS,
+# CURRENCY, ...) is decoded as float64
+INTEGER_TYPES = {MetricType.TYPE_INTEGER}
+
+def plain_value(value):
+    # Whole numbers as int, the way GA writes them (e.g. SECONDS metrics)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+class DimensionColumn:
+    # Dictionary-encoded: each row stores the index of its value in values
+    def __init__(self, name):
+        self.name = name
+        self.values = []
+        self.codes = array('I')
+        self._index = {}
+
+    def append(self, value):
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+class ReportResult:
+    # Columnar form of a RunReportResponse: dimension columns are dictionary
+    # encoded and metric columns are typed arrays ('q' for INTEGER metrics,
+    # 'd' for the rest), so values are parsed once instead of on every use.
+    # The arrays support the buffer protocol, e.g. numpy.frombuffer(column, dtype).
+    # Meant for bulk consumers of full reports (stream_report(columnar=True),
+    # which `flask ga-export` writes out as CSV);
+    # the cached report path keeps format_response's dicts, since the cache
+    # stores them as JSON and the prompts take them as text
+    def __init__(self, dimension_names, metric_names, metric_types):
+        self.dimensions = [DimensionColumn(name) for name in dimension_names]
+        self.metric_names = list(metric_names)
+        self.metric_types = list(metric_types)
+        self.metrics = [array('q' if metric_type in INTEGER_TYPES else 'd') for metric_type in self.metric_types]
+        self.totals = None
+        self.row_count = 0
+
+    @classmethod
+    def from_response(cls, response, limit=None):
+        response = raw_response(response)
+        result = cls([header.name for header in response.dimension_headers],
+                     [header.name for header in response.metric_headers],
+                     [header.type_ for header in response.metric_headers])
+        parsers = [int if metric_type in INTEGER_TYPES else float for metric_type in result.metric_types]
+        for row in response.rows[:limit]:
+            for column, value in zip(result.dimensions, row.dimension_values):
+                column.append(value.value)
+            for column, parse, value in zip(result.metrics, parsers, row.metric_values):
+                column.append(parse(value.value))
+        if response.totals:
+            result.totals = [parse(value.value) for parse, value in zip(parsers, response.totals[0].metric_values)]
+        result.row_count = response.row_count
+        return result
+
+    def __len__(self):
+        return len(self.metrics[0]) if self.metrics else len(self.dimensions[0].codes) if self.dimensions else 0
+
+    def metric(self, name):
+        return self.metrics[self.metric_names.index(name)]
+
+    def dimension(self, name):
+        return next(column for column in self.dimensions if column.name == name)
+
+    def row(self, i):
+        return [column[i] for column in self.dimensions], [column[i] for column in self.metrics]
+
+    def sums(self):
+        return [sum(column) for column in self.metrics]
+
+    def to_dict(self):
+        # The dict shape format_response returns, including its "(Sonstige)" row;
+        # values are re-rendered from the numbers, so e.g. "0.110" comes back as "0.11"
+        rows = []
+        for i in range(len(self)):
+            dimension_values, metric_values = self.row(i)
+            rows.append({"dimensionValues": dimension_values,
+                         "metricValues": [str(plain_value(value)) for value in metric_values]})
+        if self.totals is not None and self.row_count > len(rows):
+            rows.append(other_row(self.metric_names, len(self.dimensions), [plain_value(value) for value in self.totals],
+                                  [plain_value(value) for value in self.sums()]))
+        return {"metricHeaders": list(self.metric_names), "rows": rows}
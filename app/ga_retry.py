@@ -0,0 +1,177 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from collections import deque
+from app.ga_errors import RETRYABLE_ERRORS
+from app.ga_quota import run_with_quota, run_with_quota_async
+from app.ga_singleflight import flight_key, get_single_flight
+import asyncio
+import os
+import random
+import threading
+import time
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Retries of UNAVAILABLE / DEADLINE_EXCEEDED with full-jitter exponential backoff
+MAX_RETRIES = int(os.environ.get('GA_MAX_RETRIES', 4))
+BACKOFF_BASE_SECONDS = float(os.environ.get('GA_BACKOFF_BASE', 0.5))
+BACKOFF_MAX_SECONDS = float(os.environ.get('GA_BACKOFF_MAX', 20))
+# Send a duplicate request once a call has been running longer than the
+# HEDGE_PERCENTILE latency of earlier calls for the same report
+HEDGE_ENABLED = os.environ.get('GA_HEDGE_REQUESTS', 'false').lower() in ('1', 'true', 'yes')
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+HEDGE_WORKERS = int(os.environ.get('GA_HEDGE_WORKERS', 16))
+# Threads running the first attempt of hedged calls
+ATTEMPT_WORKERS = int(os.environ.get('GA_ATTEMPT_WORKERS', 32))
+
+def backoff_delay(attempt):
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+class LatencyTracker:
+    # Recent successful call latencies per key (a report or planned request name)
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                latencies = self._latencies[key] = deque(maxlen=self.window)
+            latencies.append(seconds)
+
+    def percentile(self, key, percentile=HEDGE_PERCENTILE):
+        # None until there are enough samples to trust
+        with self._lock:
+            latencies = sorted(self._latencies.get(key, ()))
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(percentile * len(latencies)))]
+
+latencies = LatencyTracker()
+_attempt_executor = None
+_hedge_executor = None
+_executor_lock = threading.Lock()
+
+def get_attempt_executor():
+    global _attempt_executor
+    with _executor_lock:
+        if _attempt_executor is None:
+            _attempt_executor = ThreadPoolExecutor(max_workers=ATTEMPT_WORKERS, thread_name_prefix='ga-call')
+        return _attempt_executor
+
+def get_hedge_executor():
+    # Separate from the attempt pool, so hedges never queue behind the
+    # attempts they are meant to overtake
+    global _hedge_executor
+    with _executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='ga-hedge')
+        return _hedge_executor
+
+def timed(key, call):
+    started = time.perf_counter()
+    result = call()
+    latencies.record(key, time.perf_counter() - started)
+    return result
+
+def start_attempt(key, call):
+    # The attempt may queue while the pool is busy; started is set once it
+    # runs, so the hedge delay doesn't count the time spent queued
+    started = threading.Event()
+
+    def attempt():
+        started.set()
+        return timed(key, call)
+    return get_attempt_executor().submit(attempt), started
+
+def hedged(key, call):
+    delay = latencies.percentile(key) if HEDGE_ENABLED else None
+    if delay is None:
+        return timed(key, call)
+    first, started = start_attempt(key, call)
+    started.wait()
+    try:
+        return first.result(timeout=delay)
+    except FutureTimeoutError:
+        pass
+    logger.debug(f"Hedging {key} after {delay:.2f}s")
+    second = get_hedge_executor().submit(timed, key, call)
+    done, pending = wait([first, second], return_when=FIRST_COMPLETED)
+    succeeded = [future for future in done if future.exception() is None]
+    if succeeded or not pending:
+        # A loser still queued in its pool never runs; a running one can't be
+        # interrupted and just finishes unused
+        for future in pending:
+            future.cancel()
+        return (succeeded or list(done))[0].result()
+    # The other request may still succeed
+    return pending.pop().result()
+
+def run_ga_call(method, request, key):
+    # method is a client's run_report or batch_run_reports; key names the
+    # report for latency tracking and hedging. Identical concurrent calls
+    # share one RPC
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return call_with_retry(method, request, key)
+    return single_flight.do(flight_key(request), lambda: call_with_retry(method, request, key))
+
+def call_with_retry(method, request, key):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return hedged(key, lambda: run_with_quota(method, request))
+        except RETRYABLE_ERRORS as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"GA call for {key} failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+async def timed_async(key, call):
+    started = time.perf_counter()
+    result = await call()
+    latencies.record(key, time.perf_counter() - started)
+    return result
+
+async def hedged_async(key, call):
+    delay = latencies.percentile(key) if HEDGE_ENABLED else None
+    if delay is None:
+        return await timed_async(key, call)
+    pending = {asyncio.ensure_future(timed_async(key, call))}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return done.pop().result()
+        logger.debug(f"Hedging {key} after {delay:.2f}s")
+        pending.add(asyncio.ensure_future(timed_async(key, call)))
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [task for task in done if task.exception() is None]
+            if succeeded or not pending:
+                return (succeeded or list(done))[0].result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def run_ga_call_async(method, request, key):
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return await call_with_retry_async(method, request, key)
+    return await single_flight.do_async(flight_key(request), lambda: call_with_retry_async(method, request, key))
+
+async def call_with_retry_async(method, request, key):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await hedged_async(key, lambda: run_with_quota_async(method, request))
+        except RETRYABLE_ERRORS as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"GA call for {key} failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
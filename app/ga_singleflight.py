@@ -0,0 +1,216 @@
+from google.analytics.data_v1beta.types import BatchRunReportsRequest
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_ENABLED = os.environ.get('GA_SINGLEFLIGHT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Also coalesce across worker processes through the report cache
+SHARED_FLIGHTS_ENABLED = os.environ.get('GA_SINGLEFLIGHT_SHARED', 'false').lower() in ('1', 'true', 'yes')
+FLIGHTS_PATH = os.environ.get('GA_SINGLEFLIGHT_PATH') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'ga_flights.sqlite3')
+# A flight whose process died stops blocking others after this long
+FLIGHT_TIMEOUT_SECONDS = 300
+POLL_INTERVAL_SECONDS = 0.05
+MAX_POLL_INTERVAL_SECONDS = 0.5
+
+class _Abandoned(Exception):
+    # The leader was cancelled; a follower takes over
+    pass
+
+def flight_key(request):
+    # Identical requests (property, report spec and date ranges) share a key;
+    # the quota flag doesn't change the result
+    message = type(request)(request)
+    if isinstance(message, BatchRunReportsRequest):
+        for report_request in message.requests:
+            report_request.return_property_quota = False
+    else:
+        message.return_property_quota = False
+    raw = type(message).serialize(message)
+    return hashlib.sha256(type(message).__name__.encode('utf-8') + raw).hexdigest()
+
+class SingleFlight:
+    # Concurrent callers with the same key wait on the first caller's call and
+    # share its result (or its error) instead of sending their own
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                return future, False
+            future = self._flights[key] = Future()
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._flights[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, func):
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return future.result()
+                except _Abandoned:
+                    continue
+            try:
+                result = func()
+            except Exception as e:
+                self._finish(key, future, error=e)
+                raise
+            except BaseException:
+                self._finish(key, future, error=_Abandoned())
+                raise
+            self._finish(key, future, result)
+            return result
+
+    async def do_async(self, key, func):
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    # shield: a cancelled follower must not cancel the shared future
+                    return await asyncio.shield(asyncio.wrap_future(future))
+                except _Abandoned:
+                    continue
+            try:
+                result = await func()
+            except Exception as e:
+                self._finish(key, future, error=e)
+                raise
+            except BaseException:
+                self._finish(key, future, error=_Abandoned())
+                raise
+            self._finish(key, future, result)
+            return result
+
+class SharedFlights:
+    # Cross-process half of single-flight: a SQLite row per key marks the
+    # process fetching it; other processes wait for the row to go away and
+    # then find the result in the report cache
+    def __init__(self, path=FLIGHTS_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS ga_flights (
+                key TEXT PRIMARY KEY,
+                pid INTEGER NOT NULL,
+                started_at REAL NOT NULL
+            )""")
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _try_take(self, keys):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            connection.execute("DELETE FROM ga_flights WHERE started_at < ?", (now - FLIGHT_TIMEOUT_SECONDS,))
+            placeholders = ','.join('?' * len(keys))
+            held = connection.execute(f"SELECT COUNT(*) FROM ga_flights WHERE key IN ({placeholders})",
+                                      keys).fetchone()[0]
+            if not held:
+                connection.executemany("INSERT INTO ga_flights (key, pid, started_at) VALUES (?, ?, ?)",
+                                       [(key, os.getpid(), now) for key in keys])
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return not held
+
+    @contextmanager
+    def hold(self, keys):
+        # Returns once no other process is fetching any of the keys; the
+        # caller should re-check the cache before fetching
+        keys = sorted(set(keys))
+        if not keys:
+            yield
+            return
+        interval = POLL_INTERVAL_SECONDS
+        waited = False
+        while not self._try_take(keys):
+            waited = True
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL_SECONDS)
+        if waited:
+            logger.debug(f"Waited for {len(keys)} GA fetches in another process")
+        try:
+            yield
+        finally:
+            self._release(keys)
+
+    @asynccontextmanager
+    async def hold_async(self, keys):
+        # hold for the event loop; the SQLite calls run in a worker thread
+        keys = sorted(set(keys))
+        if not keys:
+            yield
+            return
+        interval = POLL_INTERVAL_SECONDS
+        waited = False
+        while True:
+            taking = asyncio.ensure_future(asyncio.to_thread(self._try_take, keys))
+            try:
+                taken = await asyncio.shield(taking)
+            except asyncio.CancelledError:
+                # Don't leave the keys held by a caller that stopped waiting
+                taking.add_done_callback(
+                    lambda task: not task.cancelled() and not task.exception() and task.result() and self._release(keys))
+                raise
+            if taken:
+                break
+            waited = True
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL_SECONDS)
+        if waited:
+            logger.debug(f"Waited for {len(keys)} GA fetches in another process")
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self._release, keys)
+
+    def _release(self, keys):
+        placeholders = ','.join('?' * len(keys))
+        self._connect().execute(f"DELETE FROM ga_flights WHERE key IN ({placeholders}) AND pid = ?",
+                                [*keys, os.getpid()])
+
+_single_flight = SingleFlight()
+_shared_flights = None
+_shared_lock = threading.Lock()
+
+def get_single_flight():
+    return _single_flight if SINGLEFLIGHT_ENABLED else None
+
+def get_shared_flights():
+    global _shared_flights
+    if not (SINGLEFLIGHT_ENABLED and SHARED_FLIGHTS_ENABLED):
+        return None
+    with _shared_lock:
+        if _shared_flights is None:
+            _shared_flights = SharedFlights()
+        return _shared_flights
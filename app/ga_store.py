@@ -0,0 +1,323 @@
+from google.analytics.data_v1beta.types import DateRange, Dimension, Filter, FilterExpression, FilterExpressionList, OrderBy, RunReportRequest
+from app.data_fetcher import build_requests, build_sections, format_response, report_limit, selected_specs
+from app.report_specs import ADDITIVE_METRICS, OTHER_LABEL, TOP_N, format_metric_value, raw_response
+from app.ga_cache import CACHE_PATH, FINAL_AFTER_DAYS, RECENT_TTL_SECONDS
+from app.ga_client import get_client_pool
+from app.ga_errors import wrap_error
+from app.ga_metadata import get_metadata_cache, validate_reports
+from app.ga_retry import run_ga_call
+from app.ga_index import RangeIndex
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+STORE_PATH = os.environ.get('GA_STORE_PATH') or os.path.join(os.path.dirname(CACHE_PATH), 'ga_store.sqlite3')
+# Rows per page when downloading per-day data (GA allows up to 250000)
+PAGE_SIZE = int(os.environ.get('GA_STORE_PAGE_SIZE', 100000))
+# Values (8 bytes each) the in-memory range indexes of all specs may hold;
+# the least recently used are dropped beyond it
+INDEX_MAX_VALUES = int(os.environ.get('GA_STORE_INDEX_MAX_VALUES', 4000000))
+
+def dimension_names(request):
+    return ",".join(dimension.name for dimension in request.dimensions)
+
+def day_range(start_day, end_day):
+    return [start_day + timedelta(days=i) for i in range((end_day - start_day).days + 1)]
+
+def contiguous_runs(days):
+    # [d1, d2, d3, d7, d8] -> [(d1, d3), (d7, d8)]
+    runs = []
+    for day in sorted(days):
+        if runs and day - runs[-1][1] == timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+class DailyStore:
+    # Keeps the additive metrics of every report per property, day and
+    # dimension combination, so any date range can be answered by fetching
+    # only the days that are not stored yet and summing locally
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._indexes = OrderedDict()
+        self._index_lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS ga_daily_days (
+                    spec TEXT NOT NULL,
+                    property TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    final INTEGER NOT NULL,
+                    PRIMARY KEY (spec, day)
+                )""")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS ga_daily_rows (
+                    spec TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    dimensions TEXT NOT NULL,
+                    metrics TEXT NOT NULL
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS ga_daily_rows_spec_day ON ga_daily_rows (spec, day)")
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def daily_request(request):
+        # The request as stored per day: a leading date dimension, only the
+        # additive metrics and no server-side ordering, limits or totals
+        daily = RunReportRequest(
+            property=request.property,
+            dimensions=[Dimension(name="date")] + list(request.dimensions),
+            metrics=[metric for metric in request.metrics if metric.name in ADDITIVE_METRICS],
+            dimension_filter=request.dimension_filter,
+            metric_filter=request.metric_filter,
+        )
+        return daily
+
+    @staticmethod
+    def spec_key(daily_request):
+        spec = RunReportRequest.to_json(daily_request, sort_keys=True, indent=None)
+        return hashlib.sha256(spec.encode('utf-8')).hexdigest()
+
+    def missing_days(self, spec, start_day, end_day):
+        rows = self._connect().execute(
+            "SELECT day, fetched_at, final FROM ga_daily_days WHERE spec = ? AND day BETWEEN ? AND ?",
+            (spec, start_day.isoformat(), end_day.isoformat())).fetchall()
+        now = time.time()
+        fresh = {day for day, fetched_at, final in rows if final or fetched_at > now - RECENT_TTL_SECONDS}
+        return [day for day in day_range(start_day, end_day) if day.isoformat() not in fresh]
+
+    def fetch_days(self, client, daily_request, spec, start_day, end_day):
+        request = RunReportRequest(daily_request)
+        request.date_ranges = [DateRange(start_date=start_day.isoformat(), end_date=end_day.isoformat())]
+        request.limit = PAGE_SIZE
+        # Pages are read by offset, which is only stable under a total order
+        request.order_bys = [OrderBy(dimension=OrderBy.DimensionOrderBy(dimension_name=dimension.name))
+                             for dimension in request.dimensions]
+        # Decode each metric column by its GA type instead of guessing per value
+        parsers = get_metadata_cache().metric_parsers(client, daily_request.property.split('/')[-1],
+                                                      [metric.name for metric in request.metrics])
+
+        rows = []
+        while True:
+            response = raw_response(run_ga_call(client.run_report, request, f"daily {spec}"))
+            for row in response.rows:
+                day = datetime.strptime(row.dimension_values[0].value, '%Y%m%d').date().isoformat()
+                rows.append((spec, day, json.dumps([value.value for value in row.dimension_values[1:]]),
+                             json.dumps([parse(value.value) for parse, value in zip(parsers, row.metric_values)])))
+            request.offset += len(response.rows)
+            if not response.rows or request.offset >= response.row_count:
+                break
+
+        days = day_range(start_day, end_day)
+        final_before = date.today() - timedelta(days=FINAL_AFTER_DAYS)
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("DELETE FROM ga_daily_rows WHERE spec = ? AND day BETWEEN ? AND ?",
+                               (spec, start_day.isoformat(), end_day.isoformat()))
+            connection.executemany("INSERT INTO ga_daily_rows (spec, day, dimensions, metrics) VALUES (?, ?, ?, ?)", rows)
+            connection.executemany(
+                "INSERT OR REPLACE INTO ga_daily_days (spec, property, day, fetched_at, final) VALUES (?, ?, ?, ?, ?)",
+                [(spec, daily_request.property, day.isoformat(), now, int(day < final_before)) for day in days])
+        logger.debug(f"Stored {len(rows)} daily rows for {daily_request.property} {start_day} to {end_day}")
+
+    def range_index(self, spec, metric_count):
+        # Index of the spec's final days only, so refetching the recent days
+        # doesn't invalidate it; rebuilt when days become final. None when
+        # nothing is final yet or the index wouldn't fit INDEX_MAX_VALUES
+        version = self._connect().execute(
+            "SELECT COUNT(*), MAX(fetched_at), MIN(day), MAX(day) FROM ga_daily_days WHERE spec = ? AND final = 1",
+            (spec,)).fetchone()
+        if not version[0]:
+            return None
+        with self._index_lock:
+            cached = self._indexes.get(spec)
+            if cached is not None and cached[0] == version:
+                self._indexes.move_to_end(spec)
+                return cached[1]
+        rows = self._connect().execute(
+            "SELECT r.day, r.dimensions, r.metrics FROM ga_daily_rows r JOIN ga_daily_days d "
+            "ON d.spec = r.spec AND d.day = r.day WHERE r.spec = ? AND d.final = 1", (spec,))
+        index = RangeIndex.build(rows, date.fromisoformat(version[2]), date.fromisoformat(version[3]), metric_count)
+        if index.size > INDEX_MAX_VALUES:
+            logger.debug(f"Range index of {spec} has {index.size} values, summing in SQLite instead")
+            index = None
+        with self._index_lock:
+            # A too large index is remembered as None until the version changes
+            self._indexes[spec] = (version, index)
+            self._indexes.move_to_end(spec)
+            total = sum(entry[1].size for entry in self._indexes.values() if entry[1] is not None)
+            while total > INDEX_MAX_VALUES:
+                _, (_, evicted) = self._indexes.popitem(last=False)
+                total -= evicted.size if evicted is not None else 0
+        return index
+
+    def _sql_sum(self, spec, totals, start_day, end_day):
+        for dimensions, metrics in self._connect().execute(
+                "SELECT dimensions, metrics FROM ga_daily_rows WHERE spec = ? AND day BETWEEN ? AND ?",
+                (spec, start_day.isoformat(), end_day.isoformat())):
+            key = tuple(json.loads(dimensions))
+            values = json.loads(metrics)
+            if key in totals:
+                totals[key] = [a + b for a, b in zip(totals[key], values)]
+            else:
+                totals[key] = values
+
+    def sum_range(self, spec, start_day, end_day, metric_count=None):
+        # {dimension tuple: [summed additive metric values]}; final days come
+        # from the range index, the rest (recent days) are summed in SQLite
+        index = self.range_index(spec, metric_count) if metric_count is not None else None
+        if index is None:
+            totals = {}
+            self._sql_sum(spec, totals, start_day, end_day)
+            return totals
+
+        index_start, index_end = max(start_day, index.first_day), min(end_day, index.last_day)
+        totals = index.range_totals(index_start, index_end) if index_start <= index_end else {}
+        indexed = set(day_range(index_start, index_end)) if index_start <= index_end else set()
+        # Days inside the index's span that were stored before they were final
+        indexed -= {date.fromisoformat(day) for (day,) in self._connect().execute(
+            "SELECT day FROM ga_daily_days WHERE spec = ? AND final = 0 AND day BETWEEN ? AND ?",
+            (spec, index_start.isoformat(), index_end.isoformat()))}
+        for run_start, run_end in contiguous_runs(set(day_range(start_day, end_day)) - indexed):
+            self._sql_sum(spec, totals, run_start, run_end)
+        return totals
+
+    def additive_totals(self, client, request, start_day, end_day):
+        # Fetches the missing days, then sums the additive metrics of the range
+        daily_request = self.daily_request(request)
+        spec = self.spec_key(daily_request)
+        for run_start, run_end in contiguous_runs(self.missing_days(spec, start_day, end_day)):
+            self.fetch_days(client, daily_request, spec, run_start, run_end)
+        return self.sum_range(spec, start_day, end_day, metric_count=len(daily_request.metrics))
+
+    def query(self, client, request, start_day, end_day, limit=TOP_N):
+        # Answers one report for one range in the format_response shape
+        if not answers_from_store(request):
+            return query_direct(client, request, start_day, end_day, limit)
+
+        metric_names = [metric.name for metric in request.metrics]
+        additive = [name for name in metric_names if name in ADDITIVE_METRICS]
+        order_metrics = order_metric_names(request)
+        # Same ordering as the server-side order_bys
+        sort_index = additive.index(order_metrics[0]) if order_metrics else 0
+        totals = sorted(self.additive_totals(client, request, start_day, end_day).items(),
+                        key=lambda item: item[1][sort_index], reverse=True)
+        rest = []
+        if limit is not None:
+            totals, rest = totals[:limit], totals[limit:]
+
+        non_additive = {}
+        if len(additive) < len(metric_names) and totals:
+            non_additive = query_non_additive(client, request, start_day, end_day, [key for key, _ in totals])
+
+        rows = []
+        for key, values in totals:
+            additive_values = dict(zip(additive, values))
+            other_values = non_additive.get(key, {})
+            rows.append({"dimensionValues": list(key),
+                         "metricValues": [format_metric_value(additive_values[name]) if name in additive_values
+                                          else other_values.get(name, "0") for name in metric_names]})
+        if request.metric_aggregations and rest:
+            rest_values = dict(zip(additive, [sum(column) for column in zip(*(values for _, values in rest))]))
+            rows.append({"dimensionValues": [OTHER_LABEL] * len(request.dimensions),
+                         "metricValues": [format_metric_value(rest_values[name]) if name in rest_values else ""
+                                          for name in metric_names]})
+        return {"metricHeaders": metric_names, "rows": rows}
+
+def order_metric_names(request):
+    return [order_by.metric.metric_name for order_by in request.order_bys if order_by.metric.metric_name]
+
+def answers_from_store(request):
+    # Whether DailyStore.query reads the report from stored days: it needs
+    # additive metrics, and top rows by a non-additive metric (e.g.
+    # totalUsers) can't be ranked from the daily sums, so GA ranks those
+    if not any(metric.name in ADDITIVE_METRICS for metric in request.metrics):
+        return False
+    order_metrics = order_metric_names(request)
+    return not order_metrics or order_metrics[0] in ADDITIVE_METRICS
+
+def query_direct(client, request, start_day, end_day, limit=TOP_N):
+    request = RunReportRequest(request)
+    request.date_ranges = [DateRange(start_date=start_day.isoformat(), end_date=end_day.isoformat())]
+    return format_response(run_ga_call(client.run_report, request, f"direct {dimension_names(request)}"), limit=limit)
+
+def query_non_additive(client, request, start_day, end_day, keys):
+    # Fetches the non-additive metrics for just the given dimension combinations
+    direct_request = RunReportRequest(
+        property=request.property,
+        dimensions=request.dimensions,
+        metrics=[metric for metric in request.metrics if metric.name not in ADDITIVE_METRICS],
+        date_ranges=[DateRange(start_date=start_day.isoformat(), end_date=end_day.isoformat())],
+    )
+    filters = [request.dimension_filter] if request.dimension_filter else []
+    for i, dimension in enumerate(request.dimensions):
+        values = sorted({key[i] for key in keys})
+        filters.append(FilterExpression(filter=Filter(field_name=dimension.name,
+                                                      in_list_filter=Filter.InListFilter(values=values))))
+    if filters:
+        direct_request.dimension_filter = FilterExpression(and_group=FilterExpressionList(expressions=filters))
+
+    response = format_response(run_ga_call(client.run_report, direct_request,
+                                           f"non-additive {dimension_names(request)}"), limit=None)
+    return {tuple(row["dimensionValues"]): dict(zip(response["metricHeaders"], row["metricValues"]))
+            for row in response["rows"]}
+
+def fetch_periods_from_store(property_id, periods):
+    # Drop-in for data_fetcher.fetch_periods backed by the daily store
+    store = get_daily_store()
+    period_dates = {name: (start_date.date() if isinstance(start_date, datetime) else start_date,
+                           end_date.date() if isinstance(end_date, datetime) else end_date)
+                    for name, start_date, end_date in periods}
+    requests = build_requests(property_id, [])
+
+    data = {name: {} for name in period_dates}
+    with get_client_pool().client() as client:
+        validate_reports(client, property_id, selected_specs())
+        with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+            future_to_report = {executor.submit(store.query, client, request, start_day, end_day, report_limit(report_name)):
+                                (report_name, name)
+                                for report_name, request in requests.items()
+                                for name, (start_day, end_day) in period_dates.items()}
+            for future in as_completed(future_to_report):
+                report_name, name = future_to_report[future]
+                try:
+                    data[name][report_name] = future.result()
+                except Exception as e:
+                    raise wrap_error(e, f"{report_name} report", report_name)
+
+    return {name: build_sections(start_day.isoformat(), end_day.isoformat(), data[name])
+            for name, (start_day, end_day) in period_dates.items()}
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_daily_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DailyStore()
+            logger.debug(f"GA daily store opened at {_store.path}")
+        return _store
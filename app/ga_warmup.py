@@ -0,0 +1,156 @@
+from app.ga_cache import CACHE_PATH, get_report_cache
+from app.ga_quota import get_quota_limiter
+from app.data_fetcher import get_fetcher
+from app.reports import monthly_periods, yoy_periods
+from datetime import datetime, timedelta
+import fcntl
+import os
+import random
+import threading
+import time
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.environ.get('GA_WARMUP_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Local hour of the daily run, plus up to WARMUP_JITTER_SECONDS so several
+# deployments don't hit GA at the same second
+WARMUP_HOUR = int(os.environ.get('GA_WARMUP_HOUR', 3))
+WARMUP_JITTER_SECONDS = int(os.environ.get('GA_WARMUP_JITTER', 1800))
+# Pause between properties, on top of the quota limiter's own pacing
+WARMUP_PACING_SECONDS = float(os.environ.get('GA_WARMUP_PACING', 5))
+# Properties with fewer hourly tokens left are skipped, leaving them to interactive use
+WARMUP_RESERVE_TOKENS = int(os.environ.get('GA_WARMUP_RESERVE_TOKENS', 2000))
+RETRY_SECONDS = 3600
+# Only one worker process runs a day's warm-up
+LOCK_PATH = os.path.join(os.path.dirname(CACHE_PATH), 'ga_warmup.lock')
+
+def previous_month(today):
+    end_date = datetime(today.year, today.month, 1) - timedelta(days=1)
+    return datetime(end_date.year, end_date.month, 1), end_date
+
+def warmup_periods(today):
+    # The ranges a yoy or monthly report on the previous month requests, i.e.
+    # the previous month, the same month last year and the month before
+    start_date, end_date = previous_month(today)
+    periods = {}
+    for name, period_start, period_end in yoy_periods(start_date, end_date) + monthly_periods(start_date, end_date):
+        periods.setdefault((period_start, period_end), name)
+    return [(name, period_start, period_end) for (period_start, period_end), name in periods.items()]
+
+def next_scheduled(now):
+    # The next WARMUP_HOUR:00, before jitter
+    run_at = now.replace(hour=WARMUP_HOUR, minute=0, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    return run_at
+
+def next_run(now):
+    return next_scheduled(now) + timedelta(seconds=random.uniform(0, WARMUP_JITTER_SECONDS))
+
+def quota_allows(property_id):
+    limiter = get_quota_limiter()
+    if limiter is None:
+        return True
+    status = limiter.status().get(f"properties/{property_id}")
+    if status is None:
+        return True
+    tokens_per_hour = status["tokens_per_hour"]
+    return not status["paused_for"] and (tokens_per_hour is None or tokens_per_hour >= WARMUP_RESERVE_TOKENS)
+
+def keep_warm(property_id, periods):
+    # Ranges ending in the last few days (the previous month, on the first
+    # days of a month) are cached only briefly; keep what was just fetched
+    # until the next run starts, which fetches it again
+    cache = get_report_cache()
+    if cache is None:
+        return
+    cache.keep_until(f"properties/{property_id}",
+                     [(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+                      for _, start_date, end_date in periods],
+                     next_scheduled(datetime.now()).timestamp())
+
+def warm_up(accounts, today=None):
+    # Fetches the standard report periods of every account into the report
+    # cache, one property at a time; returns the names that were skipped or failed
+    periods = warmup_periods(today or datetime.now())
+    skipped = []
+    for i, (name, property_id) in enumerate(accounts.items()):
+        if i:
+            time.sleep(WARMUP_PACING_SECONDS)
+        if not quota_allows(property_id):
+            logger.info(f"Skipping warm-up of {name}: GA quota is running low")
+            skipped.append(name)
+            continue
+        try:
+            started = time.time()
+            get_fetcher()(str(property_id), periods)
+            keep_warm(property_id, periods)
+            logger.info(f"Warmed up {name} ({property_id}) in {time.time() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"Error warming up {name} ({property_id}): {str(e)}")
+            skipped.append(name)
+    return skipped
+
+def run_once(accounts, today=None, retry=False):
+    # warm_up unless another process holds the lock or already ran today;
+    # retry=True re-runs skipped accounts on a day that was already marked done
+    today = today or datetime.now()
+    os.makedirs(os.path.dirname(LOCK_PATH), exist_ok=True)
+    with open(LOCK_PATH, 'a+') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.debug("GA warm-up already running in another process")
+            return None
+        lock_file.seek(0)
+        if not retry and lock_file.read().strip() == today.date().isoformat():
+            return None
+        skipped = warm_up(accounts, today)
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(today.date().isoformat())
+        return skipped
+
+class WarmupScheduler(threading.Thread):
+    def __init__(self, accounts):
+        super().__init__(name='ga-warmup', daemon=True)
+        self.accounts = accounts
+        self._stop_event = threading.Event()
+
+    def run(self):
+        # Accounts skipped for quota or errors are retried an hour later
+        pending = {}
+        while True:
+            if pending:
+                run_at = datetime.now() + timedelta(seconds=RETRY_SECONDS)
+            else:
+                run_at = next_run(datetime.now())
+            logger.debug(f"Next GA warm-up at {run_at:%Y-%m-%d %H:%M:%S}")
+            if self._stop_event.wait((run_at - datetime.now()).total_seconds()):
+                return
+            try:
+                skipped = run_once(pending or self.accounts, retry=bool(pending))
+            except Exception as e:
+                logger.error(f"Error in GA warm-up: {str(e)}", exc_info=True)
+                skipped = None
+            pending = {name: self.accounts[name] for name in skipped or ()}
+
+    def stop(self):
+        self._stop_event.set()
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def start_warmup_scheduler(accounts):
+    global _scheduler
+    if not WARMUP_ENABLED:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = WarmupScheduler(accounts)
+            _scheduler.start()
+            logger.info(f"GA warm-up scheduled daily at {WARMUP_HOUR:02d}:00 for {len(accounts)} properties")
+        return _scheduler
@@ -1,4 +1,5 @@
 from openai import OpenAI
+from app.cassette import openai_client_options
 import os
 import logging
 
@@ -6,7 +7,12 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-client = OpenAI()
+# OPENAI_BASE_URL points the client at another server, e.g. the local stand-in
+# in benchmarks/fake_openai_server.py
+client = OpenAI(base_url=os.environ.get('OPENAI_BASE_URL'), **openai_client_options())
+
+def build_prompt(last_year_data, current_year_data):
+    return f"Schreibe einen Bericht über die performance meiner Website und vergleiche die Daten vom letztem Zeitraum mit den aktuellen Daten. Analysiere die Daten gründlich und vollständig. Daten des letzten Zeitraums: {last_year_data}. Daten diesen Zeitraums:{current_year_data}."
 
 def api_call(last_year_data, current_year_data):
     logger.info("Starting API call...")
@@ -17,7 +23,7 @@ def api_call(last_year_data, current_year_data):
         message = client.beta.threads.messages.create(
             thread_id=thread.id,
             role="user",
-            content= f"Schreibe einen Bericht über die performance meiner Website und vergleiche die Daten vom letztem Zeitraum mit den aktuellen Daten. Analysiere die Daten gründlich und vollständig. Daten des letzten Zeitraums: {last_year_data}. Daten diesen Zeitraums:{current_year_data}."
+            content=build_prompt(last_year_data, current_year_data)
         )
         logger.info(f"Created message with ID: {message.id}")
         
@@ -0,0 +1,187 @@
+from google.analytics.data_v1beta.types import Dimension, FilterExpression, Metric, MetricAggregation, OrderBy, RunReportRequest, RunReportResponse
+from dataclasses import dataclass
+import json
+import os
+import threading
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Rows kept per report and period, fetched server-side ordered by the main metric
+TOP_N = 10
+# GA applies the row limit across all DateRanges of a request, so leave some
+# headroom for periods whose top rows rank below another period's. Periods that
+# still come back short are refetched on their own (PlannedRequest.split)
+MULTI_RANGE_HEADROOM = 2
+
+OTHER_LABEL = "(Sonstige)"
+# Metrics whose value over a range or a set of rows is the sum of the parts;
+# everything else (totalUsers, engagementRate, per-user ratios) is not
+ADDITIVE_METRICS = {"sessions", "screenPageViews", "newUsers", "conversions", "userEngagementDuration", "eventCount"}
+
+def parse_metric_value(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+def raw_response(response):
+    # The protobuf message under a proto-plus RunReportResponse, or parsed from
+    # its serialized bytes; reading fields on it skips proto-plus's per-access
+    # wrapper objects, which dominate formatting large responses
+    if isinstance(response, (bytes, bytearray, memoryview)):
+        return RunReportResponse.pb().FromString(bytes(response))
+    if isinstance(response, RunReportResponse):
+        return RunReportResponse.pb(response)
+    return response
+
+def format_metric_value(value):
+    # Whole floats (e.g. SECONDS metrics decoded as float) print like GA's integers
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+@dataclass(frozen=True)
+class ReportSpec:
+    name: str
+    # Path of the report in the fetch_data result, e.g. ("Zielgruppe", "Browser")
+    section: tuple
+    metrics: tuple
+    dimensions: tuple = ()
+    order_by: str = None
+    limit: int = TOP_N
+    # Append a "(Sonstige)" row built from the TOTAL aggregation
+    other_bucket: bool = False
+    # FilterExpression in GA's JSON form, e.g. {"filter": {"fieldName": ..., ...}}
+    dimension_filter: str = None
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            name=data['name'],
+            section=tuple(data['section']) if isinstance(data['section'], list) else (data['section'],),
+            metrics=tuple(data['metrics']),
+            dimensions=tuple(data.get('dimensions', ())),
+            order_by=data.get('order_by'),
+            limit=data.get('limit', TOP_N),
+            other_bucket=data.get('other_bucket', False),
+            dimension_filter=json.dumps(data['dimension_filter']) if data.get('dimension_filter') else None,
+        )
+
+    def template(self, property_id):
+        # Everything but the date ranges and the row limit, which depend on the call
+        request = RunReportRequest(
+            property=f"properties/{property_id}",
+            dimensions=[Dimension(name=name) for name in self.dimensions],
+            metrics=[Metric(name=name) for name in self.metrics],
+        )
+        if self.order_by:
+            request.order_bys = [OrderBy(metric=OrderBy.MetricOrderBy(metric_name=self.order_by), desc=True)]
+        if self.other_bucket:
+            request.metric_aggregations = [MetricAggregation.TOTAL]
+        if self.dimension_filter:
+            request.dimension_filter = FilterExpression.from_json(self.dimension_filter)
+        return RunReportRequest.serialize(request)
+
+    def build_request(self, property_id, date_ranges):
+        request = RunReportRequest.deserialize(get_template(self, str(property_id)))
+        request.date_ranges = date_ranges
+        if self.limit:
+            request.limit = self.limit if len(date_ranges) <= 1 else self.limit * len(date_ranges) * MULTI_RANGE_HEADROOM
+        return request
+
+# Listed in the order the sections appear in the report data
+DEFAULT_REPORT_SPECS = [
+    ReportSpec(
+        name="overall",
+        section=("Kennzahlen",),
+        metrics=("newUsers", "totalUsers", "sessions", "screenPageViews", "engagementRate",
+                 "screenPageViewsPerUser", "userEngagementDuration"),
+        limit=None,
+    ),
+    ReportSpec(
+        name="browser",
+        section=("Zielgruppe", "Browser"),
+        dimensions=("browser",),
+        metrics=("newUsers", "totalUsers", "conversions", "engagementRate", "userEngagementDuration"),
+        order_by="totalUsers",
+    ),
+    ReportSpec(
+        name="devices",
+        section=("Zielgruppe", "Geräte"),
+        dimensions=("deviceCategory",),
+        metrics=("totalUsers",),
+        order_by="totalUsers",
+    ),
+    ReportSpec(
+        name="user_source",
+        section=("Besucher Quellen",),
+        dimensions=("firstUserSource", "firstUserMedium"),
+        metrics=("totalUsers", "newUsers", "sessions", "userEngagementDuration", "engagementRate", "conversions"),
+        order_by="totalUsers",
+        other_bucket=True,
+    ),
+    ReportSpec(
+        name="city",
+        section=("Top Städte",),
+        dimensions=("city",),
+        metrics=("newUsers", "totalUsers", "sessions", "engagementRate", "userEngagementDuration", "eventCountPerUser"),
+        order_by="totalUsers",
+        other_bucket=True,
+    ),
+    ReportSpec(
+        name="events",
+        section=("Conversions und Ereignisse",),
+        dimensions=("eventName",),
+        metrics=("conversions",),
+        order_by="conversions",
+        other_bucket=True,
+    ),
+    ReportSpec(
+        name="conversion_origin",
+        section=("Herkunft der Conversions ",),
+        dimensions=("eventName", "city"),
+        metrics=("conversions",),
+        order_by="conversions",
+        other_bucket=True,
+    ),
+    ReportSpec(
+        name="page_url",
+        section=("Top Seiten",),
+        dimensions=("fullPageUrl",),
+        metrics=("newUsers", "totalUsers", "screenPageViews", "userEngagementDuration"),
+        order_by="screenPageViews",
+        other_bucket=True,
+    ),
+]
+
+def load_report_specs(path):
+    # JSON file with a list of spec objects, see ReportSpec.from_dict
+    with open(path, encoding='utf-8') as f:
+        return [ReportSpec.from_dict(data) for data in json.load(f)]
+
+_specs = None
+_templates = {}
+_lock = threading.Lock()
+
+def get_report_specs():
+    global _specs
+    with _lock:
+        if _specs is None:
+            path = os.environ.get('GA_REPORT_SPECS_FILE')
+            specs = load_report_specs(path) if path else DEFAULT_REPORT_SPECS
+            _specs = {spec.name: spec for spec in specs}
+            logger.debug(f"Loaded {len(_specs)} report specs from {path or 'defaults'}")
+        return _specs
+
+def get_template(spec, property_id):
+    # Serialized request template per spec and property, built once
+    key = (spec, property_id)
+    template = _templates.get(key)
+    if template is None:
+        template = _templates[key] = spec.template(property_id)
+    return template
@@ -1,5 +1,6 @@
 import logging
-from app.data_fetcher import fetch_data
+from app.cassette import record_report
+from app.data_fetcher import get_fetcher
 from datetime import timedelta
 
 # Set up logging
@@ -13,14 +14,25 @@ except ImportError:
     logger.warning("Could not import api_call function. OpenAI integration will not be available.")
     api_call = None
 
+def yoy_periods(start_date, end_date):
+    return [
+        ("current_year", start_date, end_date),
+        ("last_year", start_date - timedelta(days=365), end_date - timedelta(days=365)),
+    ]
+
+def monthly_periods(start_date, end_date):
+    return [
+        ("current_month", start_date, end_date),
+        ("last_month", start_date - timedelta(days=30), end_date - timedelta(days=30)),  # Approximate
+    ]
+
 def generate_yoy_report(property_id, start_date, end_date):
     try:
         property_id = str(property_id)  # Ensure property_id is a string
-        current_year_data = fetch_data(property_id, start_date, end_date)
-
-        last_year_start = start_date - timedelta(days=365)
-        last_year_end = end_date - timedelta(days=365)
-        last_year_data = fetch_data(property_id, last_year_start, last_year_end)
+        record_report('yoy', property_id, start_date, end_date)
+        data = get_fetcher()(property_id, yoy_periods(start_date, end_date))
+        current_year_data = data["current_year"]
+        last_year_data = data["last_year"]
 
         report = f"Monatlicher Report (Jahresvergleich) für den Zeitraum: {start_date.strftime('%Y-%m-%d')} bis {end_date.strftime('%Y-%m-%d')}\n\n"
 
@@ -52,11 +64,10 @@ def generate_yoy_report(property_id, start_date, end_date):
 def generate_monthly_report(property_id, start_date, end_date):
     try:
         property_id = str(property_id)  # Ensure property_id is a string
-        current_month_data = fetch_data(property_id, start_date, end_date)
-
-        last_month_start = start_date - timedelta(days=30)  # Approximate
-        last_month_end = end_date - timedelta(days=30)
-        last_month_data = fetch_data(property_id, last_month_start, last_month_end)
+        record_report('monthly', property_id, start_date, end_date)
+        data = get_fetcher()(property_id, monthly_periods(start_date, end_date))
+        current_month_data = data["current_month"]
+        last_month_data = data["last_month"]
 
         report = f"Monatlicher Report (Monatsvergleich) für den Zeitraum: {start_date.strftime('%Y-%m-%d')} bis {end_date.strftime('%Y-%m-%d')}\n\n"
 
@@ -0,0 +1,581 @@
+import os
+import sys
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import logging
+from collections import Counter
+from concurrent import futures
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.analytics.data_v1beta.types import (BatchRunReportsRequest, BatchRunReportsResponse,
+                                                CheckCompatibilityRequest, CheckCompatibilityResponse, Compatibility,
+                                                Filter, GetMetadataRequest, Metadata, MetricAggregation, MetricType,
+                                                RunReportRequest, RunReportResponse)
+from google.protobuf import json_format
+import grpc
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Local stand-in for the GA4 Data API. Serves RunReport, BatchRunReports,
+# GetMetadata and CheckCompatibility over gRPC and REST with synthetic but
+# realistic data, so the fetch path can be measured without GA quota:
+#   python benchmarks/fake_ga_server.py [--grpc-port 50051] [--http-port 8085] [--config fake_ga.json]
+# and point the app at it with GA_API_ENDPOINT=http://localhost:<port> (the
+# gRPC port, or the HTTP port with GA_TRANSPORT=rest).
+#
+# The config file is JSON: {"default": {...}, "properties": {"<id>": {...}}},
+# where a property's settings override the defaults key by key, e.g.
+#   {"properties": {"123": {"scale": 50000, "cardinality": {"fullPageUrl": 20000},
+#                           "latency": {"distribution": "lognormal", "median_ms": 400, "sigma": 0.6},
+#                           "errors": {"UNAVAILABLE": 0.02}}}}
+
+SERVICE = 'google.analytics.data.v1beta.BetaAnalyticsData'
+
+DEFAULT_CONFIG = {
+    # Daily users of the top row; row n gets scale * (n + 1) ** -zipf, so the
+    # long tail runs out of users like real traffic does
+    "scale": 2000,
+    "zipf": 1.1,
+    # Distinct values per dimension; dimensions with a vocabulary default to its size
+    "cardinality": {"default": 500},
+    # Rows per date range before limit and offset
+    "max_rows": 100000,
+    # fixed (median_ms), uniform (min_ms, max_ms) or lognormal (median_ms,
+    # sigma); tail_probability adds tail_ms to that share of calls, and
+    # per_row_ms charges for rows returned
+    "latency": {"distribution": "lognormal", "median_ms": 0, "sigma": 0.5, "per_row_ms": 0,
+                "tail_probability": 0, "tail_ms": 0},
+    # Chance per call of each status, e.g. {"UNAVAILABLE": 0.02, "RESOURCE_EXHAUSTED": 0.01}
+    "errors": {},
+    # GA's per-property quotas
+    "concurrent_requests": 10,
+    "tokens_per_hour": 40000,
+    "tokens_per_day": 200000,
+    # Extra fields for getMetadata, e.g. "customEvent:plan"
+    "custom_dimensions": [],
+    "custom_metrics": [],
+    # Field pairs checkCompatibility reports as incompatible
+    "incompatible": [],
+    # GA doesn't promise an order among rows that tie on every order_by;
+    # true shuffles them on every call, as offset paging may then see them
+    "shuffle_ties": False,
+}
+
+VOCABULARIES = {
+    "deviceCategory": ["desktop", "mobile", "tablet", "smart tv"],
+    "browser": ["Chrome", "Safari", "Edge", "Firefox", "Samsung Internet", "Opera", "Android Webview",
+                "Safari (in-app)"],
+    "operatingSystem": ["Windows", "iOS", "Android", "Macintosh", "Linux", "Chrome OS"],
+    "country": ["Germany", "Austria", "Switzerland", "United States", "Netherlands", "France", "Italy",
+                "United Kingdom", "Poland", "Spain"],
+    "city": ["Berlin", "Hamburg", "Munich", "Cologne", "Frankfurt", "Stuttgart", "Vienna", "Zurich",
+             "Düsseldorf", "Leipzig", "(not set)"],
+    "firstUserMedium": ["organic", "(none)", "cpc", "referral", "email", "social", "(not set)"],
+    "sessionMedium": ["organic", "(none)", "cpc", "referral", "email", "social", "(not set)"],
+    "firstUserSource": ["google", "(direct)", "bing", "facebook.com", "instagram.com", "newsletter",
+                        "duckduckgo", "linkedin.com"],
+    "sessionSource": ["google", "(direct)", "bing", "facebook.com", "instagram.com", "newsletter",
+                      "duckduckgo", "linkedin.com"],
+    "eventName": ["page_view", "session_start", "user_engagement", "first_visit", "scroll", "click",
+                  "form_start", "form_submit", "file_download", "generate_lead", "purchase", "video_start"],
+}
+PAGE_DIMENSIONS = {"fullPageUrl": "www.example.com/", "pageLocation": "https://www.example.com/",
+                   "pagePath": "/", "landingPage": "/"}
+
+DIMENSIONS = ["date", "dateHour", "dayOfWeek", "month", "year", "city", "region", "country", "continent",
+              "deviceCategory", "browser", "operatingSystem", "platform", "language", "eventName",
+              "firstUserSource", "firstUserMedium", "firstUserCampaignName", "firstUserDefaultChannelGroup",
+              "sessionSource", "sessionMedium", "sessionCampaignName", "sessionDefaultChannelGroup",
+              "fullPageUrl", "pageLocation", "pagePath", "pageTitle", "landingPage", "hostName", "newVsReturning"]
+INTEGER_METRICS = ["activeUsers", "newUsers", "totalUsers", "sessions", "engagedSessions", "screenPageViews",
+                   "eventCount", "conversions", "keyEvents"]
+FLOAT_METRICS = ["engagementRate", "bounceRate", "eventCountPerUser", "sessionsPerUser",
+                 "screenPageViewsPerSession", "screenPageViewsPerUser", "eventsPerSession", "totalRevenue"]
+SECONDS_METRICS = ["userEngagementDuration", "averageSessionDuration"]
+# Summed into totals; everything else is averaged
+ADDITIVE_METRICS = set(INTEGER_METRICS) | {"userEngagementDuration", "totalRevenue"}
+
+HTTP_STATUS = {"INVALID_ARGUMENT": 400, "PERMISSION_DENIED": 403, "NOT_FOUND": 404, "RESOURCE_EXHAUSTED": 429,
+               "INTERNAL": 500, "UNAVAILABLE": 503, "DEADLINE_EXCEEDED": 504}
+
+class FakeError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def merge_config(base, override):
+    merged = dict(base)
+    for key, value in override.items():
+        merged[key] = {**merged[key], **value} if isinstance(merged.get(key), dict) else value
+    return merged
+
+def metric_type(name):
+    if name in INTEGER_METRICS:
+        return MetricType.TYPE_INTEGER
+    if name in SECONDS_METRICS:
+        return MetricType.TYPE_SECONDS
+    if name == "totalRevenue":
+        return MetricType.TYPE_CURRENCY
+    return MetricType.TYPE_FLOAT
+
+def row_metrics(users, rng):
+    # One row's metrics, consistent with each other
+    sessions = users * rng.uniform(1.1, 1.6)
+    engaged = sessions * rng.uniform(0.45, 0.75)
+    views = sessions * rng.uniform(1.5, 4.0)
+    events = views * rng.uniform(2.0, 4.0)
+    duration = users * rng.uniform(20, 120)
+    conversions = sessions * rng.uniform(0, 0.05)
+    return {"activeUsers": users * 0.95, "newUsers": users * rng.uniform(0.4, 0.8), "totalUsers": users,
+            "sessions": sessions, "engagedSessions": engaged, "screenPageViews": views, "eventCount": events,
+            "conversions": conversions, "keyEvents": conversions, "engagementRate": engaged / sessions,
+            "bounceRate": 1 - engaged / sessions, "eventCountPerUser": events / users,
+            "sessionsPerUser": sessions / users, "screenPageViewsPerSession": views / sessions,
+            "screenPageViewsPerUser": views / users, "eventsPerSession": events / sessions,
+            "totalRevenue": conversions * rng.uniform(20, 80), "userEngagementDuration": duration,
+            "averageSessionDuration": duration / sessions}
+
+def format_value(name, value):
+    if metric_type(name) == MetricType.TYPE_INTEGER or name == "userEngagementDuration":
+        return str(int(round(value)))
+    return repr(round(value, 6))
+
+def dimension_value(name, index):
+    vocabulary = VOCABULARIES.get(name)
+    if vocabulary is not None and index < len(vocabulary):
+        return vocabulary[index]
+    if name in PAGE_DIMENSIONS:
+        return f"{PAGE_DIMENSIONS[name]}page-{index}" if index else PAGE_DIMENSIONS[name]
+    return f"{name}_{index}"
+
+def range_days(date_range):
+    try:
+        start = datetime.strptime(date_range.start_date, '%Y-%m-%d')
+        end = datetime.strptime(date_range.end_date, '%Y-%m-%d')
+    except ValueError:
+        raise FakeError("INVALID_ARGUMENT", f"Invalid date range {date_range.start_date} to {date_range.end_date}")
+    if end < start:
+        raise FakeError("INVALID_ARGUMENT", "The end date of a date range is before its start date")
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+def string_matches(string_filter, value):
+    expected, actual = string_filter.value, value
+    if not string_filter.case_sensitive:
+        expected, actual = expected.lower(), actual.lower()
+    match_type = string_filter.match_type
+    if match_type == Filter.StringFilter.MatchType.BEGINS_WITH:
+        return actual.startswith(expected)
+    if match_type == Filter.StringFilter.MatchType.ENDS_WITH:
+        return actual.endswith(expected)
+    if match_type == Filter.StringFilter.MatchType.CONTAINS:
+        return expected in actual
+    if match_type in (Filter.StringFilter.MatchType.FULL_REGEXP, Filter.StringFilter.MatchType.PARTIAL_REGEXP):
+        pattern = re.compile(string_filter.value, 0 if string_filter.case_sensitive else re.IGNORECASE)
+        return bool(pattern.fullmatch(value) if match_type == Filter.StringFilter.MatchType.FULL_REGEXP
+                    else pattern.search(value))
+    return actual == expected
+
+def filter_matches(expression, values):
+    # expression is a raw FilterExpression, values {dimension name: value}
+    kind = expression.WhichOneof('expr')
+    if kind == 'and_group':
+        return all(filter_matches(child, values) for child in expression.and_group.expressions)
+    if kind == 'or_group':
+        return any(filter_matches(child, values) for child in expression.or_group.expressions)
+    if kind == 'not_expression':
+        return not filter_matches(expression.not_expression, values)
+    if kind != 'filter':
+        return True
+    field_filter = expression.filter
+    value = values.get(field_filter.field_name, "")
+    if field_filter.HasField('string_filter'):
+        return string_matches(field_filter.string_filter, value)
+    if field_filter.HasField('in_list_filter'):
+        in_list = field_filter.in_list_filter
+        if in_list.case_sensitive:
+            return value in in_list.values
+        return value.lower() in {item.lower() for item in in_list.values}
+    return True
+
+class FakeGA:
+    # The API's behaviour, independent of gRPC and REST. Methods take and
+    # return raw protobuf messages and raise FakeError for a failed call
+    def __init__(self, config=None):
+        config = config or {}
+        self.default = merge_config(DEFAULT_CONFIG, config.get("default", {}))
+        self.properties = {str(key): merge_config(self.default, value)
+                           for key, value in config.get("properties", {}).items()}
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._in_flight = Counter()
+        # property: (hour started, tokens this hour, day started, tokens today)
+        self._tokens = {}
+
+    def settings(self, property_name):
+        return self.properties.get(property_name.split('/')[-1], self.default)
+
+    def call(self, method, property_name, func):
+        # func(settings) returns (response, rows returned)
+        settings = self.settings(property_name)
+        started = time.perf_counter()
+        with self._lock:
+            self.stats[method] += 1
+            if self._in_flight[property_name] >= settings["concurrent_requests"]:
+                self.stats["RESOURCE_EXHAUSTED"] += 1
+                raise FakeError("RESOURCE_EXHAUSTED", "Exhausted concurrent requests quota.")
+            self._in_flight[property_name] += 1
+        try:
+            rng = random.Random()
+            for status, probability in settings["errors"].items():
+                if rng.random() < probability:
+                    self.sleep(settings, started, rng, 0)
+                    raise FakeError(status, f"Injected {status}")
+            response, rows = func(settings)
+            self.sleep(settings, started, rng, rows)
+            return response
+        except FakeError as e:
+            with self._lock:
+                self.stats[e.status] += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight[property_name] -= 1
+
+    def sleep(self, settings, started, rng, rows):
+        latency = settings["latency"]
+        distribution = latency.get("distribution", "fixed")
+        if distribution == "uniform":
+            milliseconds = rng.uniform(latency.get("min_ms", 0), latency.get("max_ms", 0))
+        elif distribution == "lognormal":
+            milliseconds = rng.lognormvariate(0, latency.get("sigma", 0.5)) * latency.get("median_ms", 0)
+        else:
+            milliseconds = latency.get("median_ms", 0)
+        if rng.random() < latency.get("tail_probability", 0):
+            milliseconds += latency.get("tail_ms", 0)
+        milliseconds += rows * latency.get("per_row_ms", 0)
+        # Building the response counts towards the latency
+        remaining = milliseconds / 1000 - (time.perf_counter() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def charge(self, property_name, settings, tokens):
+        # Spends tokens; returns {PropertyQuota field: (consumed, remaining)}
+        now = time.time()
+        with self._lock:
+            hour_start, hour_tokens, day_start, day_tokens = self._tokens.get(property_name, (now, 0, now, 0))
+            if now - hour_start >= 3600:
+                hour_start, hour_tokens = now, 0
+            if now - day_start >= 86400:
+                day_start, day_tokens = now, 0
+            if hour_tokens >= settings["tokens_per_hour"] or day_tokens >= settings["tokens_per_day"]:
+                raise FakeError("RESOURCE_EXHAUSTED", "Exhausted property tokens quota.")
+            hour_tokens += tokens
+            day_tokens += tokens
+            self._tokens[property_name] = (hour_start, hour_tokens, day_start, day_tokens)
+            concurrent = self._in_flight[property_name]
+        return {"tokens_per_hour": (tokens, max(0, settings["tokens_per_hour"] - hour_tokens)),
+                "tokens_per_day": (tokens, max(0, settings["tokens_per_day"] - day_tokens)),
+                "concurrent_requests": (concurrent, max(0, settings["concurrent_requests"] - concurrent))}
+
+    def check_fields(self, settings, dimensions, metrics):
+        known_dimensions = set(DIMENSIONS) | set(settings["custom_dimensions"])
+        known_metrics = set(INTEGER_METRICS + FLOAT_METRICS + SECONDS_METRICS) | set(settings["custom_metrics"])
+        for name in dimensions:
+            if name not in known_dimensions:
+                raise FakeError("INVALID_ARGUMENT", f"Field {name} is not a valid dimension.")
+        for name in metrics:
+            if name not in known_metrics:
+                raise FakeError("INVALID_ARGUMENT", f"Field {name} is not a valid metric.")
+
+    def cardinality(self, settings, name):
+        cardinality = settings["cardinality"]
+        if name in cardinality:
+            return cardinality[name]
+        if name in VOCABULARIES:
+            return len(VOCABULARIES[name])
+        return cardinality["default"]
+
+    def build_rows(self, request, settings, dimensions, metrics, range_name, days):
+        # [(dimension values, metric values)] of one date range, most users first
+        other_dimensions = [name for name in dimensions if name != 'date']
+        radixes = [self.cardinality(settings, name) for name in other_dimensions]
+        combinations = 1
+        for radix in radixes:
+            combinations *= radix
+        by_day = 'date' in dimensions
+        periods = [[day] for day in days] if by_day else [days]
+        per_period = max(1, min(combinations, settings["max_rows"] // len(periods)))
+        rows = []
+        for period in periods:
+            # Weekends are quieter
+            day_factor = sum(0.7 if day.weekday() >= 5 else 1.0 for day in period)
+            for rank in range(per_period):
+                users = settings["scale"] * day_factor * (rank + 1) ** -settings["zipf"]
+                if users < 1:
+                    break
+                index, values = rank, {}
+                for name, radix in zip(other_dimensions, radixes):
+                    index, position = divmod(index, radix)
+                    values[name] = dimension_value(name, position)
+                if by_day:
+                    values['date'] = period[0].strftime('%Y%m%d')
+                if request.HasField('dimension_filter') and not filter_matches(request.dimension_filter, values):
+                    continue
+                # The same property, day(s) and dimension values always get the same numbers
+                rng = random.Random(f"{request.property}|{period[0]:%Y%m%d}|{len(period)}|"
+                                    f"{'|'.join(values[name] for name in other_dimensions)}")
+                generated = row_metrics(max(1.0, users * rng.lognormvariate(0, 0.2)), rng)
+                rows.append(([values[name] for name in dimensions] + ([range_name] if range_name else []),
+                             [generated[name] if name in generated else rng.random() for name in metrics]))
+        return rows
+
+    def report(self, request, settings):
+        dimensions = [dimension.name for dimension in request.dimensions]
+        metrics = [metric.name for metric in request.metrics]
+        self.check_fields(settings, dimensions, metrics)
+        if not request.date_ranges or len(request.date_ranges) > 4:
+            raise FakeError("INVALID_ARGUMENT", "Requests must have between 1 and 4 date ranges.")
+        multiple_ranges = len(request.date_ranges) > 1
+
+        rows = []
+        range_names = []
+        for i, date_range in enumerate(request.date_ranges):
+            range_name = date_range.name or f"date_range_{i}"
+            range_names.append(range_name)
+            rows.extend(self.build_rows(request, settings, dimensions, metrics,
+                                        range_name if multiple_ranges else None, range_days(date_range)))
+
+        if settings["shuffle_ties"]:
+            random.shuffle(rows)
+        for order_by in reversed(request.order_bys):
+            if order_by.HasField('metric') and order_by.metric.metric_name in metrics:
+                # By the value as returned, so rows showing the same count tie like in GA
+                name = order_by.metric.metric_name
+                index = metrics.index(name)
+                rows.sort(key=lambda row: float(format_value(name, row[1][index])), reverse=order_by.desc)
+            elif order_by.HasField('dimension') and order_by.dimension.dimension_name in dimensions:
+                index = dimensions.index(order_by.dimension.dimension_name)
+                rows.sort(key=lambda row: row[0][index], reverse=order_by.desc)
+
+        response = RunReportResponse.pb()()
+        for name in dimensions + (["dateRange"] if multiple_ranges else []):
+            response.dimension_headers.add(name=name)
+        for name in metrics:
+            response.metric_headers.add(name=name, type_=metric_type(name))
+
+        aggregations = [(MetricAggregation.TOTAL, response.totals), (MetricAggregation.MAXIMUM, response.maximums),
+                        (MetricAggregation.MINIMUM, response.minimums)]
+        for aggregation, target in aggregations:
+            if aggregation not in request.metric_aggregations:
+                continue
+            for range_name in range_names:
+                range_rows = [values for dimension_values, values in rows
+                              if not multiple_ranges or dimension_values[-1] == range_name]
+                aggregate = target.add()
+                for _ in dimensions:
+                    aggregate.dimension_values.add(value=f"RESERVED_{MetricAggregation(aggregation).name}")
+                if multiple_ranges:
+                    aggregate.dimension_values.add(value=range_name)
+                for j, name in enumerate(metrics):
+                    column = [values[j] for values in range_rows] or [0]
+                    if aggregation == MetricAggregation.MAXIMUM:
+                        value = max(column)
+                    elif aggregation == MetricAggregation.MINIMUM:
+                        value = min(column)
+                    elif name in ADDITIVE_METRICS:
+                        value = sum(column)
+                    else:
+                        value = sum(column) / len(column)
+                    aggregate.metric_values.add(value=format_value(name, value))
+
+        response.row_count = len(rows)
+        rows = rows[request.offset:request.offset + (request.limit or 10000)]
+        for dimension_values, values in rows:
+            row = response.rows.add()
+            for value in dimension_values:
+                row.dimension_values.add(value=value)
+            for name, value in zip(metrics, values):
+                row.metric_values.add(value=format_value(name, value))
+        # Bigger reports cost more tokens, roughly like GA's own accounting
+        quota = self.charge(request.property, settings, 1 + response.row_count // 1000)
+        if request.return_property_quota:
+            for name, (consumed, remaining) in quota.items():
+                getattr(response.property_quota, name).consumed = consumed
+                getattr(response.property_quota, name).remaining = remaining
+        response.kind = "analyticsData#runReport"
+        return response, len(rows)
+
+    def run_report(self, request):
+        return self.call('RunReport', request.property, lambda settings: self.report(request, settings))
+
+    def batch_run_reports(self, request):
+        def batch(settings):
+            if len(request.requests) > 5:
+                raise FakeError("INVALID_ARGUMENT", "A batch can have at most 5 requests.")
+            response = BatchRunReportsResponse.pb()()
+            rows = 0
+            for report_request in request.requests:
+                if report_request.property and report_request.property != request.property:
+                    raise FakeError("INVALID_ARGUMENT", "All requests of a batch must be for the same property.")
+                report_request.property = request.property
+                report, report_rows = self.report(report_request, settings)
+                response.reports.append(report)
+                rows += report_rows
+            response.kind = "analyticsData#batchRunReports"
+            return response, rows
+        return self.call('BatchRunReports', request.property, batch)
+
+    def get_metadata(self, request):
+        property_name = request.name.rsplit('/metadata', 1)[0]
+
+        def metadata(settings):
+            response = Metadata.pb()(name=request.name)
+            for name in DIMENSIONS + settings["custom_dimensions"]:
+                response.dimensions.add(api_name=name, ui_name=name, custom_definition=':' in name)
+            for name in INTEGER_METRICS + FLOAT_METRICS + SECONDS_METRICS + settings["custom_metrics"]:
+                response.metrics.add(api_name=name, ui_name=name, type_=metric_type(name),
+                                     custom_definition=':' in name)
+            return response, 0
+        return self.call('GetMetadata', property_name, metadata)
+
+    def check_compatibility(self, request):
+        def compatibility(settings):
+            dimensions = [dimension.name for dimension in request.dimensions]
+            metrics = [metric.name for metric in request.metrics]
+            self.check_fields(settings, dimensions, metrics)
+            fields = set(dimensions) | set(metrics)
+            incompatible = {name for pair in settings["incompatible"] if set(pair) <= fields for name in pair}
+            response = CheckCompatibilityResponse.pb()()
+            for name in dimensions:
+                item = response.dimension_compatibilities.add()
+                item.dimension_metadata.api_name = name
+                item.compatibility = Compatibility.INCOMPATIBLE if name in incompatible else Compatibility.COMPATIBLE
+            for name in metrics:
+                item = response.metric_compatibilities.add()
+                item.metric_metadata.api_name = name
+                item.metric_metadata.type_ = metric_type(name)
+                item.compatibility = Compatibility.INCOMPATIBLE if name in incompatible else Compatibility.COMPATIBLE
+            return response, 0
+        return self.call('CheckCompatibility', request.property, compatibility)
+
+class FakeGAServer:
+    def __init__(self, grpc_port=0, http_port=0, workers=64, config=None):
+        self.api = FakeGA(config)
+        self.grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+        methods = {
+            'RunReport': (self.api.run_report, RunReportRequest, RunReportResponse),
+            'BatchRunReports': (self.api.batch_run_reports, BatchRunReportsRequest, BatchRunReportsResponse),
+            'GetMetadata': (self.api.get_metadata, GetMetadataRequest, Metadata),
+            'CheckCompatibility': (self.api.check_compatibility, CheckCompatibilityRequest,
+                                   CheckCompatibilityResponse),
+        }
+        handlers = {name: grpc.unary_unary_rpc_method_handler(grpc_method(method),
+                                                              request_deserializer=request_type.pb().FromString,
+                                                              response_serializer=response_type.pb().SerializeToString)
+                    for name, (method, request_type, response_type) in methods.items()}
+        self.grpc_server.add_generic_rpc_handlers([grpc.method_handlers_generic_handler(SERVICE, handlers)])
+        self.grpc_port = self.grpc_server.add_insecure_port(f'localhost:{grpc_port}')
+        self.http_server = ThreadingHTTPServer(('localhost', http_port), RestHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.api = self.api
+        self.http_port = self.http_server.server_address[1]
+
+    def start(self):
+        self.grpc_server.start()
+        threading.Thread(target=self.http_server.serve_forever, name='fake-ga-http', daemon=True).start()
+        logger.info(f"Fake GA serving gRPC on localhost:{self.grpc_port} and REST on localhost:{self.http_port}")
+        return self
+
+    def stop(self):
+        self.grpc_server.stop(None)
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+def grpc_method(method):
+    def handle(request, context):
+        try:
+            return method(request)
+        except FakeError as e:
+            context.abort(getattr(grpc.StatusCode, e.status), e.message)
+    return handle
+
+class RestHandler(BaseHTTPRequestHandler):
+    # The v1beta REST paths, plus GET /stats with the calls served so far
+    protocol_version = 'HTTP/1.1'
+    post_routes = {'runReport': (RunReportRequest, 'run_report'),
+                   'batchRunReports': (BatchRunReportsRequest, 'batch_run_reports'),
+                   'checkCompatibility': (CheckCompatibilityRequest, 'check_compatibility')}
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/stats':
+            return self.send_json(200, dict(self.server.api.stats))
+        match = re.fullmatch(r'/v1beta/(properties/[^/:]+/metadata)', path)
+        if match is None:
+            return self.send_error_json(FakeError("NOT_FOUND", f"No route for GET {path}"))
+        self.respond(self.server.api.get_metadata, GetMetadataRequest.pb()(name=match.group(1)))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = self.path.split('?')[0]
+        match = re.fullmatch(r'/v1beta/(properties/[^/:]+):(\w+)', path)
+        if match is None or match.group(2) not in self.post_routes:
+            return self.send_error_json(FakeError("NOT_FOUND", f"No route for POST {path}"))
+        request_type, method_name = self.post_routes[match.group(2)]
+        try:
+            request = json_format.Parse(body or b'{}', request_type.pb()(), ignore_unknown_fields=True)
+        except json_format.ParseError as e:
+            return self.send_error_json(FakeError("INVALID_ARGUMENT", str(e)))
+        request.property = match.group(1)
+        self.respond(getattr(self.server.api, method_name), request)
+
+    def respond(self, method, request):
+        try:
+            response = method(request)
+        except FakeError as e:
+            return self.send_error_json(e)
+        self.send_json(200, json_format.MessageToDict(response))
+
+    def send_error_json(self, error):
+        status = HTTP_STATUS.get(error.status, 500)
+        self.send_json(status, {"error": {"code": status, "message": error.message, "status": error.status}})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def load_config(path):
+    if not path:
+        return None
+    with open(path, encoding='utf-8') as config_file:
+        return json.load(config_file)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the GA4 Data API')
+    parser.add_argument('--grpc-port', type=int, default=50051)
+    parser.add_argument('--http-port', type=int, default=8085)
+    parser.add_argument('--config', default=os.environ.get('FAKE_GA_CONFIG'), help='JSON settings file')
+    parser.add_argument('--workers', type=int, default=64, help='gRPC server threads')
+    args = parser.parse_args()
+    server = FakeGAServer(args.grpc_port, args.http_port, args.workers, load_config(args.config)).start()
+    try:
+        server.grpc_server.wait_for_termination()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,368 @@
+import os
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import logging
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Local stand-in for the OpenAI endpoints the report generation uses: the
+# Assistants threads/messages/runs API (polled or streamed) and chat
+# completions (plain or streamed). Runs queue, then write their answer token by
+# token at a configurable rate, and fail on demand:
+#   python benchmarks/fake_openai_server.py [--port 8086] [--config fake_openai.json]
+# and point the app at it with OPENAI_BASE_URL=http://localhost:<port>/v1 and
+# any OPENAI_API_KEY. Answers and timings are seeded by the prompt, so the
+# same workload produces the same run.
+
+DEFAULT_CONFIG = {
+    "seed": 0,
+    # Time a run spends queued before it starts (lognormal around the median)
+    "queue_median_ms": 500,
+    "queue_sigma": 0.5,
+    # Time to first token once a run or completion starts, then the output rate
+    "first_token_ms": 300,
+    "tokens_per_second": 60,
+    # Answer length in tokens (lognormal around the median)
+    "output_tokens": 800,
+    "output_sigma": 0.3,
+    # Chance per request of an HTTP 500 or 429, and per run of ending "failed"
+    "server_error_rate": 0,
+    "rate_limit_rate": 0,
+    "run_failure_rate": 0,
+    # Sent as openai-poll-after-ms, which create_and_poll uses as its interval
+    "poll_after_ms": 100,
+    "model": "gpt-4o",
+}
+
+# Words the answers are made of; the report is German
+WORDS = ["Die", "Anzahl", "der", "Nutzer", "ist", "im", "Vergleich", "zum", "Vorjahr", "gestiegen", "gesunken",
+         "Sitzungen", "Seitenaufrufe", "Conversions", "Interaktionsrate", "deutlich", "leicht", "um", "Prozent",
+         "Besonders", "mobile", "Geräte", "zeigen", "eine", "positive", "Entwicklung", "organische", "Suche",
+         "bleibt", "wichtigste", "Quelle", "Empfehlung:", "Inhalte", "optimieren", "und", "weiter", "beobachten."]
+
+def now():
+    return int(time.time())
+
+def new_id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+def seeded(config, *parts):
+    key = "|".join([str(config["seed"]), *parts])
+    return random.Random(hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+def answer_tokens(config, prompt):
+    rng = seeded(config, prompt)
+    count = max(1, int(config["output_tokens"] * rng.lognormvariate(0, config["output_sigma"])))
+    return [rng.choice(WORDS) + ("\n\n" if i % 60 == 59 else " ") for i in range(count)]
+
+def prompt_tokens(text):
+    # Roughly four characters per token
+    return max(1, len(text) // 4)
+
+class FakeOpenAI:
+    # In-memory threads, messages and runs. A run's status follows from the
+    # time since it was created, so polling sees queued, in_progress and then
+    # completed (or failed) without any background work
+    def __init__(self, config=None):
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.threads = {}
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def thread(self, thread_id):
+        thread = self.threads.get(thread_id)
+        if thread is None:
+            raise LookupError(f"No thread found with id '{thread_id}'.")
+        return thread
+
+    def create_thread(self, body):
+        thread_id = new_id('thread')
+        with self._lock:
+            self.threads[thread_id] = {"id": thread_id, "created_at": now(), "messages": [], "runs": {}}
+        for message in body.get("messages", []):
+            self.create_message(thread_id, message)
+        return {"id": thread_id, "object": "thread", "created_at": now(), "metadata": body.get("metadata", {}),
+                "tool_resources": None}
+
+    def message(self, thread_id, role, text, run_id=None, assistant_id=None):
+        return {"id": new_id('msg'), "object": "thread.message", "created_at": now(), "thread_id": thread_id,
+                "role": role, "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+                "assistant_id": assistant_id, "run_id": run_id, "attachments": [], "metadata": {},
+                "status": "completed", "completed_at": now(), "incomplete_at": None, "incomplete_details": None}
+
+    def create_message(self, thread_id, body):
+        content = body.get("content", "")
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        message = self.message(thread_id, body.get("role", "user"), content)
+        with self._lock:
+            self.thread(thread_id)["messages"].append(message)
+        return message
+
+    def list_messages(self, thread_id, query):
+        with self._lock:
+            for run in self.thread(thread_id)["runs"].values():
+                self.advance(run)
+            messages = list(self.thread(thread_id)["messages"])
+        if query.get("order", "desc") == "desc":
+            messages.reverse()
+        messages = messages[:int(query.get("limit", 20))]
+        return {"object": "list", "data": messages, "first_id": messages[0]["id"] if messages else None,
+                "last_id": messages[-1]["id"] if messages else None, "has_more": False}
+
+    def create_run(self, thread_id, body):
+        config = self.config
+        with self._lock:
+            thread = self.thread(thread_id)
+            prompt = "\n".join(part["text"]["value"] for message in thread["messages"]
+                               for part in message["content"])
+            run_id = new_id('run')
+            rng = seeded(config, 'run', prompt)
+            run = {"id": run_id, "thread_id": thread_id, "assistant_id": body.get("assistant_id"),
+                   "model": body.get("model") or config["model"], "created": time.time(), "prompt": prompt,
+                   "tokens": answer_tokens(config, prompt),
+                   "queue_seconds": config["queue_median_ms"] / 1000 * rng.lognormvariate(0, config["queue_sigma"]),
+                   "fails": rng.random() < config["run_failure_rate"], "message": None}
+            thread["runs"][run_id] = run
+        return run
+
+    def generation_seconds(self, run):
+        return self.config["first_token_ms"] / 1000 + len(run["tokens"]) / self.config["tokens_per_second"]
+
+    def status(self, run):
+        elapsed = time.time() - run["created"]
+        if elapsed < run["queue_seconds"]:
+            return "queued"
+        if elapsed < run["queue_seconds"] + self.generation_seconds(run):
+            return "in_progress"
+        return "failed" if run["fails"] else "completed"
+
+    def advance(self, run):
+        # Adds the assistant's answer once the run has completed; call with the lock held
+        if run["message"] is None and self.status(run) == "completed":
+            self.finish(run)
+
+    def finish(self, run):
+        run["message"] = self.message(run["thread_id"], "assistant", "".join(run["tokens"]), run["id"],
+                                      run["assistant_id"])
+        self.threads[run["thread_id"]]["messages"].append(run["message"])
+
+    def run_object(self, run, status=None):
+        status = status or self.status(run)
+        created = int(run["created"])
+        started = int(run["created"] + run["queue_seconds"])
+        finished = int(run["created"] + run["queue_seconds"] + self.generation_seconds(run))
+        done = status in ("completed", "failed")
+        return {"id": run["id"], "object": "thread.run", "created_at": created, "thread_id": run["thread_id"],
+                "assistant_id": run["assistant_id"], "status": status, "model": run["model"],
+                "instructions": "", "tools": [], "metadata": {}, "required_action": None,
+                "last_error": {"code": "server_error", "message": "Injected run failure"}
+                if status == "failed" else None,
+                "expires_at": None if done else created + 600, "started_at": started if status != "queued" else None,
+                "cancelled_at": None, "failed_at": finished if status == "failed" else None,
+                "completed_at": finished if status == "completed" else None, "incomplete_details": None,
+                "usage": {"prompt_tokens": prompt_tokens(run["prompt"]), "completion_tokens": len(run["tokens"]),
+                          "total_tokens": prompt_tokens(run["prompt"]) + len(run["tokens"])}
+                if status == "completed" else None,
+                "temperature": 1.0, "top_p": 1.0, "max_prompt_tokens": None, "max_completion_tokens": None,
+                "truncation_strategy": {"type": "auto", "last_messages": None}, "response_format": "auto",
+                "tool_choice": "auto", "parallel_tool_calls": True}
+
+    def get_run(self, thread_id, run_id):
+        with self._lock:
+            run = self.thread(thread_id)["runs"].get(run_id)
+            if run is None:
+                raise LookupError(f"No run found with id '{run_id}'.")
+            self.advance(run)
+            return self.run_object(run)
+
+    def run_events(self, run):
+        # (event, data, seconds to wait before it) of a streamed run
+        message_id = new_id('msg')
+        message = self.message(run["thread_id"], "assistant", "", run["id"], run["assistant_id"])
+        message.update(id=message_id, status="in_progress", content=[], completed_at=None)
+        yield "thread.run.created", self.run_object(run, "queued"), 0
+        yield "thread.run.queued", self.run_object(run, "queued"), 0
+        yield "thread.run.in_progress", self.run_object(run, "in_progress"), run["queue_seconds"]
+        if run["fails"]:
+            yield "thread.run.failed", self.run_object(run, "failed"), self.generation_seconds(run)
+            return
+        yield "thread.message.created", message, 0
+        yield "thread.message.in_progress", message, 0
+        for i, token in enumerate(run["tokens"]):
+            delay = self.config["first_token_ms"] / 1000 if i == 0 else 1 / self.config["tokens_per_second"]
+            yield "thread.message.delta", {"id": message_id, "object": "thread.message.delta", "delta": {
+                "content": [{"index": 0, "type": "text", "text": {"value": token, "annotations": []}}]}}, delay
+        with self._lock:
+            if run["message"] is None:
+                self.finish(run)
+        yield "thread.message.completed", run["message"], 0
+        yield "thread.run.step.completed", {"id": new_id('step'), "object": "thread.run.step",
+                                            "run_id": run["id"], "status": "completed"}, 0
+        yield "thread.run.completed", self.run_object(run, "completed"), 0
+
+    def completion_tokens(self, body):
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        return prompt, answer_tokens(self.config, prompt)
+
+    def chat_completion(self, body):
+        prompt, tokens = self.completion_tokens(body)
+        time.sleep(self.config["first_token_ms"] / 1000 + len(tokens) / self.config["tokens_per_second"])
+        return {"id": new_id('chatcmpl'), "object": "chat.completion", "created": now(),
+                "model": body.get("model") or self.config["model"], "system_fingerprint": None,
+                "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": {"prompt_tokens": prompt_tokens(prompt), "completion_tokens": len(tokens),
+                          "total_tokens": prompt_tokens(prompt) + len(tokens)}}
+
+    def chat_chunks(self, body):
+        _, tokens = self.completion_tokens(body)
+        completion_id = new_id('chatcmpl')
+        model = body.get("model") or self.config["model"]
+
+        def chunk(delta, finish_reason=None):
+            return {"id": completion_id, "object": "chat.completion.chunk", "created": now(), "model": model,
+                    "system_fingerprint": None,
+                    "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish_reason}]}
+        yield chunk({"role": "assistant", "content": ""}), self.config["first_token_ms"] / 1000
+        for token in tokens:
+            yield chunk({"content": token}), 1 / self.config["tokens_per_second"]
+        yield chunk({}, "stop"), 0
+
+class OpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        api = self.server.api
+        path, _, query_string = self.path.partition('?')
+        query = dict(part.split('=', 1) for part in query_string.split('&') if '=' in part)
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        if path == '/stats':
+            return self.send_json(200, dict(api.stats))
+        route = re.sub(r'/(thread|run|msg)_[0-9a-f]+', r'/{\1}', path)
+        with api._lock:
+            api.stats[f"{method} {route}"] += 1
+        rng = random.Random()
+        if rng.random() < api.config["server_error_rate"]:
+            return self.send_error_json(500, "server_error", "Injected server error")
+        if rng.random() < api.config["rate_limit_rate"]:
+            return self.send_error_json(429, "rate_limit_exceeded", "Injected rate limit", {"retry-after-ms": "200"})
+
+        try:
+            if method == 'POST' and path == '/v1/threads':
+                return self.send_json(200, api.create_thread(body))
+            match = re.fullmatch(r'/v1/threads/([^/]+)/messages', path)
+            if match and method == 'POST':
+                return self.send_json(200, api.create_message(match.group(1), body))
+            if match:
+                return self.send_json(200, api.list_messages(match.group(1), query))
+            match = re.fullmatch(r'/v1/threads/([^/]+)/runs', path)
+            if match and method == 'POST':
+                run = api.create_run(match.group(1), body)
+                if body.get("stream"):
+                    return self.send_events((f"event: {event}\ndata: {json.dumps(data)}", delay)
+                                            for event, data, delay in api.run_events(run))
+                return self.send_json(200, api.run_object(run), poll=True)
+            match = re.fullmatch(r'/v1/threads/([^/]+)/runs/([^/]+)', path)
+            if match and method == 'GET':
+                return self.send_json(200, api.get_run(match.group(1), match.group(2)), poll=True)
+            if method == 'POST' and path == '/v1/chat/completions':
+                if body.get("stream"):
+                    return self.send_events((f"data: {json.dumps(chunk)}", delay)
+                                            for chunk, delay in api.chat_chunks(body))
+                return self.send_json(200, api.chat_completion(body))
+        except LookupError as e:
+            return self.send_error_json(404, "not_found", str(e))
+        self.send_error_json(404, "not_found", f"Unknown endpoint {method} {path}")
+
+    def send_json(self, status, data, poll=False, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if poll:
+            self.send_header('openai-poll-after-ms', str(self.server.api.config["poll_after_ms"]))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, code, message, headers=None):
+        self.send_json(status, {"error": {"message": message, "type": code, "param": None, "code": code}},
+                       headers=headers)
+
+    def send_events(self, events):
+        # Server-sent events, one chunk each, paced by their delays
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for payload, delay in events:
+                if delay:
+                    time.sleep(delay)
+                self.write_chunk(f"{payload}\n\n".encode('utf-8'))
+            self.write_chunk(b"data: [DONE]\n\n" if payload.startswith("data:") else b"event: done\ndata: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading
+            self.close_connection = True
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeOpenAIServer:
+    def __init__(self, port=0, config=None):
+        self.api = FakeOpenAI(config)
+        self.http_server = ThreadingHTTPServer(('localhost', port), OpenAIHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.api = self.api
+        self.port = self.http_server.server_address[1]
+        self.base_url = f"http://localhost:{self.port}/v1"
+
+    def start(self):
+        threading.Thread(target=self.http_server.serve_forever, name='fake-openai-http', daemon=True).start()
+        logger.info(f"Fake OpenAI serving on {self.base_url}")
+        return self
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the OpenAI Assistants and chat APIs')
+    parser.add_argument('--port', type=int, default=8086)
+    parser.add_argument('--config', default=os.environ.get('FAKE_OPENAI_CONFIG'),
+                        help='JSON file overriding ' + ', '.join(DEFAULT_CONFIG))
+    args = parser.parse_args()
+    config = None
+    if args.config:
+        with open(args.config, encoding='utf-8') as config_file:
+            config = json.load(config_file)
+    server = FakeOpenAIServer(args.port, config).start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,67 @@
+import os
+import sys
+import timeit
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.disable(logging.CRITICAL)
+
+from google.analytics.data_v1beta.types import (DimensionHeader, DimensionValue, MetricHeader, MetricType, MetricValue,
+                                                RunReportResponse, Row)
+from app.data_fetcher import format_response
+
+# Micro-benchmark of format_response on a synthetic response, comparing the
+# version before the raw protobuf path (copied from the baseline commit) with
+# the proto-plus, raw protobuf and serialized-bytes inputs of the current one:
+#   python benchmarks/format_response.py [rows] [repeats]
+
+def make_response(row_count):
+    metrics = [("totalUsers", MetricType.TYPE_INTEGER), ("sessions", MetricType.TYPE_INTEGER),
+               ("engagementRate", MetricType.TYPE_FLOAT), ("userEngagementDuration", MetricType.TYPE_SECONDS)]
+    return RunReportResponse(
+        dimension_headers=[DimensionHeader(name="city"), DimensionHeader(name="browser")],
+        metric_headers=[MetricHeader(name=name, type_=metric_type) for name, metric_type in metrics],
+        rows=[Row(dimension_values=[DimensionValue(value=f"city_{i}"), DimensionValue(value=f"browser_{i % 7}")],
+                  metric_values=[MetricValue(value=str(1000 - i % 1000)), MetricValue(value=str(i)),
+                                 MetricValue(value=f"0.{i % 997}"), MetricValue(value=str(i * 3))])
+              for i in range(row_count)],
+        row_count=row_count,
+    )
+
+def format_response_before(response):
+    # format_response as it was before the raw protobuf path, verbatim
+    try:
+        return {
+            "metricHeaders": [header.name for header in response.metric_headers],
+            "rows": [{"dimensionValues": [str(value.value) for value in row.dimension_values], 
+                      "metricValues": [str(value.value) for value in row.metric_values]} 
+                     for row in response.rows[:10]]  # Limit to top 10 rows
+        }
+    except Exception as e:
+        raise Exception(f"Error in format_response: {str(e)}")
+
+def run(row_count=10000, repeats=5):
+    response = make_response(row_count)
+    data = RunReportResponse.serialize(response)
+    # No totals in the response, so both versions return the same top rows
+    assert format_response_before(response) == format_response(response) == format_response(data)
+    raw = RunReportResponse.pb(response)
+
+    cases = [
+        ("before", lambda: format_response_before(response)),
+        ("proto-plus", lambda: format_response(response)),
+        ("raw protobuf", lambda: format_response(raw)),
+        # Includes parsing every row of the response, whatever the limit
+        ("serialized bytes", lambda: format_response(data)),
+    ]
+    results = {}
+    for name, func in cases:
+        results[name] = min(timeit.repeat(func, number=1, repeat=repeats))
+    baseline = results["before"]
+    print(f"format_response, {row_count} rows, best of {repeats}")
+    for name, seconds in results.items():
+        print(f"  {name:<18} {seconds * 1000:9.2f} ms  {baseline / seconds:5.2f}x")
+    return results
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,301 @@
+import os
+import sys
+import argparse
+import json
+import random
+import secrets
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import logging
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.disable(logging.CRITICAL)
+
+from benchmarks.replay import AI_FAILURES
+from benchmarks.stats import percentile
+
+# End-to-end load test of the report endpoints:
+#   python benchmarks/loadtest.py [--users 8] [--reports 200 | --duration 60] [--rate 2]
+# Without --url it starts the GA and OpenAI stand-ins in this process and the
+# Flask app in a child process (threaded werkzeug server) pointed at them, with
+# its caches in a temporary directory and a throwaway login. The app's other
+# settings (GA_TRANSPORT, GA_CACHE_ENABLED, GA_QUOTA_*, CASSETTE_MODE, ...) are
+# passed through from the environment, and the stand-ins take the same JSON
+# settings files as when run on their own (--ga-config, --openai-config).
+# With --url it loads an app that is already running, e.g. under gunicorn with
+# the worker count being sized, logging in with --username and --password.
+#
+# Each virtual user logs in once, then POSTs /generate_report for a random
+# property, report type and month and downloads the result, --users at a time.
+# With --rate, reports instead start at random (Poisson) arrivals at that rate
+# whether or not earlier ones finished, and latencies count from the arrival,
+# so queueing in front of a saturated app shows up in the figures. The summary
+# gives throughput, p50/p95/p99 and error rate per stage; "report" is generate
+# plus download, and reports whose AI analysis failed are counted as degraded.
+
+STAGES = ('login', 'generate', 'download', 'report')
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+def serve(port, username, password):
+    # Child process: the app is configured by the environment the parent set
+    from werkzeug.serving import make_server
+    from app import app
+    from app.models import User, users
+    user = users.setdefault(username, {'id': max(data['id'] for data in users.values()) + 1})
+    user['password_hash'] = User.hash_password(password)
+    make_server('localhost', port, app, threaded=True).serve_forever()
+
+def start_app(args, workdir):
+    from benchmarks.fake_ga_server import FakeGAServer, load_config
+    from benchmarks.fake_openai_server import FakeOpenAIServer
+    ga_server = FakeGAServer(config=load_config(args.ga_config)).start()
+    openai_server = FakeOpenAIServer(config=load_config(args.openai_config)).start()
+    ga_port = ga_server.http_port if os.environ.get('GA_TRANSPORT') == 'rest' else ga_server.grpc_port
+    port = free_port()
+    env = dict(os.environ, GA_API_ENDPOINT=f"http://localhost:{ga_port}", OPENAI_BASE_URL=openai_server.base_url)
+    env.setdefault('OPENAI_API_KEY', 'sk-loadtest')
+    env.setdefault('GA_CACHE_PATH', os.path.join(workdir, 'ga_cache.sqlite3'))
+    env.setdefault('GA_WARMUP_ENABLED', 'false')
+    with open(args.app_log, 'ab') as log_file:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port),
+                                    args.username, args.password], env=env, stdout=log_file, stderr=log_file)
+    url = f"http://localhost:{port}"
+    deadline = time.monotonic() + 60
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"The app exited with {process.returncode} before serving, see --app-log")
+        try:
+            httpx.get(f"{url}/login", timeout=1)
+            break
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("The app did not start serving within 60 seconds")
+            time.sleep(0.2)
+    return url, process, ga_server, openai_server
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.degraded = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._clients = []
+        weights = dict(item.split('=') for item in args.mix.split(','))
+        self.report_types = list(weights)
+        self.report_weights = [float(weight) for weight in weights.values()]
+
+    def record(self, stage, started, error=None):
+        with self._lock:
+            if error is None:
+                self.latencies[stage].append(time.perf_counter() - started)
+            else:
+                self.errors[stage][error] += 1
+
+    def next_report(self):
+        # A whole calendar month among the last --months, like the month-end runs
+        with self._lock:
+            property_id = self.random.choice(self.args.properties)
+            report_type = self.random.choices(self.report_types, self.report_weights)[0]
+            months_back = self.random.randint(1, self.args.months)
+        end_date = date.today().replace(day=1) - timedelta(days=1)
+        for _ in range(months_back - 1):
+            end_date = end_date.replace(day=1) - timedelta(days=1)
+        return {"property_id": property_id, "report_type": report_type,
+                "start_date": end_date.replace(day=1).isoformat(), "end_date": end_date.isoformat()}
+
+    def client(self):
+        # One logged-in session per virtual user (worker thread)
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = httpx.Client(base_url=self.args.url, timeout=self.args.timeout)
+            with self._lock:
+                self._clients.append(client)
+            started = time.perf_counter()
+            try:
+                response = client.post('/login', data={"username": self.args.username,
+                                                      "password": self.args.password})
+                # A successful login redirects away from the login page
+                if response.status_code != 302 or response.headers.get('location', '').endswith('/login'):
+                    raise RuntimeError("login rejected")
+            except Exception as e:
+                self.record('login', started, type(e).__name__ if isinstance(e, httpx.HTTPError) else str(e))
+                client.close()
+                raise
+            self.record('login', started)
+            self._local.client = client
+        return client
+
+    def run_report(self, arrival=None):
+        try:
+            client = self.client()
+        except Exception:
+            self.record('report', arrival or time.perf_counter(), 'login failed')
+            return
+        started = arrival or time.perf_counter()
+        stage_started = time.perf_counter()
+        try:
+            response = client.post('/generate_report', json=self.next_report())
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}")
+            report_id = response.json()["report_id"]
+        except Exception as e:
+            error = type(e).__name__ if isinstance(e, httpx.HTTPError) else str(e)
+            self.record('generate', stage_started, error)
+            self.record('report', started, f"generate: {error}")
+            return
+        self.record('generate', stage_started)
+        stage_started = time.perf_counter()
+        try:
+            response = client.get(f'/download_report/{report_id}')
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}")
+        except Exception as e:
+            error = type(e).__name__ if isinstance(e, httpx.HTTPError) else str(e)
+            self.record('download', stage_started, error)
+            self.record('report', started, f"download: {error}")
+            return
+        self.record('download', stage_started)
+        self.record('report', started)
+        if any(marker in response.text for marker in AI_FAILURES):
+            with self._lock:
+                self.degraded += 1
+
+    def run(self):
+        args = self.args
+        deadline = time.perf_counter() + args.duration if args.duration else None
+        started = time.perf_counter()
+        if args.rate:
+            # Open loop: arrivals don't wait for earlier reports to finish
+            with ThreadPoolExecutor(max_workers=args.users) as executor:
+                arrival = started
+                for _ in range(args.reports or sys.maxsize):
+                    arrival += self.random.expovariate(args.rate)
+                    if deadline and arrival > deadline:
+                        break
+                    time.sleep(max(0, arrival - time.perf_counter()))
+                    executor.submit(self.run_report, arrival)
+        else:
+            remaining = iter(range(args.reports or sys.maxsize))
+            remaining_lock = threading.Lock()
+
+            def user():
+                while not deadline or time.perf_counter() < deadline:
+                    with remaining_lock:
+                        if next(remaining, None) is None:
+                            return
+                    self.run_report()
+
+            with ThreadPoolExecutor(max_workers=args.users) as executor:
+                for _ in range(args.users):
+                    executor.submit(user)
+        elapsed = time.perf_counter() - started
+        for client in self._clients:
+            client.close()
+        return elapsed
+
+    def summary(self, elapsed):
+        results = {"elapsed": elapsed, "users": self.args.users, "rate": self.args.rate,
+                   "degraded": self.degraded, "stages": {}}
+        for stage in STAGES:
+            latencies = self.latencies[stage]
+            errors = sum(self.errors[stage].values())
+            total = len(latencies) + errors
+            results["stages"][stage] = {
+                "count": total, "per_second": len(latencies) / elapsed if elapsed else 0,
+                "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99), "error_rate": errors / total if total else 0,
+                "errors": dict(self.errors[stage].most_common()),
+            }
+        return results
+
+def print_summary(results):
+    mode = f"{results['rate']}/s arrivals, {results['users']} workers" if results["rate"] \
+        else f"{results['users']} users"
+    print(f"{results['stages']['report']['count']} reports in {results['elapsed']:.1f}s, {mode}")
+    print(f"  {'stage':<10} {'count':>6} {'per s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for stage, result in results["stages"].items():
+        if not result["count"]:
+            continue
+        print(f"  {stage:<10} {result['count']:>6} {result['per_second']:7.2f} {result['p50'] * 1000:8.0f} "
+              f"{result['p95'] * 1000:8.0f} {result['p99'] * 1000:8.0f} {result['error_rate']:7.1%}")
+        for error, count in list(result["errors"].items())[:3]:
+            print(f"      {count} x {error}")
+    if results["degraded"]:
+        print(f"  {results['degraded']} reports without AI analysis")
+    for name, stats in results.get("stand_ins", {}).items():
+        print(f"  {name}: " + ", ".join(f"{key} {value}" for key, value in sorted(stats.items())))
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of /generate_report and /download_report')
+    parser.add_argument('--url', help='App to load; default starts one against local stand-ins')
+    parser.add_argument('--username', default='loadtest')
+    parser.add_argument('--password', default=os.environ.get('LOADTEST_PASSWORD'))
+    parser.add_argument('--users', type=int, default=8, help='Virtual users, or workers with --rate')
+    parser.add_argument('--reports', type=int, help='Reports to run (default 100 unless --duration)')
+    parser.add_argument('--duration', type=float, help='Seconds to run for')
+    parser.add_argument('--rate', type=float, help='Report arrivals per second (open loop)')
+    parser.add_argument('--properties', help='Comma-separated GA property ids (default 20 made-up ones)')
+    parser.add_argument('--mix', default='yoy=1,monthly=1', help='Report type weights')
+    parser.add_argument('--months', type=int, default=12, help='Pick report months among the last N')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds per HTTP request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ga-config', help='JSON settings for the GA stand-in')
+    parser.add_argument('--openai-config', help='JSON settings for the OpenAI stand-in')
+    parser.add_argument('--app-log', default=os.devnull, help='File for the started app\'s output')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+    if args.reports is None and args.duration is None:
+        args.reports = 100
+    if args.properties:
+        args.properties = args.properties.split(',')
+    elif args.url:
+        parser.error('--properties is required with --url')
+    else:
+        args.properties = [str(1001 + i) for i in range(20)]
+    if args.url and not args.password:
+        parser.error('--password (or LOADTEST_PASSWORD) is required with --url')
+    args.password = args.password or secrets.token_urlsafe(16)
+
+    process = ga_server = openai_server = None
+    with tempfile.TemporaryDirectory(prefix='loadtest-') as workdir:
+        try:
+            if not args.url:
+                args.url, process, ga_server, openai_server = start_app(args, workdir)
+            load_test = LoadTest(args)
+            results = load_test.summary(load_test.run())
+            if ga_server is not None:
+                results["stand_ins"] = {"GA": dict(ga_server.api.stats), "OpenAI": dict(openai_server.api.stats)}
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+            for server in (ga_server, openai_server):
+                if server is not None:
+                    server.stop()
+    print_summary(results)
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    return results
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--serve']:
+        serve(int(sys.argv[2]), sys.argv[3], sys.argv[4])
+    else:
+        main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.disable(logging.CRITICAL)
+
+from benchmarks.stats import percentile
+
+# Replays a recorded workload without GA or OpenAI:
+#   python benchmarks/replay.py CASSETTE [time_scale] [results.json]
+# Record one by running the app under its usual load with
+# CASSETTE_MODE=record and CASSETTE_PATH=CASSETTE. Every report is started at
+# its recorded offset and every GA and OpenAI call waits its recorded duration,
+# both times time_scale (default 1; 0 runs everything at once with no waits),
+# so a change to the app's own code shows up as a change in report latency.
+# The report cache is off unless GA_CACHE_ENABLED is set, as the recording
+# should have been made with the same setting
+
+# What api_call and the report generators write instead of an analysis
+AI_FAILURES = ("An error occurred during the API call", "Error occurred during API call",
+               "API call did not complete successfully", "No analysis generated", "Not available due to")
+
+def run(cassette_path, time_scale=1.0, results_path=None):
+    os.environ.update(CASSETTE_MODE='replay', CASSETTE_PATH=cassette_path, CASSETTE_TIME_SCALE=str(time_scale))
+    os.environ.setdefault('GA_CACHE_ENABLED', 'false')
+    os.environ.setdefault('GA_WARMUP_ENABLED', 'false')
+    from app.cassette import get_cassette
+    from app.reports import generate_monthly_report, generate_yoy_report
+    generators = {"yoy": generate_yoy_report, "monthly": generate_monthly_report}
+
+    reports = sorted(get_cassette().reports(), key=lambda report: report["at"])
+    if not reports:
+        print(f"No reports recorded in {cassette_path}")
+        return None
+    first = reports[0]["at"]
+    latencies = []
+    errors = []
+
+    def replay(report):
+        delay = (report["at"] - first) * time_scale - (time.perf_counter() - started)
+        if delay > 0:
+            time.sleep(delay)
+        report_started = time.perf_counter()
+        try:
+            result = generators[report["report"]](report["property_id"],
+                                                  datetime.strptime(report["start_date"], '%Y-%m-%d'),
+                                                  datetime.strptime(report["end_date"], '%Y-%m-%d'))
+        except Exception as e:
+            errors.append(f"{report['report']} {report['property_id']}: {str(e)}")
+            return
+        # OpenAI failures end up in the report text rather than raising
+        failure = next((marker for marker in AI_FAILURES if marker in result), None)
+        if failure:
+            errors.append(f"{report['report']} {report['property_id']}: {failure}")
+        else:
+            latencies.append(time.perf_counter() - report_started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(reports)) as executor:
+        list(executor.map(replay, reports))
+    elapsed = time.perf_counter() - started
+
+    results = {"cassette": cassette_path, "time_scale": time_scale, "reports": len(reports),
+               "elapsed": elapsed, "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+               "max": max(latencies, default=0), "errors": len(errors)}
+    print(f"{len(reports)} reports from {cassette_path} at time scale {time_scale}")
+    print(f"  wall {elapsed:.2f}s  p50 {results['p50'] * 1000:.1f} ms  p95 {results['p95'] * 1000:.1f} ms  "
+          f"max {results['max'] * 1000:.1f} ms  errors {len(errors)}")
+    for error in errors[:5]:
+        print(f"  {error}")
+    if results_path:
+        with open(results_path, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    return results
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit("usage: python benchmarks/replay.py CASSETTE [time_scale] [results.json]")
+    run(sys.argv[1], *([float(sys.argv[2])] if len(sys.argv) > 2 else []), *sys.argv[3:4])
@@ -0,0 +1,7 @@
+import statistics
+
+def percentile(values, percent):
+    # Inclusive percentile (1-99) of the samples; fewer than two samples are their own percentile
+    if len(values) < 2:
+        return values[0] if values else 0
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
@@ -0,0 +1,205 @@
+import os
+import sys
+import argparse
+import json
+import platform
+import timeit
+import logging
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.disable(logging.CRITICAL)
+
+# Offline micro-benchmarks of the CPU paths a report goes through once its GA
+# data is cached, compared with stored baselines:
+#   python benchmarks/suite.py [-k filter] [--save] [--threshold 1.3]
+# Each case is timed with timeit (autoranged, best of --repeats) and compared
+# with benchmarks/baselines.json; cases more than --threshold times slower are
+# flagged and make the exit status 1. --save records the current timings as the
+# new baselines, which only compare meaningfully on the machine (and Python)
+# they were recorded on, so re-save after moving the suite to another machine.
+# No network or credentials are needed: GA responses are synthetic, and GA and
+# OpenAI are never called.
+
+os.environ.setdefault('OPENAI_API_KEY', 'sk-benchmark')
+os.environ.setdefault('GA_WARMUP_ENABLED', 'false')
+os.environ['CASSETTE_MODE'] = 'off'
+
+from google.analytics.data_v1beta.types import (DimensionHeader, DimensionValue, MetricHeader, MetricValue,
+                                                RunReportResponse, Row)
+from benchmarks.format_response import make_response
+from app.data_fetcher import build_sections, format_response
+from app.report_specs import TOP_N, get_report_specs
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+START_DATE = datetime(2024, 5, 1)
+END_DATE = datetime(2024, 5, 31)
+
+def spec_response(spec, offset):
+    # TOP_N rows for one report spec, the way GA returns them
+    return RunReportResponse(
+        dimension_headers=[DimensionHeader(name=name) for name in spec.dimensions],
+        metric_headers=[MetricHeader(name=name) for name in spec.metrics],
+        rows=[Row(dimension_values=[DimensionValue(value=f"{name} {i}") for name in spec.dimensions],
+                  metric_values=[MetricValue(value=str((i + 1) * (offset + j + 7) * 13))
+                                 for j in range(len(spec.metrics))])
+              for i in range(TOP_N if spec.dimensions else 1)],
+        row_count=TOP_N if spec.dimensions else 1,
+    )
+
+def period_data(start_date, end_date, offset):
+    # fetch_periods' result for one period, with every registered report filled
+    data = {spec.name: format_response(spec_response(spec, offset)) for spec in get_report_specs().values()}
+    return build_sections(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'), data)
+
+def ai_report():
+    # About the length of a real analysis, umlauts included
+    paragraph = ("Die Sitzungen sind im Vergleich zum Vorjahreszeitraum um 12 % gestiegen, während die "
+                 "Interaktionsrate leicht zurückgegangen ist. Besonders auffällig ist das Wachstum über "
+                 "organische Suche und die höhere Verweildauer auf den Übersichtsseiten. ")
+    return "\n\n".join(f"## Abschnitt {i}\n{paragraph * 4}" for i in range(12))
+
+def format_response_case(row_count, limit=None):
+    def setup():
+        response = make_response(row_count)
+        return lambda: format_response(response, limit=limit)
+    return setup
+
+def prompt_case():
+    from app.openai_call import build_prompt
+    last_year_data = period_data(START_DATE.replace(year=2023), END_DATE.replace(year=2023), 0)
+    current_year_data = period_data(START_DATE, END_DATE, 1)
+    return lambda: build_prompt(last_year_data, current_year_data)
+
+def report_case(report):
+    # The generator with the GA fetch and the OpenAI call answered from memory,
+    # leaving its own string building (log messages are formatted, not emitted)
+    def setup():
+        from app import reports
+        periods = reports.yoy_periods if report == 'yoy' else reports.monthly_periods
+        data = {name: period_data(start_date, end_date, i)
+                for i, (name, start_date, end_date) in enumerate(periods(START_DATE, END_DATE))}
+        analysis = ai_report()
+        generate = reports.generate_yoy_report if report == 'yoy' else reports.generate_monthly_report
+
+        def generate_report():
+            # Patched per call and restored, so the other cases see the real module
+            get_fetcher, api_call = reports.get_fetcher, reports.api_call
+            reports.get_fetcher = lambda: lambda property_id, periods: data
+            reports.api_call = lambda last_data, current_data: analysis
+            try:
+                return generate("250074345", START_DATE, END_DATE)
+            finally:
+                reports.get_fetcher, reports.api_call = get_fetcher, api_call
+        return generate_report
+    return setup
+
+def load_user_case(user_count):
+    def setup():
+        from app import load_user
+        from app.models import users
+        # Made-up accounts ahead of the looked-up one, which is the last
+        for i in range(len(users), user_count):
+            users.setdefault(f"benchmark_user_{i}", {'id': 1000 + i, 'password_hash': ''})
+        user_id = str(list(users.values())[-1]['id'])
+        return lambda: load_user(user_id)
+    return setup
+
+def download_case():
+    from app import app, routes
+    app.config['LOGIN_DISABLED'] = True
+    report = f"Monatlicher Report (Jahresvergleich)\n\nAI Analysis:\n{ai_report()}\n\n"
+
+    def download():
+        # The route drops each report after sending it
+        routes.reports['benchmark'] = report
+        with app.test_request_context('/download_report/benchmark'):
+            response = routes.download_report('benchmark')
+            body = b''.join(response.response)
+            response.close()
+        return body
+    return download
+
+def cases():
+    # (name, setup) pairs; setup returns the function to time
+    return [
+        ("format_response 10 rows", format_response_case(10)),
+        ("format_response 1k rows", format_response_case(1000)),
+        ("format_response 100k rows", format_response_case(100000)),
+        ("format_response 100k rows top 10", format_response_case(100000, TOP_N)),
+        ("api_call prompt", prompt_case),
+        ("yoy report", report_case('yoy')),
+        ("monthly report", report_case('monthly')),
+        ("load_user 1 user", load_user_case(1)),
+        ("load_user 1k users", load_user_case(1000)),
+        ("download_report", download_case),
+    ]
+
+def measure(func, repeats):
+    # Seconds per call, best of the repeats
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeats, number=number)) / number
+
+def machine():
+    return {"python": platform.python_version(), "machine": platform.machine(), "processor": platform.processor(),
+            "system": platform.system()}
+
+def format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 0.001:
+        return f"{seconds * 1000:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+def run(name_filter=None, repeats=5, threshold=1.3, baseline_path=BASELINES_PATH, save=False):
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+    baseline_results = baseline.get("results", {})
+    if baseline and baseline.get("machine") != machine():
+        print(f"Baselines were recorded on {baseline.get('machine')}, comparisons are rough")
+
+    results = {}
+    regressions = []
+    print(f"  {'case':<34} {'baseline':>10} {'current':>10} {'ratio':>6}")
+    for name, setup in cases():
+        if name_filter and name_filter not in name:
+            continue
+        seconds = results[name] = measure(setup(), repeats)
+        previous = baseline_results.get(name)
+        if previous is None:
+            print(f"  {name:<34} {'-':>10} {format_seconds(seconds):>10}")
+            continue
+        ratio = seconds / previous
+        flag = ""
+        if ratio > threshold:
+            flag = "  slower"
+            regressions.append(name)
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        print(f"  {name:<34} {format_seconds(previous):>10} {format_seconds(seconds):>10} {ratio:5.2f}x{flag}")
+
+    if save:
+        # Cases left out by the filter keep their old baselines
+        results = {name: float(f"{seconds:.4g}") for name, seconds in results.items()}
+        baseline = {"machine": machine(), "results": {**baseline_results, **results}}
+        with open(baseline_path, 'w', encoding='utf-8') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print(f"Saved {len(results)} baselines to {baseline_path}")
+    elif regressions:
+        print(f"{len(regressions)} of {len(results)} cases are more than {threshold}x slower than their baseline")
+    return results, regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CPU micro-benchmarks of the report pipeline')
+    parser.add_argument('-k', dest='name_filter', help='Only run cases whose name contains this')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=1.3, help='Ratio to the baseline flagged as slower')
+    parser.add_argument('--baseline', default=BASELINES_PATH)
+    parser.add_argument('--save', action='store_true', help='Store the timings as the new baselines')
+    args = parser.parse_args()
+    results, regressions = run(args.name_filter, args.repeats, args.threshold, args.baseline, args.save)
+    sys.exit(1 if regressions and not args.save else 0)
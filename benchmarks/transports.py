@@ -0,0 +1,94 @@
+import os
+import sys
+import json
+import subprocess
+import threading
+import time
+import logging
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.disable(logging.CRITICAL)
+
+from benchmarks.stats import percentile
+
+# Throughput and latency of the 8-report fetch for each GA transport, against
+# the local stand-in server:
+#   python benchmarks/transports.py [concurrency] [fetches] [transports]
+# e.g. python benchmarks/transports.py 16 400 grpc,rest
+# Each transport runs in its own process with the report cache, quota limiter,
+# single-flight and spec validation off, so every fetch goes over the wire.
+# Channel settings (GA_GRPC_COMPRESSION, GA_MAX_STREAMS_PER_CHANNEL, ...)
+# are passed through from the environment. The stand-in runs in this process
+# and its own CPU time is part of every figure, so compare the rows with each
+# other rather than with production latencies
+
+TRANSPORTS = ('grpc', 'grpc_asyncio', 'rest')
+PERIODS = [("current", datetime(2024, 5, 1), datetime(2024, 5, 31)),
+           ("previous_year", datetime(2023, 5, 1), datetime(2023, 5, 31))]
+
+def run_client(concurrency, fetches):
+    # Child process: the app is configured by the environment the parent set
+    from app.data_fetcher import fetch_periods
+    fetch_periods("0", PERIODS)
+    latencies = []
+    errors = []
+    counter = iter(range(fetches))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            try:
+                # A different property each time, like separate users' reports
+                fetch_periods(str(1000 + i), PERIODS)
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                errors.append(str(e))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(json.dumps({"elapsed": elapsed, "latencies": latencies, "errors": errors[:5], "error_count": len(errors)}))
+
+def run(concurrency=8, fetches=200, transports=TRANSPORTS):
+    from benchmarks.fake_ga_server import FakeGAServer
+    server = FakeGAServer().start()
+    results = {}
+    try:
+        for transport in transports:
+            port = server.http_port if transport == 'rest' else server.grpc_port
+            env = dict(os.environ, GA_TRANSPORT=transport, GA_API_ENDPOINT=f"http://localhost:{port}",
+                       GA_CACHE_ENABLED='false', GA_QUOTA_ENABLED='false', GA_SINGLEFLIGHT_ENABLED='false',
+                       GA_VALIDATE_SPECS='false', GA_HEDGE_REQUESTS='false', GA_WARMUP_ENABLED='false')
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--client', str(concurrency),
+                                     str(fetches)], env=env, stdout=subprocess.PIPE, text=True, check=True).stdout
+            results[transport] = json.loads(output.strip().splitlines()[-1])
+    finally:
+        server.stop()
+
+    print(f"8-report fetch, {fetches} fetches, {concurrency} concurrent")
+    print(f"  {'transport':<14} {'fetches/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for transport, result in results.items():
+        latencies = result["latencies"]
+        if len(latencies) < 2:
+            print(f"  {transport:<14} {'-':>9} {'-':>8} {'-':>8} {result['error_count']:>7}  {result['errors'][:1]}")
+            continue
+        print(f"  {transport:<14} {len(latencies) / result['elapsed']:9.1f} {percentile(latencies, 50) * 1000:8.1f} "
+              f"{percentile(latencies, 99) * 1000:8.1f} {result['error_count']:>7}")
+    return results
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--client']:
+        run_client(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        args = sys.argv[1:]
+        run(*(int(arg) for arg in args[:2]), *([args[2].split(',')] if len(args) > 2 else []))
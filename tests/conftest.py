@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_ga_server import FakeGAServer
+
+# The app reads its settings when it is first imported, so they are set here,
+# before any test module imports it, and the environment is restored when the
+# session ends. GA is the in-process stand-in; every SQLite file goes to a
+# temporary directory
+_environ = dict(os.environ)
+_workdir = tempfile.TemporaryDirectory()
+_fake_ga = FakeGAServer()
+os.environ.update(GA_API_ENDPOINT=f"http://localhost:{_fake_ga.grpc_port}",
+                  GA_CACHE_PATH=os.path.join(_workdir.name, 'ga_cache.sqlite3'),
+                  GA_SINGLEFLIGHT_PATH=os.path.join(_workdir.name, 'ga_flights.sqlite3'),
+                  GA_WARMUP_ENABLED='false', CASSETTE_MODE='off', OPENAI_API_KEY='sk-test')
+
+def pytest_sessionfinish(session):
+    os.environ.clear()
+    os.environ.update(_environ)
+    _workdir.cleanup()
+
+@pytest.fixture(scope='session')
+def fake_ga():
+    _fake_ga.start()
+    yield _fake_ga
+    _fake_ga.stop()
+
+@pytest.fixture
+def no_report_cache(monkeypatch):
+    # Every fetch goes to GA
+    from app import ga_cache
+    monkeypatch.setattr(ga_cache, 'CACHE_ENABLED', False)
+
+@pytest.fixture
+def report_cache(tmp_path, monkeypatch):
+    # An empty report cache of its own for the test
+    from app import ga_cache
+    cache = ga_cache.ReportCache(str(tmp_path / 'ga_cache.sqlite3'))
+    monkeypatch.setattr(ga_cache, 'CACHE_ENABLED', True)
+    monkeypatch.setattr(ga_cache, '_cache', cache)
+    return cache
+
+@pytest.fixture
+def shuffled_ties(fake_ga, monkeypatch):
+    # Like GA, the stand-in then returns rows that tie on every order_by in any order
+    monkeypatch.setitem(fake_ga.api.default, "shuffle_ties", True)
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+from google.analytics.data_v1beta.types import DimensionHeader, RunReportRequest, RunReportResponse
+from google.api_core.exceptions import ServiceUnavailable
+import httpx
+import pytest
+
+from app import cassette as cassette_module
+from app.cassette import (Cassette, CassetteMiss, RecordingGAClient, RecordingTransport, ReplayGAClient,
+                          ReplayTransport)
+
+REQUEST = RunReportRequest(property="properties/123")
+RESPONSE = RunReportResponse(dimension_headers=[DimensionHeader(name="city")], row_count=3)
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    # Replays answer at once
+    monkeypatch.setattr(cassette_module, "TIME_SCALE", 0)
+    return str(tmp_path / 'cassette.jsonl.gz')
+
+class FlakyGAClient:
+    # Fails its first run_report, like an unavailable backend
+    def __init__(self):
+        self.calls = 0
+
+    def run_report(self, request):
+        self.calls += 1
+        if self.calls == 1:
+            raise ServiceUnavailable("backend unavailable")
+        return RESPONSE
+
+def test_ga_calls_replay_in_recorded_order(path):
+    recording = RecordingGAClient(FlakyGAClient(), Cassette(path, 'record'))
+    with pytest.raises(ServiceUnavailable):
+        recording.run_report(REQUEST)
+    assert recording.run_report(REQUEST) == RESPONSE
+
+    replay = ReplayGAClient(Cassette(path, 'replay'))
+    # The quota flag the limiter sets doesn't change which recording answers
+    request = RunReportRequest(REQUEST, return_property_quota=True)
+    with pytest.raises(ServiceUnavailable):
+        replay.run_report(request)
+    assert replay.run_report(request) == RESPONSE
+    # The last recording keeps answering
+    assert replay.run_report(request) == RESPONSE
+    with pytest.raises(CassetteMiss):
+        replay.run_report(RunReportRequest(property="properties/456"))
+
+def openai_handler(request):
+    if request.method == 'POST':
+        return httpx.Response(200, json={"id": "thread_recorded"}, headers={"retry-after-ms": "250"})
+    return httpx.Response(200, json={"data": [], "url": str(request.url.path)})
+
+def test_openai_requests_replay_with_other_object_ids(path):
+    with httpx.Client(transport=RecordingTransport(Cassette(path, 'record'), httpx.MockTransport(openai_handler)),
+                      base_url="https://api.openai.com") as client:
+        assert client.post("/v1/threads", json={}).json() == {"id": "thread_recorded"}
+        client.get("/v1/threads/thread_recorded/messages")
+        client.get("/v1/threads/thread_recorded/runs")
+
+    with httpx.Client(transport=ReplayTransport(Cassette(path, 'replay')),
+                      base_url="https://api.openai.com") as client:
+        created = client.post("/v1/threads", json={})
+        assert created.json() == {"id": "thread_recorded"}
+        # Delays the SDK sleeps on are scaled, but never to a retry-after of 0
+        assert created.headers["retry-after-ms"] == "1"
+        # A replayed run may have other ids; they are matched loosely, then mapped to the recorded ones
+        assert client.get("/v1/threads/thread_replayed/messages").json()["url"] == \
+            "/v1/threads/thread_recorded/messages"
+        assert client.get("/v1/threads/thread_replayed/runs").json()["url"] == "/v1/threads/thread_recorded/runs"
+
+def test_reports_are_recorded_for_replay(path):
+    Cassette(path, 'record').record_report('yoy', 250074345, datetime(2024, 5, 1), datetime(2024, 5, 31))
+    [report] = Cassette(path, 'replay').reports()
+    assert (report["report"], report["property_id"], report["start_date"], report["end_date"]) == \
+        ('yoy', '250074345', '2024-05-01', '2024-05-31')
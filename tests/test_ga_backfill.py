@@ -0,0 +1,18 @@
+from datetime import date
+
+from app.ga_backfill import CHUNK_DAYS, backfill_range, plan_chunks
+from app.ga_store import DailyStore
+
+def test_backfill_range_counts_months_from_yesterday():
+    assert backfill_range(24, today=date(2026, 10, 18)) == (date(2024, 10, 18), date(2026, 10, 17))
+    assert backfill_range(1, today=date(2024, 4, 1)) == (date(2024, 3, 1), date(2024, 3, 31))
+    assert backfill_range(0, today=date(2024, 4, 1)) == (date(2024, 3, 31), date(2024, 3, 31))
+
+def test_plan_chunks_leaves_out_reports_the_store_never_reads(tmp_path):
+    # browser, user_source and city are ordered by the non-additive
+    # totalUsers and devices has no additive metric, so DailyStore.query
+    # always fetches them directly
+    store = DailyStore(str(tmp_path / 'ga_store.sqlite3'))
+    chunks = plan_chunks(store, "123", date(2024, 1, 1), date(2024, 3, 31))
+    assert {chunk[0] for chunk in chunks} == {"overall", "events", "conversion_origin", "page_url"}
+    assert len(chunks) == 4 * -(-91 // CHUNK_DAYS)
@@ -0,0 +1,33 @@
+import csv
+import io
+from datetime import datetime
+
+from app import app
+from app.data_fetcher import stream_report
+
+START_DATE = datetime(2024, 5, 1)
+END_DATE = datetime(2024, 5, 31)
+
+def columnar_rows(page_size):
+    return [page.row(i) for page in stream_report("123", "page_url", START_DATE, END_DATE, page_size, columnar=True)
+            for i in range(len(page))]
+
+def test_columnar_pages_match_one_unpaged_run(shuffled_ties):
+    whole = columnar_rows(100000)
+    assert len(whole) > 37 * 3
+    assert columnar_rows(37) == whole
+
+def test_columnar_rows_match_the_dict_pages(fake_ga):
+    rows = [row for page in stream_report("123", "page_url", START_DATE, END_DATE) for row in page["rows"]]
+    assert [(row["dimensionValues"], [float(value) for value in row["metricValues"]]) for row in rows] == \
+        columnar_rows(100000)
+
+def test_export_command_writes_every_row(shuffled_ties):
+    result = app.test_cli_runner().invoke(args=["ga-export", "--property", "123", "--report", "page_url",
+                                                "--start", "2024-05-01", "--end", "2024-05-31", "--page-size", "37"])
+    assert result.exit_code == 0, result.output
+    header, *rows = list(csv.reader(io.StringIO(result.output)))
+    assert header == ["fullPageUrl", "newUsers", "totalUsers", "screenPageViews", "userEngagementDuration"]
+    whole = columnar_rows(100000)
+    assert len(rows) == len(whole)
+    assert [row[0] for row in rows] == [dimension_values[0] for dimension_values, _ in whole]
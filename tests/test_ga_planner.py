@@ -0,0 +1,103 @@
+from datetime import datetime
+
+from google.analytics.data_v1beta.types import (DateRange, DimensionHeader, DimensionValue, MetricHeader, MetricValue,
+                                                Row, RunReportResponse)
+
+from app.ga_planner import ROLLUP_ROW_LIMIT, plan_reports
+from app.report_specs import DEFAULT_REPORT_SPECS, OTHER_LABEL
+
+SPECS = {spec.name: spec for spec in DEFAULT_REPORT_SPECS}
+CURRENT = ("current", datetime(2024, 5, 1), datetime(2024, 5, 31))
+PREVIOUS = ("previous", datetime(2024, 4, 1), datetime(2024, 4, 30))
+
+def make_response(dimension_names, metric_names, rows, totals=(), row_count=None):
+    # rows and totals: (dimension values, metric values)
+    def make_row(dimension_values, metric_values):
+        return Row(dimension_values=[DimensionValue(value=value) for value in dimension_values],
+                   metric_values=[MetricValue(value=str(value)) for value in metric_values])
+    return RunReportResponse(
+        dimension_headers=[DimensionHeader(name=name) for name in dimension_names],
+        metric_headers=[MetricHeader(name=name) for name in metric_names],
+        rows=[make_row(*row) for row in rows],
+        totals=[make_row(*row) for row in totals],
+        row_count=len(rows) if row_count is None else row_count,
+    )
+
+def plan_shape(plan):
+    return {planned.name: ([spec.name for spec in planned.members], [spec.name for spec in planned.rollups],
+                           [spec.name for spec in planned.totals])
+            for planned in plan}
+
+def test_default_specs_share_requests():
+    plan = plan_reports(DEFAULT_REPORT_SPECS)
+    assert plan_shape(plan) == {
+        "browser+overall": (["browser"], [], ["overall"]),
+        "devices": (["devices"], [], []),
+        "user_source": (["user_source"], [], []),
+        "city": (["city"], [], []),
+        "conversion_origin+events": (["conversion_origin"], ["events"], []),
+        "page_url": (["page_url"], [], []),
+    }
+    hosts = {planned.name: planned.host for planned in plan}
+    # The rollup host fetches enough rows to aggregate; the totals host asks for TOTAL
+    assert hosts["conversion_origin+events"].limit == ROLLUP_ROW_LIMIT
+    assert hosts["browser+overall"].other_bucket
+    assert set(hosts["browser+overall"].metrics) == set(SPECS["browser"].metrics) | set(SPECS["overall"].metrics)
+
+def test_rollup_sums_host_rows_per_period():
+    [planned] = plan_reports([SPECS["events"], SPECS["conversion_origin"]])
+    response = make_response(["eventName", "city", "dateRange"], ["conversions"], [
+        (["purchase", "Berlin", "current"], [5]),
+        (["form_submit", "Berlin", "current"], [4]),
+        (["purchase", "Hamburg", "current"], [3]),
+        (["purchase", "Berlin", "previous"], [1]),
+    ])
+    data = planned.split(response, ["current", "previous"])
+    assert data["current"]["events"]["rows"] == [
+        {"dimensionValues": ["purchase"], "metricValues": ["8"]},
+        {"dimensionValues": ["form_submit"], "metricValues": ["4"]},
+    ]
+    assert data["previous"]["events"]["rows"] == [{"dimensionValues": ["purchase"], "metricValues": ["1"]}]
+    assert [row["dimensionValues"] for row in data["current"]["conversion_origin"]["rows"]] == \
+        [["purchase", "Berlin"], ["form_submit", "Berlin"], ["purchase", "Hamburg"]]
+
+def test_truncated_response_leaves_rollups_and_short_periods_out():
+    [planned] = plan_reports([SPECS["events"], SPECS["conversion_origin"]])
+    rows = [([f"event_{i}", "Berlin", "current"], [100 - i]) for i in range(12)] + \
+        [(["purchase", "Berlin", "previous"], [1])]
+    data = planned.split(make_response(["eventName", "city", "dateRange"], ["conversions"], rows, row_count=50),
+                         ["current", "previous"])
+    # The previous period may have been crowded out, so it is refetched on its own
+    assert list(data) == ["current"]
+    assert data["current"]["events"] is None
+    assert len(data["current"]["conversion_origin"]["rows"]) == SPECS["conversion_origin"].limit
+
+def test_totals_and_other_bucket_come_from_the_total_row():
+    [planned] = plan_reports([SPECS["browser"], SPECS["overall"]])
+    metric_names = list(planned.host.metrics)
+    rows = [([f"browser_{i}"], [100 + i] * len(metric_names)) for i in range(12)]
+    total = [10000 + i for i in range(len(metric_names))]
+    data = planned.split(make_response(["browser"], metric_names, rows, totals=[(["RESERVED_TOTAL"], total)]),
+                         ["current"])["current"]
+    assert data["overall"] == {"metricHeaders": list(SPECS["overall"].metrics),
+                               "rows": [{"dimensionValues": [],
+                                         "metricValues": [str(total[metric_names.index(name)])
+                                                          for name in SPECS["overall"].metrics]}]}
+    # browser has no other bucket of its own, whatever its host asks for
+    assert len(data["browser"]["rows"]) == SPECS["browser"].limit
+    assert OTHER_LABEL not in data["browser"]["rows"][-1]["dimensionValues"]
+
+def test_planned_fetch_answers_every_report_with_fewer_requests(fake_ga, no_report_cache):
+    from app.data_fetcher import run_reports
+    from app.ga_client import get_client_pool
+    date_ranges = [DateRange(start_date=start.strftime('%Y-%m-%d'), end_date=end.strftime('%Y-%m-%d'), name=name)
+                   for name, start, end in (CURRENT, PREVIOUS)]
+    with get_client_pool().client() as client:
+        calls = fake_ga.api.stats["RunReport"]
+        data = run_reports(client, "123", date_ranges, batched=False, planned=True)
+        planned_calls = fake_ga.api.stats["RunReport"] - calls
+        run_reports(client, "123", date_ranges, batched=False, planned=False)
+        unplanned_calls = fake_ga.api.stats["RunReport"] - calls - planned_calls
+    assert set(data) == set(SPECS)
+    assert all(set(periods) == {"current", "previous"} for periods in data.values())
+    assert planned_calls == len(plan_reports(DEFAULT_REPORT_SPECS)) < unplanned_calls == len(SPECS)
@@ -0,0 +1,68 @@
+from google.analytics.data_v1beta.types import PropertyQuota, QuotaStatus, RunReportRequest, RunReportResponse
+import pytest
+
+from app import ga_quota
+from app.ga_quota import INITIAL_CONCURRENCY, RESERVE_TOKENS, QuotaLimiter
+
+PROPERTY = "properties/123"
+
+@pytest.fixture
+def limiter(tmp_path):
+    return QuotaLimiter(str(tmp_path / 'ga_quota.sqlite3'))
+
+def quota_response(**quotas):
+    return RunReportResponse(property_quota=PropertyQuota(
+        **{name: QuotaStatus(consumed=consumed, remaining=remaining) for name, (consumed, remaining) in quotas.items()}))
+
+def take_all(limiter):
+    leases = []
+    while True:
+        lease_id, wait = limiter.try_acquire(PROPERTY)
+        if lease_id is None:
+            return leases, wait
+        leases.append(lease_id)
+
+def test_slots_are_limited_to_the_concurrency(limiter):
+    leases, wait = take_all(limiter)
+    assert len(leases) == int(INITIAL_CONCURRENCY)
+    assert wait == 0
+    limiter.release(leases[0], PROPERTY)
+    assert limiter.try_acquire(PROPERTY)[0] is not None
+    assert limiter.status()[PROPERTY]["in_flight"] == len(leases)
+
+def test_successes_raise_the_limit_up_to_the_reported_maximum(limiter):
+    lease_id, _ = limiter.try_acquire(PROPERTY)
+    limiter.release(lease_id, PROPERTY, RunReportResponse())
+    assert limiter.status()[PROPERTY]["concurrency"] == INITIAL_CONCURRENCY + 1 / INITIAL_CONCURRENCY
+    for _ in range(50):
+        lease_id, _ = limiter.try_acquire(PROPERTY)
+        limiter.release(lease_id, PROPERTY, quota_response(concurrent_requests=(1, 5)))
+    assert limiter.status()[PROPERTY]["concurrency"] == 6
+
+def test_exhausted_halves_the_limit_and_pauses(limiter):
+    limiter.exhausted(PROPERTY, 0)
+    status = limiter.status()[PROPERTY]
+    assert status["concurrency"] == INITIAL_CONCURRENCY / 2
+    assert 0 < status["paused_for"] <= 1
+    lease_id, wait = limiter.try_acquire(PROPERTY)
+    assert lease_id is None and 0 < wait <= 1
+
+def test_low_daily_tokens_pause_until_the_quota_day_resets(limiter):
+    lease_id, _ = limiter.try_acquire(PROPERTY)
+    limiter.release(lease_id, PROPERTY, quota_response(tokens_per_day=(24950, RESERVE_TOKENS - 1)))
+    status = limiter.status()[PROPERTY]
+    assert status["tokens_per_day"] == RESERVE_TOKENS - 1
+    now = ga_quota.time.time()
+    assert status["paused_for"] == pytest.approx(ga_quota.next_quota_day(now) - now, abs=5)
+
+def test_leases_of_crashed_workers_time_out(limiter, monkeypatch):
+    take_all(limiter)
+    monkeypatch.setattr(ga_quota, "LEASE_TIMEOUT_SECONDS", -1)
+    assert limiter.try_acquire(PROPERTY)[0] is not None
+
+def test_failed_calls_release_their_lease(limiter):
+    def method(request):
+        raise ValueError("broken request")
+    with pytest.raises(ValueError):
+        limiter.call(method, RunReportRequest(property=PROPERTY))
+    assert limiter.status()[PROPERTY]["in_flight"] == 0
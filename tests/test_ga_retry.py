@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core.exceptions import GatewayTimeout, InvalidArgument, ServiceUnavailable
+import pytest
+
+from app import ga_retry
+
+KEY = "browser"
+HEDGE_AFTER = 0.05
+
+@pytest.fixture
+def hedging(monkeypatch):
+    # Enough recorded latencies of HEDGE_AFTER for calls to hedge after it
+    tracker = ga_retry.LatencyTracker()
+    for _ in range(ga_retry.HEDGE_MIN_SAMPLES):
+        tracker.record(KEY, HEDGE_AFTER)
+    monkeypatch.setattr(ga_retry, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(ga_retry, "latencies", tracker)
+    return tracker
+
+@pytest.fixture
+def release():
+    # Unblocks stalled attempts once the test is done with them
+    event = threading.Event()
+    yield event
+    event.set()
+
+def attempts(*results):
+    # A call whose nth invocation waits for its event (or the time) and then
+    # returns or raises its result
+    started = []
+
+    def call():
+        wait, result = results[len(started)]
+        started.append(time.perf_counter())
+        if isinstance(wait, threading.Event):
+            wait.wait(5)
+        else:
+            time.sleep(wait)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return call, started
+
+def test_fast_call_is_not_hedged(hedging):
+    call, started = attempts((0, "first"))
+    assert ga_retry.hedged(KEY, call) == "first"
+    assert len(started) == 1
+
+def test_stalled_call_is_hedged_after_the_percentile(hedging, release):
+    call, started = attempts((release, "first"), (0, "hedge"))
+    assert ga_retry.hedged(KEY, call) == "hedge"
+    assert len(started) == 2
+    assert started[1] - started[0] >= HEDGE_AFTER
+
+def test_failed_hedge_waits_for_the_first_attempt(hedging):
+    call, started = attempts((3 * HEDGE_AFTER, "first"), (0, ValueError("hedge failed")))
+    assert ga_retry.hedged(KEY, call) == "first"
+    assert len(started) == 2
+
+def test_hedge_delay_counts_from_the_attempts_start(hedging, monkeypatch):
+    # The only attempt worker is busy for longer than the hedge delay
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(ga_retry, "_attempt_executor", executor)
+    busy = executor.submit(time.sleep, 4 * HEDGE_AFTER)
+    call, started = attempts((0, "first"))
+    try:
+        assert ga_retry.hedged(KEY, call) == "first"
+        assert busy.done()
+        assert len(started) == 1
+    finally:
+        executor.shutdown()
+
+def test_queued_hedge_is_cancelled_when_the_first_attempt_wins(hedging, monkeypatch, release):
+    # The only hedge worker is blocked, so the hedge stays queued
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(ga_retry, "_hedge_executor", executor)
+    executor.submit(release.wait, 5)
+    call, started = attempts((2 * HEDGE_AFTER, "first"), (0, "hedge"))
+    try:
+        assert ga_retry.hedged(KEY, call) == "first"
+    finally:
+        release.set()
+        executor.shutdown()
+    assert len(started) == 1
+
+def test_async_hedge_cancels_the_slower_attempt(hedging):
+    started, cancelled = [], []
+
+    async def call():
+        started.append(time.perf_counter())
+        if len(started) == 2:
+            return "hedge"
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "first"
+
+    async def run():
+        result = await ga_retry.hedged_async(KEY, call)
+        # Let the cancellation reach the first attempt
+        await asyncio.sleep(0)
+        return result
+    assert asyncio.run(run()) == "hedge"
+    assert len(started) == 2
+    assert cancelled == [True]
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    # Retries without sleeping, and the calls go straight to the method
+    delays = []
+    monkeypatch.setattr(ga_retry, "backoff_delay", lambda attempt: delays.append(attempt) or 0)
+    monkeypatch.setattr(ga_retry, "run_with_quota", lambda method, request: method(request))
+    return delays
+
+def failing(*errors):
+    # A method raising the given errors in turn and then succeeding
+    calls = []
+
+    def method(request):
+        calls.append(request)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "response"
+    return method, calls
+
+def test_transient_errors_are_retried_with_backoff(no_backoff):
+    method, calls = failing(ServiceUnavailable("unavailable"), GatewayTimeout("deadline exceeded"))
+    assert ga_retry.call_with_retry(method, "request", KEY) == "response"
+    assert len(calls) == 3
+    assert no_backoff == [0, 1]
+
+def test_retries_give_up_after_max_retries(no_backoff):
+    method, calls = failing(*[ServiceUnavailable("unavailable")] * (ga_retry.MAX_RETRIES + 1))
+    with pytest.raises(ServiceUnavailable):
+        ga_retry.call_with_retry(method, "request", KEY)
+    assert len(calls) == ga_retry.MAX_RETRIES + 1
+
+def test_other_errors_are_not_retried(no_backoff):
+    method, calls = failing(InvalidArgument("bad dimension"))
+    with pytest.raises(InvalidArgument):
+        ga_retry.call_with_retry(method, "request", KEY)
+    assert len(calls) == 1
+    assert no_backoff == []
+
+def test_backoff_is_capped_full_jitter():
+    for attempt in range(12):
+        delay = ga_retry.backoff_delay(attempt)
+        assert 0 <= delay <= min(ga_retry.BACKOFF_MAX_SECONDS, ga_retry.BACKOFF_BASE_SECONDS * 2 ** attempt)
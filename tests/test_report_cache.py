@@ -0,0 +1,88 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+CURRENT = ("current", datetime(2024, 5, 1), datetime(2024, 5, 31))
+PREVIOUS = ("previous", datetime(2024, 4, 1), datetime(2024, 4, 30))
+
+@pytest.fixture
+def slow_ga(fake_ga, monkeypatch):
+    # Long enough for concurrent callers to overlap
+    monkeypatch.setitem(fake_ga.api.default, "latency", {**fake_ga.api.default["latency"], "distribution": "fixed",
+                                                         "median_ms": 50})
+    return fake_ga
+
+def test_concurrent_async_fetches_share_the_cold_ranges(slow_ga, report_cache):
+    from app.data_fetcher import fetch_periods_async
+    from app.ga_planner import get_plan
+
+    async def fetch_all():
+        # The period order differs, so the requests aren't coalesced as identical
+        return await asyncio.gather(*[fetch_periods_async("123", [CURRENT, PREVIOUS] if i % 2 else [PREVIOUS, CURRENT])
+                                      for i in range(8)])
+    calls = slow_ga.api.stats["RunReport"]
+    results = asyncio.run(fetch_all())
+    # One request per planned report covers both ranges; everyone else waits and reads the cache
+    assert slow_ga.api.stats["RunReport"] - calls == len(get_plan())
+    assert all(result == results[0] for result in results)
+    assert not report_cache._locks
+
+def cache_request(*date_ranges, limit=None):
+    from google.analytics.data_v1beta.types import DateRange
+    from app.report_specs import get_report_specs
+    spec = get_report_specs()["page_url"]
+    request = spec.build_request("123", [DateRange(start_date=start, end_date=end, name=name)
+                                         for name, start, end in date_ranges])
+    if limit is not None:
+        request.limit = limit
+    return request
+
+OLD = ("old", "2024-05-01", "2024-05-31")
+RECENT = ("recent", (date.today() - timedelta(days=6)).isoformat(), date.today().isoformat())
+
+def test_cached_ranges_are_reused_across_requests(report_cache):
+    report_cache.store(cache_request(OLD), {"old": {"rows": ["may"]}})
+    # The same range under another period name and row limit is a hit
+    hits, missing = report_cache.split(cache_request(("last_year", *OLD[1:]), RECENT, limit=7))
+    assert hits == {"last_year": {"rows": ["may"]}}
+    assert [date_range.name for date_range in missing.date_ranges] == ["recent"]
+    assert missing.limit == 7
+
+def test_only_ranges_with_unfinished_days_expire(report_cache, monkeypatch):
+    from app import ga_cache
+    report_cache.store(cache_request(OLD, RECENT), {"old": {"rows": ["may"]}, "recent": {"rows": ["week"]}})
+    later = time.time() + ga_cache.RECENT_TTL_SECONDS + 1
+    monkeypatch.setattr(ga_cache, "time", SimpleNamespace(time=lambda: later))
+    hits, missing = report_cache.split(cache_request(OLD, RECENT))
+    assert list(hits) == ["old"]
+    assert [date_range.name for date_range in missing.date_ranges] == ["recent"]
+    report_cache.purge_expired()
+    assert report_cache._connect().execute("SELECT COUNT(*) FROM ga_report_cache").fetchone()[0] == 1
+
+def test_keep_until_extends_recent_entries(report_cache, monkeypatch):
+    from app import ga_cache
+    report_cache.store(cache_request(RECENT), {"recent": {"rows": ["week"]}})
+    until = time.time() + 86400
+    report_cache.keep_until("properties/123", [RECENT[1:]], until)
+    monkeypatch.setattr(ga_cache, "time", SimpleNamespace(time=lambda: until - 1))
+    assert report_cache.split(cache_request(RECENT)) == ({"recent": {"rows": ["week"]}}, None)
+
+def test_concurrent_fetches_fill_a_cold_range_once(report_cache):
+    fetched = []
+
+    def fetch(missing):
+        fetched.append(sorted(missing))
+        time.sleep(0.05)
+        return {name: {date_range.name: {"rows": [name]} for date_range in request.date_ranges}
+                for name, request in missing.items()}
+    requests = {"page_url": cache_request(OLD)}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: report_cache.fetch_many(requests, fetch), range(8)))
+    assert fetched == [["page_url"]]
+    assert all(result == {"page_url": {"old": {"rows": ["page_url"]}}} for result in results)
+    # Locks are dropped once nobody holds or waits for them
+    assert not report_cache._locks
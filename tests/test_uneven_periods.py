@@ -0,0 +1,24 @@
+from datetime import datetime
+
+import pytest
+
+LONG = ("long", datetime(2024, 5, 1), datetime(2024, 5, 31))
+SHORT = ("short", datetime(2024, 6, 1), datetime(2024, 6, 2))
+
+@pytest.fixture
+def fetch_periods(fake_ga, no_report_cache):
+    from app.data_fetcher import fetch_periods
+    return fetch_periods
+
+def test_quiet_period_is_not_crowded_out(fetch_periods):
+    # GA applies the row limit across all DateRanges of a request; the 2-day
+    # period must still get its full top rows next to the 31-day one
+    both = fetch_periods("123", [LONG, SHORT])
+    alone = fetch_periods("123", [SHORT])["short"]
+    assert both["short"] == alone
+    assert len(alone["Top Seiten"]["rows"]) == 11
+    assert len(alone["Besucher Quellen"]["rows"]) == 11
+
+def test_busy_period_unchanged(fetch_periods):
+    both = fetch_periods("123", [LONG, SHORT])
+    assert both["long"] == fetch_periods("123", [LONG])["long"]